@@ -0,0 +1,123 @@
+""" Activation offloading
+
+Moves the activations autograd saves for backward to pinned host memory during the forward pass and copies them
+back, one layer ahead, during the backward pass. Trades PCIe bandwidth for device memory w/o recomputation.
+"""
+from functools import partial
+from typing import Dict, List, Optional, Sequence, Union
+
+import torch
+
+_OFFLOAD_STREAMS: Dict[torch.device, torch.cuda.Stream] = {}
+
+
+def parse_layer_selection(layers: Union[bool, str, Sequence[int], None], num_layers: int) -> List[int]:
+    """ Parse a layer selection into sorted layer indices.
+
+    * True / 'all': every layer, False / None / 'none': no layer
+    * 'every:N': every N-th layer, starting w/ the first
+    * 'first:K' / 'last:K': the first / last K layers
+    * a sequence of layer indices, or the same comma separated
+    """
+    if layers is None or layers is False or layers == 'none':
+        return []
+    if layers is True or layers == 'all':
+        return list(range(num_layers))
+    if isinstance(layers, str):
+        mode, _, value = layers.partition(':')
+        try:
+            if mode == 'every' and int(value) > 0:
+                return list(range(0, num_layers, int(value)))
+            if mode == 'first' and int(value) >= 0:
+                return list(range(min(int(value), num_layers)))
+            if mode == 'last' and int(value) >= 0:
+                return list(range(max(num_layers - int(value), 0), num_layers))
+            if not value:
+                layers = [int(i) for i in mode.split(',')]
+        except ValueError:
+            pass
+        if isinstance(layers, str):
+            raise ValueError(
+                f'Unknown layer selection {layers}, expected all, every:N, first:K, last:K or layer indices.')
+    layers = sorted(set(int(i) for i in layers))
+    assert all(0 <= i < num_layers for i in layers), f'layer indices must be in [0, {num_layers})'
+    return layers
+
+
+def _offload_stream(device: torch.device) -> torch.cuda.Stream:
+    if device not in _OFFLOAD_STREAMS:
+        _OFFLOAD_STREAMS[device] = torch.cuda.Stream(device)
+    return _OFFLOAD_STREAMS[device]
+
+
+class _OffloadSlot:
+    def __init__(self, cpu: torch.Tensor, device: torch.device):
+        self.cpu = cpu
+        self.device = device
+        self.prefetched: Optional[torch.Tensor] = None
+        self.event: Optional[torch.cuda.Event] = None
+
+
+class ActivationOffload:
+    """ Offload the tensors saved for backward by the wrapped layers to pinned host memory.
+
+    Create one instance per forward pass and run each offloaded layer in `with offload.layer(idx):`. When the
+    backward pass first unpacks a tensor of a layer, the tensors of the previous offloaded layer (needed next)
+    are prefetched on a side stream. Only CUDA activations of at least `min_numel` elements are offloaded,
+    parameters and other leaf tensors stay in place, so this is a no-op on CPU.
+    """
+
+    def __init__(self, min_numel: int = 2 ** 14):
+        self.min_numel = min_numel
+        self.slots: Dict[int, List[_OffloadSlot]] = {}
+        self.prefetched = set()
+
+    def layer(self, idx: int):
+        return torch.autograd.graph.saved_tensors_hooks(partial(self._pack, idx), self._unpack)
+
+    def _pack(self, idx: int, x: torch.Tensor):
+        if not x.is_cuda or x.grad_fn is None or x.numel() < self.min_numel:
+            return x
+        stream = _offload_stream(x.device)
+        stream.wait_stream(torch.cuda.current_stream(x.device))
+        cpu = torch.empty(x.size(), dtype=x.dtype, layout=x.layout, pin_memory=True)
+        with torch.cuda.stream(stream):
+            cpu.copy_(x, non_blocking=True)
+        # the caching allocator must not reuse the device memory before the copy is done
+        x.record_stream(stream)
+        slot = _OffloadSlot(cpu, x.device)
+        self.slots.setdefault(idx, []).append(slot)
+        return idx, slot
+
+    def _prefetch(self, idx: int):
+        if idx in self.prefetched or idx not in self.slots:
+            return
+        self.prefetched.add(idx)
+        slots = self.slots[idx]
+        stream = _offload_stream(slots[0].device)
+        stream.wait_stream(torch.cuda.current_stream(slots[0].device))
+        with torch.cuda.stream(stream):
+            event = torch.cuda.Event()
+            for slot in slots:
+                slot.prefetched = slot.cpu.to(slot.device, non_blocking=True)
+                slot.event = event
+            event.record(stream)
+
+    def _unpack(self, packed):
+        if isinstance(packed, torch.Tensor):
+            return packed
+        idx, slot = packed
+        self._prefetch(idx)
+        previous = [i for i in self.slots if i < idx]
+        if previous:
+            self._prefetch(max(previous))
+
+        current = torch.cuda.current_stream(slot.device)
+        if slot.prefetched is None:
+            # unpacked again (retain_graph), copy back synchronously
+            current.wait_stream(_offload_stream(slot.device))
+            return slot.cpu.to(slot.device, non_blocking=True)
+        current.wait_event(slot.event)
+        x, slot.prefetched = slot.prefetched, None
+        x.record_stream(current)
+        return x
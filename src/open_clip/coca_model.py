@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Optional, Sequence, Union
 
 import torch
 from torch import nn
@@ -11,8 +11,9 @@ from .transformer import (
     LayerNorm,
     QuickGELU,
     MultimodalTransformer,
+    TextTransformer,
 )
-from .model import CLIPTextCfg, CLIPVisionCfg, _build_vision_tower, _build_text_tower
+from .model import CLIPTextCfg, CLIPVisionCfg, _build_vision_tower, _build_text_tower, _set_activation_offload
 
 try:
     from transformers import (
@@ -71,6 +72,7 @@ def _build_text_decoder_tower(
         output_dim=embed_dim,
         act_layer=act_layer,
         norm_layer=norm_layer,
+        batch_first=multimodal_cfg.batch_first,
     )
 
     return decoder
@@ -131,11 +133,17 @@ class CoCa(nn.Module):
         self.context_length = multimodal_cfg.context_length
 
     @torch.jit.ignore
-    def set_grad_checkpointing(self, enable: bool = True):
+    def set_grad_checkpointing(self, enable: Union[bool, str] = True):
         self.visual.set_grad_checkpointing(enable)
         self.text.set_grad_checkpointing(enable)
         self.text_decoder.set_grad_checkpointing(enable)
 
+    @torch.jit.ignore
+    def set_activation_offload(self, layers: Union[bool, str, Sequence[int]] = True):
+        _set_activation_offload(self.visual, layers)
+        _set_activation_offload(self.text, layers)
+        self.text_decoder.set_activation_offload(layers)
+
     def _encode_image(self, images, normalize: bool = True):
         image_latent, tokens_embs = self.visual(images)
         image_latent = F.normalize(image_latent, dim=-1) if normalize else image_latent
@@ -184,6 +192,23 @@ class CoCa(nn.Module):
             out_dict["logit_bias"] = self.logit_bias
         return out_dict
 
+    def _supports_kv_cache(self):
+        return isinstance(self.text, TextTransformer) and self.text.supports_kv_cache()
+
+    def _forward_cached(self, text, image_embs, kv_cache):
+        """ Decoder logits for `text`, the tokens appended since the previous call w/ the same `kv_cache` """
+        offset = kv_cache.get('offset', 0)
+        token_embs = self.text.forward_cached(text, kv_cache.setdefault('text', []), offset=offset)
+        logits = self.text_decoder.forward_cached(
+            image_embs,
+            token_embs,
+            kv_cache.setdefault('decoder', []),
+            kv_cache.setdefault('decoder_cross', []),
+            offset=offset,
+        )
+        kv_cache['offset'] = offset + text.shape[1]
+        return logits
+
     def generate(
         self,
         image,
@@ -202,7 +227,8 @@ class CoCa(nn.Module):
         min_seq_len=5,
         stopping_criteria=None,
         repetition_penalty=1.0,
-        fixed_output_length=False # if True output.shape == (batch_size, seq_len)
+        fixed_output_length=False, # if True output.shape == (batch_size, seq_len)
+        use_cache=True, # if True only the newest token is run through the towers each step (KV cache)
     ):
         # taking many ideas and components from HuggingFace GenerationMixin
         # https://huggingface.co/docs/transformers/main/en/main_classes/text_generation
@@ -240,6 +266,7 @@ class CoCa(nn.Module):
                     min_seq_len=min_seq_len,
                     stopping_criteria=stopping_criteria,
                     logit_processor=logit_processor,
+                    use_cache=use_cache,
                 )
                 if fixed_output_length and output.shape[1] < seq_len:
                     return torch.cat(
@@ -272,11 +299,18 @@ class CoCa(nn.Module):
             cur_len = text.shape[1]
             self.eval()
             out = text
+            kv_cache = {} if use_cache and self._supports_kv_cache() else None
 
             while True:
                 x = out[:, -max_seq_len:]
                 cur_len = x.shape[1]
-                logits = self(image, x, image_latent=image_latent, image_embs=image_embs)["logits"][:, -1]
+                if kv_cache is not None and out.shape[1] > max_seq_len:
+                    # positions shift once the window slides past max_seq_len, recompute in full from here on
+                    kv_cache = None
+                if kv_cache is not None:
+                    logits = self._forward_cached(out[:, kv_cache.get('offset', 0):], image_embs, kv_cache)[:, -1]
+                else:
+                    logits = self(image, x, image_latent=image_latent, image_embs=image_embs)["logits"][:, -1]
                 mask = (out[:, -1] == eos_token_id) | (out[:, -1] == pad_token_id)
                 sample = torch.ones((out.shape[0], 1), device=device, dtype=torch.long) * pad_token_id
 
@@ -319,6 +353,7 @@ class CoCa(nn.Module):
             stopping_criteria=None,
             logit_processor=None,
             logit_warper=None,
+            use_cache=True,
     ):
         device = image_inputs.device
         batch_size = image_inputs.shape[0]
@@ -357,6 +392,7 @@ class CoCa(nn.Module):
         # the same group don't produce same tokens everytime.
         beam_scores[:, ::num_sub_beams] = 0
         beam_scores = beam_scores.view((batch_size * num_beams,))
+        kv_cache = {} if use_cache and self._supports_kv_cache() else None
 
         while True:
 
@@ -367,13 +403,17 @@ class CoCa(nn.Module):
             reordering_indices = torch.zeros(batch_size * num_beams, dtype=torch.long, device=device)
 
             # do one decoder step on all beams of all sentences in batch
-            model_inputs = prepare_inputs_for_generation(input_ids=input_ids, image_inputs=image_inputs)
-            outputs = self(
-                model_inputs['images'],
-                model_inputs['text'],
-                image_latent=image_latent,
-                image_embs=image_embs
-            )
+            if kv_cache is not None:
+                outputs = {'logits': self._forward_cached(
+                    input_ids[:, kv_cache.get('offset', 0):], image_embs, kv_cache)}
+            else:
+                model_inputs = prepare_inputs_for_generation(input_ids=input_ids, image_inputs=image_inputs)
+                outputs = self(
+                    model_inputs['images'],
+                    model_inputs['text'],
+                    image_latent=image_latent,
+                    image_embs=image_embs
+                )
 
             for beam_group_idx in range(num_beam_groups):
                 group_start_idx = beam_group_idx * num_sub_beams
@@ -436,6 +476,8 @@ class CoCa(nn.Module):
                 )
 
             input_ids = torch.cat([input_ids, current_tokens.unsqueeze(-1)], dim=-1)
+            if kv_cache is not None:
+                _reorder_kv_cache(kv_cache, reordering_indices)
 
             # increase cur_len
             cur_len = cur_len + 1
@@ -456,6 +498,13 @@ class CoCa(nn.Module):
         return sequence_outputs['sequences']
 
 
+def _reorder_kv_cache(kv_cache, beam_idx):
+    # the cross-attention caches are left alone, beams are only reordered within the same (repeated) image
+    for layer_cache in kv_cache['text'] + kv_cache['decoder']:
+        layer_cache['k'] = layer_cache['k'].index_select(0, beam_idx)
+        layer_cache['v'] = layer_cache['v'].index_select(0, beam_idx)
+
+
 def prepare_inputs_for_generation(input_ids, image_inputs, past=None, **kwargs):
     if past:
         input_ids = input_ids[:, -1].unsqueeze(-1)
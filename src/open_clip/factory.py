@@ -340,6 +340,7 @@ def create_loss(args):
             rank=args.rank,
             world_size=args.world_size,
             use_horovod=args.horovod,
+            chunk_size=args.loss_chunk_size,
         )
     elif args.siglip:
         assert not args.horovod, "Horovod not currently supported for SigLip"
@@ -354,6 +355,7 @@ def create_loss(args):
         rank=args.rank,
         world_size=args.world_size,
         use_horovod=args.horovod,
+        chunk_size=args.loss_chunk_size,
     )
 
 
@@ -376,6 +378,7 @@ def create_model_and_transforms(
         pretrained_hf: bool = True,
         cache_dir: Optional[str] = None,
         output_dict: Optional[bool] = None,
+        uint8_output: bool = False,
         **model_kwargs,
 ):
     force_preprocess_cfg = merge_preprocess_kwargs(
@@ -401,14 +404,17 @@ def create_model_and_transforms(
 
     pp_cfg = PreprocessCfg(**model.visual.preprocess_cfg)
 
+    # w/ uint8_output, the transforms output uint8 images, normalized by get_uint8_normalize(transform) per batch
     preprocess_train = image_transform_v2(
         pp_cfg,
         is_train=True,
         aug_cfg=aug_cfg,
+        uint8_output=uint8_output,
     )
     preprocess_val = image_transform_v2(
         pp_cfg,
         is_train=False,
+        uint8_output=uint8_output,
     )
 
     return model, preprocess_train, preprocess_val
@@ -0,0 +1,297 @@
+""" Continuous batching caption generation for CoCa models.
+
+`CaptionEngine` keeps one running batch of captions. Every `step()` decodes one token for all active rows w/ the
+key / value caches used by `CoCa.generate`, evicts finished rows right away and admits waiting images into the freed
+slots, so the batch is not held back by its longest caption. `AsyncCaptionServer` is a small asyncio front-end that
+drives the engine from a background task.
+"""
+import asyncio
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import torch
+import torch.nn.functional as F
+
+from .coca_model import GENERATION_TYPES, _has_transformers
+
+
+def _pad_left(t: torch.Tensor, size: int):
+    # cached keys / values are [N, heads, S, head_dim], pad the sequence dim in front
+    return F.pad(t, (0, 0, size, 0)) if size else t
+
+
+class CaptionEngine:
+    """ Continuous batching generation w/ the sampling (`top_k` / `top_p`) path of `CoCa.generate`.
+
+    Rows of the running batch are at different positions. Each row's cached keys / values are right aligned in
+    the shared cache, the columns in front of a row's first token are masked out.
+    """
+
+    def __init__(
+            self,
+            model,
+            max_batch_size: int = 16,
+            seq_len: int = 30,
+            generation_type: str = 'top_k',
+            top_k: int = 1,
+            top_p: float = 0.1,
+            temperature: float = 1.,
+            min_seq_len: int = 5,
+            repetition_penalty: float = 1.0,
+            pad_token_id: Optional[int] = None,
+            eos_token_id: Optional[int] = None,
+            sot_token_id: Optional[int] = None,
+    ):
+        assert _has_transformers, "Please install transformers for generate functionality. `pip install transformers`."
+        assert generation_type in ('top_k', 'top_p'), 'Continuous batching supports the top_k / top_p sampling only.'
+        assert model._supports_kv_cache(), 'Continuous batching requires a text tower w/ key / value cache support.'
+        assert seq_len > min_seq_len, "seq_len must be larger than min_seq_len"
+        self.model = model.eval()
+        self.device = next(model.parameters()).device
+        self.max_batch_size = max_batch_size
+        self.seq_len = seq_len
+        self.min_seq_len = min_seq_len
+        self.temperature = temperature
+        self.repetition_penalty = repetition_penalty
+        self.sot_token_id = 49406 if sot_token_id is None else sot_token_id
+        self.eos_token_id = 49407 if eos_token_id is None else eos_token_id
+        self.pad_token_id = model.pad_id if pad_token_id is None else pad_token_id
+        self.logit_warper = GENERATION_TYPES[generation_type](top_k if generation_type == 'top_k' else top_p)
+
+        self.waiting = deque()
+        self._request_ids = itertools.count()
+        self.reset()
+
+    def reset(self):
+        """ Drop the running batch, waiting requests are kept. """
+        self.request_ids = []
+        self.tokens = None  # [N, seq_len] generated tokens, sot first
+        self.lengths = None  # [N] number of tokens per row
+        self.max_lengths = None  # [N] per request seq_len
+        self.starts = None  # [N] first valid cache column per row
+        self.logits = None  # [N, vocab] next token logits
+        self.image_embs = None
+        self.kv_cache = None
+
+    def add_request(self, image: torch.Tensor, seq_len: Optional[int] = None) -> int:
+        """ Queue a (preprocessed, [3, H, W]) image for captioning, returns the request id. """
+        seq_len = self.seq_len if seq_len is None else seq_len
+        assert self.min_seq_len < seq_len <= self.seq_len, f'seq_len must be in ({self.min_seq_len}, {self.seq_len}]'
+        request_id = next(self._request_ids)
+        self.waiting.append((request_id, image, seq_len))
+        return request_id
+
+    def has_unfinished(self) -> bool:
+        return bool(self.waiting) or bool(self.request_ids)
+
+    @property
+    def num_active(self) -> int:
+        return len(self.request_ids)
+
+    def step(self) -> List[Tuple[int, torch.Tensor]]:
+        """ Decode one token for every active row, returns (request_id, tokens) of the captions finished. """
+        with torch.no_grad():
+            self._admit()
+            if not self.request_ids:
+                return []
+
+            next_tokens = self._sample()
+            rows = torch.arange(self.num_active, device=self.device)
+            self.tokens[rows, self.lengths] = next_tokens
+            self.lengths += 1
+
+            done = (next_tokens == self.eos_token_id) | (next_tokens == self.pad_token_id)
+            done |= self.lengths >= self.max_lengths
+            finished = [
+                (self.request_ids[i], self.tokens[i, :self.lengths[i]].clone())
+                for i in done.nonzero().flatten().tolist()
+            ]
+            if finished:
+                keep = (~done).nonzero().flatten()
+                self._evict(keep)
+                next_tokens = next_tokens[keep]
+            if self.request_ids:
+                self.logits = self._decode(next_tokens)
+            return finished
+
+    def _sample(self):
+        logits = self.logits
+        if self.repetition_penalty != 1.0:
+            # unused token slots hold the sot token which is part of every row already
+            score = torch.gather(logits, 1, self.tokens)
+            score = torch.where(score < 0, score * self.repetition_penalty, score / self.repetition_penalty)
+            logits = logits.scatter(1, self.tokens, score)
+        below_min = self.lengths < self.min_seq_len
+        if below_min.any():
+            logits = logits.clone()
+            logits[below_min, self.eos_token_id] = -float('inf')
+        logits = self.logit_warper(self.tokens, logits)
+        probs = F.softmax(logits / self.temperature, dim=-1)
+        next_tokens = torch.multinomial(probs, 1).squeeze(1)
+        force_eos = self.lengths + 1 == self.max_lengths
+        return torch.where(force_eos, torch.full_like(next_tokens, self.eos_token_id), next_tokens)
+
+    def _cache_width(self):
+        return self.kv_cache['text'][0]['k'].shape[2]
+
+    def _self_caches(self):
+        return self.kv_cache['text'] + self.kv_cache['decoder']
+
+    def _decode(self, next_tokens):
+        width = self._cache_width() + 1
+        attn_mask = torch.zeros(self.num_active, 1, 1, width, device=self.device)
+        attn_mask.masked_fill_(torch.arange(width, device=self.device) < self.starts[:, None, None, None], -float('inf'))
+        token_embs = self.model.text.forward_cached(
+            next_tokens[:, None], self.kv_cache['text'], offset=self.lengths - 1, attn_mask=attn_mask)
+        logits = self.model.text_decoder.forward_cached(
+            self.image_embs,
+            token_embs,
+            self.kv_cache['decoder'],
+            self.kv_cache['decoder_cross'],
+            attn_mask=attn_mask,
+        )
+        return logits[:, -1]
+
+    def _admit(self):
+        num_new = min(self.max_batch_size - self.num_active, len(self.waiting))
+        if num_new <= 0:
+            return
+        requests = [self.waiting.popleft() for _ in range(num_new)]
+        images = torch.stack([image for _, image, _ in requests]).to(self.device)
+        _, image_embs = self.model._encode_image(images)
+
+        tokens = torch.full((num_new, self.seq_len), self.sot_token_id, device=self.device, dtype=torch.long)
+        kv_cache = {}
+        logits = self.model._forward_cached(tokens[:, :1], image_embs, kv_cache)[:, -1]
+        lengths = torch.ones(num_new, device=self.device, dtype=torch.long)
+        max_lengths = torch.tensor([seq_len for _, _, seq_len in requests], device=self.device)
+        request_ids = [request_id for request_id, _, _ in requests]
+
+        if not self.request_ids:
+            self.request_ids = request_ids
+            self.tokens, self.lengths, self.max_lengths, self.logits = tokens, lengths, max_lengths, logits
+            self.starts = torch.zeros(num_new, device=self.device, dtype=torch.long)
+            self.image_embs, self.kv_cache = image_embs, kv_cache
+            return
+
+        # right align the cached keys / values of the new and the running rows
+        width, new_width = self._cache_width(), kv_cache['text'][0]['k'].shape[2]
+        merged_width = max(width, new_width)
+        for name in ('text', 'decoder'):
+            for layer_cache, new_layer_cache in zip(self.kv_cache[name], kv_cache[name]):
+                for key in ('k', 'v'):
+                    layer_cache[key] = torch.cat([
+                        _pad_left(layer_cache[key], merged_width - width),
+                        _pad_left(new_layer_cache[key], merged_width - new_width),
+                    ])
+        for layer_cache, new_layer_cache in zip(self.kv_cache['decoder_cross'], kv_cache['decoder_cross']):
+            for key in ('k', 'v'):
+                layer_cache[key] = torch.cat([layer_cache[key], new_layer_cache[key]])
+
+        self.request_ids = self.request_ids + request_ids
+        self.tokens = torch.cat([self.tokens, tokens])
+        self.lengths = torch.cat([self.lengths, lengths])
+        self.max_lengths = torch.cat([self.max_lengths, max_lengths])
+        self.starts = torch.cat([
+            self.starts + merged_width - width,
+            torch.full_like(lengths, merged_width - new_width),
+        ])
+        self.logits = torch.cat([self.logits, logits])
+        self.image_embs = torch.cat([self.image_embs, image_embs])
+
+    def _evict(self, keep):
+        if not len(keep):
+            self.reset()
+            return
+        self.request_ids = [self.request_ids[i] for i in keep.tolist()]
+        self.tokens = self.tokens[keep]
+        self.lengths = self.lengths[keep]
+        self.max_lengths = self.max_lengths[keep]
+        self.starts = self.starts[keep]
+        self.image_embs = self.image_embs[keep]
+        # drop the leading cache columns no remaining row attends to
+        trim = int(self.starts.min())
+        self.starts -= trim
+        for layer_cache in self._self_caches():
+            for key in ('k', 'v'):
+                layer_cache[key] = layer_cache[key][keep, :, trim:]
+        for layer_cache in self.kv_cache['decoder_cross']:
+            for key in ('k', 'v'):
+                layer_cache[key] = layer_cache[key][keep]
+
+
+class AsyncCaptionServer:
+    """ asyncio front-end for a `CaptionEngine`.
+
+    Engine steps run in a single worker thread so the event loop keeps accepting requests while the model runs.
+
+        async with AsyncCaptionServer(engine) as server:
+            tokens = await server.generate(image)
+    """
+
+    def __init__(self, engine: CaptionEngine):
+        self.engine = engine
+        self._futures = {}
+        self._executor = None
+        self._task = None
+        self._wakeup = None
+        self._running = False
+
+    async def start(self):
+        assert self._task is None, 'Server already started.'
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._wakeup = asyncio.Event()
+        self._running = True
+        self._task = asyncio.create_task(self._serve())
+
+    async def stop(self):
+        self._running = False
+        self._wakeup.set()
+        await self._task
+        self._executor.shutdown()
+        self._task = None
+        for future in self._futures.values():
+            future.cancel()
+        self._futures.clear()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.stop()
+
+    async def generate(self, image: torch.Tensor, seq_len: Optional[int] = None) -> torch.Tensor:
+        """ Caption tokens for one (preprocessed) image, starting w/ the sot token. """
+        assert self._running, 'Server not started.'
+        future = asyncio.get_running_loop().create_future()
+        self._futures[self.engine.add_request(image, seq_len=seq_len)] = future
+        self._wakeup.set()
+        return await future
+
+    async def _serve(self):
+        loop = asyncio.get_running_loop()
+        while self._running:
+            if not self.engine.has_unfinished():
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            try:
+                finished = await loop.run_in_executor(self._executor, self.engine.step)
+            except Exception as e:
+                # fail everything in flight, the engine state can't be trusted after a failed step
+                self.engine.reset()
+                self.engine.waiting.clear()
+                for future in self._futures.values():
+                    if not future.done():
+                        future.set_exception(e)
+                self._futures.clear()
+                continue
+
+            for request_id, tokens in finished:
+                future = self._futures.pop(request_id, None)
+                if future is not None and not future.done():
+                    future.set_result(tokens)
@@ -2,6 +2,7 @@
 
 Wraps HuggingFace transformers (https://github.com/huggingface/transformers) models for use as a text tower in CLIP model.
 """
+import logging
 import re
 
 import torch
@@ -25,6 +26,7 @@ except ImportError as e:
         pass
 
 from .hf_configs import arch_dict
+from .transformer import parse_grad_checkpointing
 
 
 # utils
@@ -187,6 +189,12 @@ class HFTextEncoder(nn.Module):
 
     @torch.jit.ignore
     def set_grad_checkpointing(self, enable=True):
+        policy = parse_grad_checkpointing(enable)
+        if policy is None:
+            self.transformer.gradient_checkpointing_disable()
+            return
+        if policy[0] != 'all':
+            logging.warning(f'grad checkpointing policy {enable} not supported for HF text towers, checkpointing all.')
         self.transformer.gradient_checkpointing_enable()
 
     def init_parameters(self):
@@ -16,6 +16,103 @@ except ImportError:
     hvd = None
 
 
+class AllGatherFeatures(torch.autograd.Function):
+    """ All-gather `features` along dim 0 into the preallocated `output`.
+
+    The backward reduce-scatters the gradient if `reduce_grad` (full distributed gradient), each rank only
+    receives the sum of the gradients of its own slice, otherwise only the local gradient is kept. The collective
+    is launched async if a `pending` list is passed, its work handle is appended and must be waited on before
+    the output is read.
+    """
+    @staticmethod
+    def forward(ctx, features, output, rank, world_size, reduce_grad, pending=None):
+        ctx.rank = rank
+        ctx.world_size = world_size
+        ctx.reduce_grad = reduce_grad
+        features = features.contiguous()
+        if dist.get_backend() == dist.Backend.NCCL:
+            work = dist.all_gather_into_tensor(output, features, async_op=pending is not None)
+        else:
+            # the chunks are views of output, gathered into in place
+            work = dist.all_gather(list(output.chunk(world_size)), features, async_op=pending is not None)
+        if pending is not None:
+            pending.append(work)
+        return output.view_as(output)
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        if ctx.reduce_grad:
+            grad_input = reduce_scatter(grad_output, ctx.rank, ctx.world_size)
+        else:
+            grad_input = grad_output.chunk(ctx.world_size)[ctx.rank]
+        return grad_input, None, None, None, None, None
+
+
+_REDUCE_SCATTER_UNSUPPORTED = set()
+
+
+def reduce_scatter(tensor, rank=0, world_size=1):
+    """ Sum `tensor` across ranks and return the local rank's chunk (along dim 0) of the result. """
+    tensor = tensor.contiguous()
+    output = tensor.new_empty((tensor.shape[0] // world_size,) + tensor.shape[1:])
+    backend = dist.get_backend()
+    if backend == dist.Backend.NCCL:
+        dist.reduce_scatter_tensor(output, tensor)
+        return output
+    if backend not in _REDUCE_SCATTER_UNSUPPORTED:
+        try:
+            dist.reduce_scatter(output, list(tensor.chunk(world_size)))
+            return output
+        except RuntimeError:
+            # raised before any communication, by every rank of a backend w/o reduce_scatter (older gloo)
+            _REDUCE_SCATTER_UNSUPPORTED.add(backend)
+    tensor = tensor.clone()
+    dist.all_reduce(tensor)
+    return tensor.chunk(world_size)[rank]
+
+
+class HorovodAllGatherFeatures(torch.autograd.Function):
+    """ Horovod all-gather of `features` along dim 0 w/ a reduce-scatter backward. """
+    @staticmethod
+    def forward(ctx, features):
+        return hvd.allgather(features)
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        return hvd.reducescatter(grad_output.contiguous(), op=hvd.Sum)
+
+
+def gather_buffer(features, world_size, buffers=None):
+    """ Output buffer for the all-gather of `features`, persistent in `buffers` across calls if passed.
+
+    Buffers are keyed by shape, dtype, device and whether `features` requires grad. The gathered features
+    of one call must have been consumed (incl. backward) before the next call w/ the same key overwrites them.
+    """
+    shape = (world_size * features.shape[0],) + features.shape[1:]
+    if buffers is None:
+        return features.new_empty(shape)
+    key = (shape, features.dtype, features.device, features.requires_grad)
+    if key not in buffers:
+        buffers[key] = features.new_empty(shape)
+    return buffers[key]
+
+
+def all_gather_features(
+        features,
+        local_loss=False,
+        gather_with_grad=False,
+        rank=0,
+        world_size=1,
+        buffers=None,
+        pending=None,
+):
+    if not gather_with_grad and (local_loss or not features.requires_grad):
+        # w/ local loss the gathered features don't need any gradient
+        features = features.detach()
+    output = gather_buffer(features, world_size, buffers)
+    return AllGatherFeatures.apply(features, output, rank, world_size, gather_with_grad, pending)
+
+
 def gather_features(
         image_features,
         text_features,
@@ -23,44 +120,147 @@ def gather_features(
         gather_with_grad=False,
         rank=0,
         world_size=1,
-        use_horovod=False
+        use_horovod=False,
+        buffers=None,
 ):
     assert has_distributed, 'torch.distributed did not import correctly, please use a PyTorch version with support.'
+    # Pack the image and text features so they're gathered w/ a single collective
+    packed = image_features.shape[0] == text_features.shape[0] and image_features.dtype == text_features.dtype
+    if packed:
+        image_dim = image_features.shape[1]
+        features = torch.cat([image_features, text_features], dim=1)
+
     if use_horovod:
         assert hvd is not None, 'Please install horovod'
+        if packed:
+            all_features = HorovodAllGatherFeatures.apply(features) if gather_with_grad else _hvd_gather_no_grad(
+                features, local_loss, rank, world_size)
+            return all_features[:, :image_dim], all_features[:, image_dim:]
         if gather_with_grad:
-            all_image_features = hvd.allgather(image_features)
-            all_text_features = hvd.allgather(text_features)
-        else:
-            with torch.no_grad():
-                all_image_features = hvd.allgather(image_features)
-                all_text_features = hvd.allgather(text_features)
-            if not local_loss:
-                # ensure grads for local rank when all_* features don't have a gradient
-                gathered_image_features = list(all_image_features.chunk(world_size, dim=0))
-                gathered_text_features = list(all_text_features.chunk(world_size, dim=0))
-                gathered_image_features[rank] = image_features
-                gathered_text_features[rank] = text_features
-                all_image_features = torch.cat(gathered_image_features, dim=0)
-                all_text_features = torch.cat(gathered_text_features, dim=0)
-    else:
-        # We gather tensors from all gpus
-        if gather_with_grad:
-            all_image_features = torch.cat(torch.distributed.nn.all_gather(image_features), dim=0)
-            all_text_features = torch.cat(torch.distributed.nn.all_gather(text_features), dim=0)
-        else:
-            gathered_image_features = [torch.zeros_like(image_features) for _ in range(world_size)]
-            gathered_text_features = [torch.zeros_like(text_features) for _ in range(world_size)]
-            dist.all_gather(gathered_image_features, image_features)
-            dist.all_gather(gathered_text_features, text_features)
-            if not local_loss:
-                # ensure grads for local rank when all_* features don't have a gradient
-                gathered_image_features[rank] = image_features
-                gathered_text_features[rank] = text_features
-            all_image_features = torch.cat(gathered_image_features, dim=0)
-            all_text_features = torch.cat(gathered_text_features, dim=0)
+            return HorovodAllGatherFeatures.apply(image_features), HorovodAllGatherFeatures.apply(text_features)
+        return (
+            _hvd_gather_no_grad(image_features, local_loss, rank, world_size),
+            _hvd_gather_no_grad(text_features, local_loss, rank, world_size),
+        )
+
+    # We gather tensors from all gpus, into persistent buffers if passed
+    if packed:
+        all_features = all_gather_features(features, local_loss, gather_with_grad, rank, world_size, buffers)
+        return all_features[:, :image_dim], all_features[:, image_dim:]
+    return (
+        all_gather_features(image_features, local_loss, gather_with_grad, rank, world_size, buffers),
+        all_gather_features(text_features, local_loss, gather_with_grad, rank, world_size, buffers),
+    )
+
+
+def _hvd_gather_no_grad(features, local_loss, rank, world_size):
+    with torch.no_grad():
+        all_features = hvd.allgather(features)
+    if not local_loss:
+        # ensure grads for local rank when all_* features don't have a gradient
+        gathered_features = list(all_features.chunk(world_size, dim=0))
+        gathered_features[rank] = features
+        all_features = torch.cat(gathered_features, dim=0)
+    return all_features
+
+
+class AsyncImageGather:
+    """ Gather the image features of each training forward pass as soon as the image tower has computed them.
+
+    The all-gather of the image features then overlaps w/ the text tower forward pass. Attach to a model w/
+    `register(model)` and pass to the loss as `async_gather`. Only forward passes in train mode are gathered and
+    each one must be followed by exactly one loss computation (no gradient accumulation, no distillation).
+    """
+
+    def __init__(self, local_loss=False, gather_with_grad=False, rank=0, world_size=1):
+        self.local_loss = local_loss
+        self.gather_with_grad = gather_with_grad
+        self.rank = rank
+        self.world_size = world_size
+        self.buffers = {}
+        self.pending = None
+
+    def register(self, model):
+        visual = model.module.visual if hasattr(model, 'module') else model.visual
+        return visual.register_forward_hook(self._gather)
+
+    def _gather(self, module, inputs, output):
+        if not module.training:
+            return
+        # towers returning (pooled, tokens) are gathered on the pooled features
+        image_features = output[0] if isinstance(output, (tuple, list)) else output
+        pending = []
+        all_image_features = all_gather_features(
+            image_features, self.local_loss, self.gather_with_grad, self.rank, self.world_size, self.buffers, pending)
+        self.pending = all_image_features, pending[0]
+
+    def wait(self):
+        assert self.pending is not None, 'No image features gathered, the model forward must be run in train mode.'
+        all_image_features, work = self.pending
+        self.pending = None
+        work.wait()
+        # the model normalizes the image tower output the same way
+        return F.normalize(all_image_features, dim=-1)
+
+
+class ChunkedLogSumExp(torch.autograd.Function):
+    """ Row-wise logsumexp of `logit_scale * query @ key.T`, accumulated over column blocks of `key`.
+
+    Only a (num_query, chunk_size) block of logits is alive at any point in forward or backward, the
+    blocks are combined online (as in online-softmax) and recomputed in backward. Both are computed in fp32
+    (also under autocast), the recomputed logits in backward must match the forward ones the lse came from.
+    """
+    @staticmethod
+    @torch.cuda.amp.custom_fwd(cast_inputs=torch.float32)
+    def forward(ctx, query, key, logit_scale, chunk_size):
+        lse = None
+        scale = logit_scale.float()
+        query_f = query.float()
+        for start in range(0, key.shape[0], chunk_size):
+            logits = scale * query_f @ key[start:start + chunk_size].float().T
+            block_lse = torch.logsumexp(logits, dim=1)
+            lse = block_lse if lse is None else torch.logaddexp(lse, block_lse)
+        ctx.save_for_backward(query, key, logit_scale, lse)
+        ctx.chunk_size = chunk_size
+        return lse
 
-    return all_image_features, all_text_features
+    @staticmethod
+    @torch.cuda.amp.custom_bwd
+    def backward(ctx, grad_lse):
+        query, key, logit_scale, lse = ctx.saved_tensors
+        scale = logit_scale.float()
+        query_f = query.float()
+        grad_query = torch.zeros_like(query_f)
+        grad_key = torch.zeros_like(key, dtype=torch.float32)
+        grad_logit_scale = torch.zeros_like(scale)
+        for start in range(0, key.shape[0], ctx.chunk_size):
+            end = start + ctx.chunk_size
+            key_block = key[start:end].float()
+            sim = query_f @ key_block.T
+            # d lse_i / d logits_ij = softmax_ij, scaled by the incoming grad of each row
+            probs = torch.exp(scale * sim - lse[:, None]) * grad_lse[:, None]
+            if ctx.needs_input_grad[0]:
+                grad_query += scale * probs @ key_block
+            if ctx.needs_input_grad[1]:
+                grad_key[start:end] = scale * probs.T @ query_f
+            if ctx.needs_input_grad[2]:
+                grad_logit_scale += (probs * sim).sum()
+        return (
+            grad_query.to(query.dtype),
+            grad_key.to(key.dtype),
+            grad_logit_scale.to(logit_scale.dtype),
+            None,
+        )
+
+
+def chunked_cross_entropy(query, key, logit_scale, labels, chunk_size):
+    """ Mean cross-entropy of `logit_scale * query @ key.T` against `labels` without materializing the logits.
+    """
+    if not isinstance(logit_scale, torch.Tensor):
+        logit_scale = torch.tensor(logit_scale, device=query.device)
+    lse = ChunkedLogSumExp.apply(query, key, logit_scale, chunk_size)
+    positive = logit_scale.float() * (query.float() * key[labels].float()).sum(dim=-1)
+    return (lse - positive).mean()
 
 
 class ClipLoss(nn.Module):
@@ -73,6 +273,8 @@ class ClipLoss(nn.Module):
             rank=0,
             world_size=1,
             use_horovod=False,
+            chunk_size=None,
+            async_gather=None,
     ):
         super().__init__()
         self.local_loss = local_loss
@@ -81,10 +283,15 @@ class ClipLoss(nn.Module):
         self.rank = rank
         self.world_size = world_size
         self.use_horovod = use_horovod
+        # compute the loss in blocks of chunk_size logit columns, never materializing the full logit matrix
+        self.chunk_size = chunk_size
+        # AsyncImageGather registered on the model, already gathering the image features
+        self.async_gather = async_gather
 
         # cache state
         self.prev_num_logits = 0
         self.labels = {}
+        self.gather_buffers = {}
 
     def get_ground_truth(self, device, num_logits) -> torch.Tensor:
         # calculated ground-truth and cache if enabled
@@ -99,11 +306,22 @@ class ClipLoss(nn.Module):
             labels = self.labels[device]
         return labels
 
-    def get_logits(self, image_features, text_features, logit_scale):
+    def gather_features(self, image_features, text_features, buffers=None):
+        # features that must stay alive at the same time (e.g. student and teacher) need distinct buffers
+        buffers = self.gather_buffers if buffers is None else buffers
+        if self.async_gather is not None:
+            all_text_features = all_gather_features(
+                text_features, self.local_loss, self.gather_with_grad, self.rank, self.world_size, buffers)
+            return self.async_gather.wait(), all_text_features
+        return gather_features(
+            image_features, text_features,
+            self.local_loss, self.gather_with_grad, self.rank, self.world_size, self.use_horovod,
+            buffers=buffers)
+
+    def get_logits(self, image_features, text_features, logit_scale, gather_buffers=None):
         if self.world_size > 1:
-            all_image_features, all_text_features = gather_features(
-                image_features, text_features,
-                self.local_loss, self.gather_with_grad, self.rank, self.world_size, self.use_horovod)
+            all_image_features, all_text_features = self.gather_features(
+                image_features, text_features, buffers=gather_buffers)
 
             if self.local_loss:
                 logits_per_image = logit_scale * image_features @ all_text_features.T
@@ -117,7 +335,28 @@ class ClipLoss(nn.Module):
         
         return logits_per_image, logits_per_text
 
+    def get_chunked_loss(self, image_features, text_features, logit_scale):
+        if self.world_size > 1:
+            all_image_features, all_text_features = self.gather_features(image_features, text_features)
+
+            if not self.local_loss:
+                # global @ global, the text -> image direction is the transpose of image -> text
+                image_features, text_features = all_image_features, all_text_features
+        else:
+            all_image_features, all_text_features = image_features, text_features
+
+        labels = self.get_ground_truth(image_features.device, image_features.shape[0])
+        total_loss = (
+            chunked_cross_entropy(image_features, all_text_features, logit_scale, labels, self.chunk_size) +
+            chunked_cross_entropy(text_features, all_image_features, logit_scale, labels, self.chunk_size)
+        ) / 2
+        return total_loss
+
     def forward(self, image_features, text_features, logit_scale, output_dict=False):
+        if self.chunk_size:
+            total_loss = self.get_chunked_loss(image_features, text_features, logit_scale)
+            return {"contrastive_loss": total_loss} if output_dict else total_loss
+
         device = image_features.device
         logits_per_image, logits_per_text = self.get_logits(image_features, text_features, logit_scale)
 
@@ -143,6 +382,8 @@ class CoCaLoss(ClipLoss):
             rank=0,
             world_size=1,
             use_horovod=False,
+            chunk_size=None,
+            async_gather=None,
     ):
         super().__init__(
             local_loss=local_loss,
@@ -150,7 +391,9 @@ class CoCaLoss(ClipLoss):
             cache_labels=cache_labels,
             rank=rank,
             world_size=world_size,
-            use_horovod=use_horovod
+            use_horovod=use_horovod,
+            chunk_size=chunk_size,
+            async_gather=async_gather,
         )
 
         self.clip_loss_weight = clip_loss_weight
@@ -179,6 +422,11 @@ class CoCaLoss(ClipLoss):
 
 class DistillClipLoss(ClipLoss):
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # the teacher features are gathered while the student's are still needed for backward
+        self.dist_gather_buffers = {}
+
     def dist_loss(self, teacher_logits, student_logits):
         return -(teacher_logits.softmax(dim=1) * student_logits.log_softmax(dim=1)).sum(dim=1).mean(dim=0)
 
@@ -196,7 +444,8 @@ class DistillClipLoss(ClipLoss):
             self.get_logits(image_features, text_features, logit_scale)
 
         dist_logits_per_image, dist_logits_per_text = \
-            self.get_logits(dist_image_features, dist_text_features, dist_logit_scale)
+            self.get_logits(
+                dist_image_features, dist_text_features, dist_logit_scale, gather_buffers=self.dist_gather_buffers)
 
         labels = self.get_ground_truth(image_features.device, logits_per_image.shape[0])
 
@@ -216,8 +465,14 @@ class DistillClipLoss(ClipLoss):
         return contrastive_loss, distill_loss
 
 
-def neighbour_exchange(from_rank, to_rank, tensor, group=None):
-    tensor_recv = torch.zeros_like(tensor)
+def neighbour_exchange(from_rank, to_rank, tensor, group=None, tensor_recv=None, pending=None):
+    """ Send `tensor` to `to_rank` and receive from `from_rank`, into `tensor_recv` if passed.
+
+    If a `pending` list is passed, the requests are appended to it instead of being waited on, the received
+    tensor must not be read before they complete.
+    """
+    if tensor_recv is None:
+        tensor_recv = torch.zeros_like(tensor)
     send_op = torch.distributed.P2POp(
         torch.distributed.isend,
         tensor,
@@ -231,14 +486,32 @@ def neighbour_exchange(from_rank, to_rank, tensor, group=None):
         group=group,
     )
     reqs = torch.distributed.batch_isend_irecv([send_op, recv_op])
-    for req in reqs:
-        req.wait()
+    if pending is not None:
+        pending.extend(reqs)
+    else:
+        for req in reqs:
+            req.wait()
     return tensor_recv
 
 
-def neighbour_exchange_bidir(left_rank, right_rank, tensor_to_left, tensor_to_right, group=None):
-    tensor_from_left = torch.zeros_like(tensor_to_right)
-    tensor_from_right = torch.zeros_like(tensor_to_left)
+def neighbour_exchange_bidir(
+        left_rank,
+        right_rank,
+        tensor_to_left,
+        tensor_to_right,
+        group=None,
+        tensor_recv=None,
+        pending=None,
+):
+    """ Exchange tensors w/ both neighbours, into the `tensor_recv` (from right, from left) buffers if passed.
+
+    Requests are appended to `pending` instead of being waited on if passed, as in `neighbour_exchange`.
+    """
+    if tensor_recv is None:
+        tensor_from_left = torch.zeros_like(tensor_to_right)
+        tensor_from_right = torch.zeros_like(tensor_to_left)
+    else:
+        tensor_from_right, tensor_from_left = tensor_recv
     send_op_left = torch.distributed.P2POp(
         torch.distributed.isend,
         tensor_to_left,
@@ -264,44 +537,62 @@ def neighbour_exchange_bidir(left_rank, right_rank, tensor_to_left, tensor_to_ri
         group=group,
     )
     reqs = torch.distributed.batch_isend_irecv([send_op_right, send_op_left, recv_op_right, recv_op_left])
-    for req in reqs:
-        req.wait()
+    if pending is not None:
+        pending.extend(reqs)
+    else:
+        for req in reqs:
+            req.wait()
     return tensor_from_right, tensor_from_left
 
 
 class NeighbourExchange(torch.autograd.Function):
     @staticmethod
-    def forward(ctx, from_rank, to_rank, group, tensor):
+    def forward(ctx, from_rank, to_rank, group, tensor, tensor_recv=None, pending=None):
         ctx.group = group
         ctx.from_rank = from_rank
         ctx.to_rank = to_rank
-        return neighbour_exchange(from_rank, to_rank, tensor, group=group)
+        tensor_recv = neighbour_exchange(
+            from_rank, to_rank, tensor, group=group, tensor_recv=tensor_recv, pending=pending)
+        return tensor_recv.view_as(tensor_recv)
 
     @staticmethod
     def backward(ctx, grad_output):
-        return (None, None, None) + (NeighbourExchange.apply(ctx.to_rank, ctx.from_rank, ctx.group, grad_output),)
+        return (None, None, None) + \
+            (NeighbourExchange.apply(ctx.to_rank, ctx.from_rank, ctx.group, grad_output),) + (None, None)
 
 
-def neighbour_exchange_with_grad(from_rank, to_rank, tensor, group=None):
-    return NeighbourExchange.apply(from_rank, to_rank, group, tensor)
+def neighbour_exchange_with_grad(from_rank, to_rank, tensor, group=None, tensor_recv=None, pending=None):
+    return NeighbourExchange.apply(from_rank, to_rank, group, tensor, tensor_recv, pending)
 
 
 class NeighbourExchangeBidir(torch.autograd.Function):
     @staticmethod
-    def forward(ctx, left_rank, right_rank, group, tensor_to_left, tensor_to_right):
+    def forward(ctx, left_rank, right_rank, group, tensor_to_left, tensor_to_right, tensor_recv=None, pending=None):
         ctx.group = group
         ctx.left_rank = left_rank
         ctx.right_rank = right_rank
-        return neighbour_exchange_bidir(left_rank, right_rank, tensor_to_left, tensor_to_right, group=group)
+        tensor_recv = neighbour_exchange_bidir(
+            left_rank, right_rank, tensor_to_left, tensor_to_right,
+            group=group, tensor_recv=tensor_recv, pending=pending)
+        return tuple(t.view_as(t) for t in tensor_recv)
 
     @staticmethod
     def backward(ctx, *grad_outputs):
         return (None, None, None) + \
-            NeighbourExchangeBidir.apply(ctx.right_rank, ctx.left_rank, ctx.group, *grad_outputs)
+            NeighbourExchangeBidir.apply(ctx.right_rank, ctx.left_rank, ctx.group, *grad_outputs) + (None, None)
 
 
-def neighbour_exchange_bidir_with_grad(left_rank, right_rank, tensor_to_left, tensor_to_right, group=None):
-    return NeighbourExchangeBidir.apply(left_rank, right_rank, group, tensor_to_left, tensor_to_right)
+def neighbour_exchange_bidir_with_grad(
+        left_rank,
+        right_rank,
+        tensor_to_left,
+        tensor_to_right,
+        group=None,
+        tensor_recv=None,
+        pending=None,
+):
+    return NeighbourExchangeBidir.apply(
+        left_rank, right_rank, group, tensor_to_left, tensor_to_right, tensor_recv, pending)
 
 
 class SigLipLoss(nn.Module):
@@ -333,6 +624,7 @@ class SigLipLoss(nn.Module):
         # cache state FIXME cache not currently used, worthwhile?
         self.prev_num_logits = 0
         self.labels = {}
+        self.recv_buffers = {}
 
     def get_ground_truth(self, device, dtype, num_logits, negative_only=False) -> torch.Tensor:
         labels = -torch.ones((num_logits, num_logits), device=device, dtype=dtype)
@@ -348,67 +640,74 @@ class SigLipLoss(nn.Module):
 
     def _loss(self, image_features, text_features, logit_scale, logit_bias=None, negative_only=False):
         logits = self.get_logits(image_features, text_features, logit_scale, logit_bias)
-        labels = self.get_ground_truth(
-            image_features.device,
-            image_features.dtype,
-            image_features.shape[0],
-            negative_only=negative_only,
-        )
-        loss = -F.logsigmoid(labels * logits).sum() / image_features.shape[0]
-        return loss
+        # -logsigmoid(labels * logits) w/o materializing the labels (-1, +1 on the diagonal of positive pairs),
+        # as -logsigmoid(x) = -logsigmoid(-x) - x
+        loss = -F.logsigmoid(-logits).sum()
+        if not negative_only:
+            loss = loss - logits.diagonal().sum()
+        return loss / image_features.shape[0]
+
+    def _recv_buffers(self, hop, num, like):
+        # receive buffers of each ring hop, kept across steps (the received features are saved for backward)
+        key = (hop, like.shape, like.dtype, like.device)
+        if key not in self.recv_buffers:
+            self.recv_buffers[key] = tuple(torch.empty_like(like) for _ in range(num))
+        return self.recv_buffers[key]
+
+    def _exchange(self, hop, bidir, text_features_to_left, text_features_to_right, pending):
+        right_rank = (self.rank + 1) % self.world_size
+        left_rank = (self.rank - 1 + self.world_size) % self.world_size
+        if bidir:
+            return neighbour_exchange_bidir_with_grad(
+                left_rank,
+                right_rank,
+                text_features_to_left,
+                text_features_to_right,
+                tensor_recv=self._recv_buffers(hop, 2, text_features_to_right),
+                pending=pending,
+            )
+        text_features_recv, = self._recv_buffers(hop, 1, text_features_to_right)
+        return (neighbour_exchange_with_grad(
+            left_rank, right_rank, text_features_to_right, tensor_recv=text_features_recv, pending=pending),)
 
     def forward(self, image_features, text_features, logit_scale, logit_bias, output_dict=False):
-        loss = self._loss(image_features, text_features, logit_scale, logit_bias)
+        if self.world_size == 1:
+            loss = self._loss(image_features, text_features, logit_scale, logit_bias)
+            return {"contrastive_loss": loss} if output_dict else loss
+
+        # Exchange text features w/ neighbour world_size - 1 times, both ways at once if bidir. The ring is
+        # pipelined, each exchange is posted before the loss of the previously received features is computed.
+        if self.bidir:
+            num_bidir, remainder = divmod(self.world_size - 1, 2)
+            hops = [True] * num_bidir + [False] * remainder
+        else:
+            hops = [False] * (self.world_size - 1)
 
-        if self.world_size > 1:
-            # exchange text features w/ neighbour world_size - 1 times
-            right_rank = (self.rank + 1) % self.world_size
-            left_rank = (self.rank - 1 + self.world_size) % self.world_size
-            if self.bidir:
-                text_features_to_right = text_features_to_left = text_features
-                num_bidir, remainder = divmod(self.world_size - 1, 2)
-                for i in range(num_bidir):
-                    text_features_recv = neighbour_exchange_bidir_with_grad(
-                        left_rank,
-                        right_rank,
-                        text_features_to_left,
-                        text_features_to_right,
-                    )
-
-                    for f in text_features_recv:
-                        loss += self._loss(
-                            image_features,
-                            f,
-                            logit_scale,
-                            logit_bias,
-                            negative_only=True,
-                        )
-                    text_features_to_left, text_features_to_right = text_features_recv
-
-                if remainder:
-                    text_features_recv = neighbour_exchange_with_grad(
-                        left_rank, right_rank, text_features_to_right)
-
-                    loss += self._loss(
-                        image_features,
-                        text_features_recv,
-                        logit_scale,
-                        logit_bias,
-                        negative_only=True,
-                    )
+        text_features_to_right = text_features_to_left = text_features
+        pending = []
+        text_features_recv = self._exchange(0, hops[0], text_features_to_left, text_features_to_right, pending)
+        loss = self._loss(image_features, text_features, logit_scale, logit_bias)
+        for hop, bidir in enumerate(hops):
+            for req in pending:
+                req.wait()
+            pending = []
+            if bidir:
+                text_features_to_left, text_features_to_right = text_features_recv
             else:
-                text_features_to_right = text_features
-                for i in range(self.world_size - 1):
-                    text_features_from_left = neighbour_exchange_with_grad(
-                        left_rank, right_rank, text_features_to_right)
-
-                    loss += self._loss(
-                        image_features,
-                        text_features_from_left,
-                        logit_scale,
-                        logit_bias,
-                        negative_only=True,
-                    )
-                    text_features_to_right = text_features_from_left
+                text_features_to_right, = text_features_recv
+
+            received = text_features_recv
+            if hop + 1 < len(hops):
+                text_features_recv = self._exchange(
+                    hop + 1, hops[hop + 1], text_features_to_left, text_features_to_right, pending)
+
+            for f in received:
+                loss += self._loss(
+                    image_features,
+                    f,
+                    logit_scale,
+                    logit_bias,
+                    negative_only=True,
+                )
 
         return {"contrastive_loss": loss} if output_dict else loss
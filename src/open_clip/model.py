@@ -6,7 +6,7 @@ import copy
 import logging
 import math
 from dataclasses import dataclass
-from typing import Any, Dict, Optional, Tuple, Union
+from typing import Any, Dict, Optional, Sequence, Tuple, Union
 
 import numpy as np
 import torch
@@ -42,6 +42,8 @@ class CLIPVisionCfg:
     final_ln_after_pool: bool = False  # apply final LayerNorm after pooling
     pool_type: str = 'tok'
     output_tokens: bool = False
+    batch_first: bool = False  # keep tokens batch-first (NLD) through the transformer, no layout permutes
+    token_merge_ratio: Union[float, Tuple[float, ...]] = 0.  # fraction of tokens merged per block at inference (ToMe)
     act_kwargs: Optional[dict] = None
     norm_kwargs: Optional[dict] = None
 
@@ -72,7 +74,9 @@ class CLIPTextCfg:
     final_ln_after_pool: bool = False  # apply final LayerNorm after pooling
     pool_type: str = 'argmax'
     proj_bias: bool = False
+    trim_padding: bool = False  # trim batches to the longest sequence before the text transformer
     output_tokens: bool = False
+    batch_first: bool = False  # keep tokens batch-first (NLD) through the transformer, no layout permutes
     act_kwargs: dict = None
     norm_kwargs: dict = None
 
@@ -165,6 +169,8 @@ def _build_vision_tower(
             output_dim=embed_dim,
             act_layer=act_layer,
             norm_layer=norm_layer,
+            batch_first=vision_cfg.batch_first,
+            token_merge_ratio=vision_cfg.token_merge_ratio,
         )
 
     return visual
@@ -210,13 +216,22 @@ def _build_text_tower(
             pad_id=text_cfg.pad_id,
             pool_type=text_cfg.pool_type,
             proj_bias=text_cfg.proj_bias,
+            trim_padding=text_cfg.trim_padding,
             output_tokens=text_cfg.output_tokens,
+            batch_first=text_cfg.batch_first,
             act_layer=act_layer,
             norm_layer=norm_layer,
         )
     return text
 
 
+def _set_activation_offload(tower: nn.Module, layers: Union[bool, str, Sequence[int]]):
+    if hasattr(tower, 'set_activation_offload'):
+        tower.set_activation_offload(layers)
+    elif layers:
+        logging.warning(f'activation offload not supported for {type(tower).__name__} towers, continuing without...')
+
+
 class CLIP(nn.Module):
     output_dict: torch.jit.Final[bool]
 
@@ -245,6 +260,7 @@ class CLIP(nn.Module):
         self.ln_final = text.ln_final
         self.text_projection = text.text_projection
         self.text_pool_type = text.pool_type
+        self.text_trim_padding = text.trim_padding
         self.register_buffer('attn_mask', text.attn_mask, persistent=False)
 
         self.logit_scale = nn.Parameter(torch.ones([]) * init_logit_scale)
@@ -258,23 +274,44 @@ class CLIP(nn.Module):
         self.visual.lock(unlocked_groups=unlocked_groups, freeze_bn_stats=freeze_bn_stats)
 
     @torch.jit.ignore
-    def set_grad_checkpointing(self, enable=True):
+    def set_grad_checkpointing(self, enable: Union[bool, str] = True):
         self.visual.set_grad_checkpointing(enable)
-        self.transformer.grad_checkpointing = enable
+        self.transformer.set_grad_checkpointing(enable)
+
+    @torch.jit.ignore
+    def set_activation_offload(self, layers: Union[bool, str, Sequence[int]] = True):
+        _set_activation_offload(self.visual, layers)
+        self.transformer.set_activation_offload(layers)
+
+    @torch.jit.ignore
+    def set_text_trim_padding(self, enable=True):
+        assert not enable or (self.attn_mask is not None and self.text_pool_type == 'argmax'), \
+            'Trimming padding requires a causal mask and argmax pooling.'
+        self.text_trim_padding = enable
 
     def encode_image(self, image, normalize: bool = False):
         features = self.visual(image)
         return F.normalize(features, dim=-1) if normalize else features
 
     def encode_text(self, text, normalize: bool = False):
+        if self.text_trim_padding:
+            # EOT is the highest token id, nothing after the last EOT of the batch affects the pooled output
+            text = text[:, :int(text.argmax(dim=-1).max()) + 1]
         cast_dtype = self.transformer.get_cast_dtype()
+        seq_len = text.shape[1]
 
         x = self.token_embedding(text).to(cast_dtype)  # [batch_size, n_ctx, d_model]
+        attn_mask = self.attn_mask
+        if attn_mask is not None:
+            attn_mask = attn_mask[:seq_len, :seq_len]
 
-        x = x + self.positional_embedding.to(cast_dtype)
-        x = x.permute(1, 0, 2)  # NLD -> LND
-        x = self.transformer(x, attn_mask=self.attn_mask)
-        x = x.permute(1, 0, 2)  # LND -> NLD
+        x = x + self.positional_embedding[:seq_len].to(cast_dtype)
+        if self.transformer.batch_first:
+            x = self.transformer(x, attn_mask=attn_mask, is_causal=attn_mask is not None)
+        else:
+            x = x.permute(1, 0, 2)  # NLD -> LND
+            x = self.transformer(x, attn_mask=attn_mask, is_causal=attn_mask is not None)
+            x = x.permute(1, 0, 2)  # LND -> NLD
         x = self.ln_final(x)  # [batch_size, n_ctx, transformer.width]
         x, _ = text_global_pool(x, text, self.text_pool_type)
         if self.text_projection is not None:
@@ -351,10 +388,20 @@ class CustomTextCLIP(nn.Module):
         self.text.lock(unlocked_layers, freeze_layer_norm)
 
     @torch.jit.ignore
-    def set_grad_checkpointing(self, enable=True):
+    def set_grad_checkpointing(self, enable: Union[bool, str] = True):
         self.visual.set_grad_checkpointing(enable)
         self.text.set_grad_checkpointing(enable)
 
+    @torch.jit.ignore
+    def set_activation_offload(self, layers: Union[bool, str, Sequence[int]] = True):
+        _set_activation_offload(self.visual, layers)
+        _set_activation_offload(self.text, layers)
+
+    @torch.jit.ignore
+    def set_text_trim_padding(self, enable=True):
+        assert hasattr(self.text, 'set_trim_padding'), 'Text tower does not support trimming padding.'
+        self.text.set_trim_padding(enable)
+
     def encode_image(self, image, normalize: bool = False):
         features = self.visual(image)
         return F.normalize(features, dim=-1) if normalize else features
@@ -23,6 +23,7 @@ except ImportError:
     timm = None
 
 from .utils import freeze_batch_norm_2d
+from .transformer import parse_grad_checkpointing
 
 
 class TimmModel(nn.Module):
@@ -141,8 +142,11 @@ class TimmModel(nn.Module):
 
     @torch.jit.ignore
     def set_grad_checkpointing(self, enable=True):
+        policy = parse_grad_checkpointing(enable)
+        if policy is not None and policy[0] != 'all':
+            logging.warning(f'grad checkpointing policy {enable} not supported for timm towers, checkpointing all.')
         try:
-            self.trunk.set_grad_checkpointing(enable)
+            self.trunk.set_grad_checkpointing(policy is not None)
         except Exception as e:
             logging.warning('grad checkpointing not supported for this timm image tower, continuing without...')
 
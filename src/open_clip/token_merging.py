@@ -0,0 +1,63 @@
+# --------------------------------------------------------
+# Token merging (ToMe) utils
+# References:
+# Token Merging: Your ViT But Faster: https://arxiv.org/abs/2210.09461
+# ToMe: https://github.com/facebookresearch/ToMe
+# --------------------------------------------------------
+import math
+from typing import Callable, Tuple
+
+import torch
+
+
+def _identity(x: torch.Tensor, mode: str = 'mean') -> torch.Tensor:
+    return x
+
+
+def bipartite_soft_matching(metric: torch.Tensor, r: int, class_token: bool = True) -> Callable:
+    """ Bipartite soft matching, merges the `r` most similar token pairs.
+
+    Tokens are split in alternating sets A and B, each token in A is matched to its most similar token in B
+    (cosine similarity of `metric` [N, L, C]) and the `r` best matches are merged into their B token.
+    The class token (first token) is never merged if `class_token` is set.
+
+    Returns a function merging a [N, L, C] tensor into [N, L - r, C].
+    """
+    protected = int(class_token)
+    r = min(r, (metric.shape[1] - protected) // 2)
+    if r <= 0:
+        return _identity
+
+    with torch.no_grad():
+        metric = metric / metric.norm(dim=-1, keepdim=True)
+        a, b = metric[..., ::2, :], metric[..., 1::2, :]
+        scores = a @ b.transpose(-1, -2)
+        if class_token:
+            scores[..., 0, :] = -math.inf
+
+        node_max, node_idx = scores.max(dim=-1)
+        edge_idx = node_max.argsort(dim=-1, descending=True)[..., None]
+        unm_idx = edge_idx[..., r:, :]  # unmerged tokens of A
+        src_idx = edge_idx[..., :r, :]  # merged tokens of A
+        dst_idx = node_idx[..., None].gather(dim=-2, index=src_idx)
+        if class_token:
+            # keep the class token first
+            unm_idx = unm_idx.sort(dim=1)[0]
+
+    def merge(x: torch.Tensor, mode: str = 'mean') -> torch.Tensor:
+        src, dst = x[..., ::2, :], x[..., 1::2, :]
+        n, t1, c = src.shape
+        unm = src.gather(dim=-2, index=unm_idx.expand(n, t1 - r, c))
+        src = src.gather(dim=-2, index=src_idx.expand(n, r, c))
+        dst = dst.scatter_reduce(-2, dst_idx.expand(n, r, c), src, reduce=mode)
+        return torch.cat([unm, dst], dim=1)
+
+    return merge
+
+
+def merge_wavg(merge: Callable, x: torch.Tensor, size: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    """ Merge tokens `x` [N, L, C] as an average weighted by `size` [N, L], the number of patches per token."""
+    size = size[..., None]
+    merged = merge(x * size, mode='sum')
+    size = merge(size, mode='sum')
+    return (merged / size).to(x.dtype), size[..., 0]
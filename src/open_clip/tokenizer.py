@@ -3,10 +3,14 @@
 Copied from https://github.com/openai/CLIP. Originally MIT License, Copyright (c) 2021 OpenAI.
 """
 import gzip
+import heapq
 import html
 import os
 import random
 import string
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from functools import lru_cache, partial
 from typing import Callable, List, Optional, Union
 import warnings
@@ -21,6 +25,7 @@ os.environ["TOKENIZERS_PARALLELISM"] = "false"
 _nltk_init = False
 
 DEFAULT_CONTEXT_LENGTH = 77  # default context length for OpenAI CLIP
+DEFAULT_BPE_CACHE_SIZE = 100_000  # max number of memoized words in SimpleTokenizer BPE cache
 
 
 @lru_cache()
@@ -124,6 +129,63 @@ def canonicalize_text(text, *, keep_punctuation_exact_string=None):
     return text.strip()
 
 
+class BpeCache:
+    """ Bounded LRU cache of BPE merge results w/ hit / miss counters.
+
+    A maxsize of None disables eviction (unbounded, original CLIP behaviour), 0 disables caching.
+    Safe to share between threads (`batch_encode(use_threads=True)`).
+    """
+
+    def __init__(self, maxsize: Optional[int] = DEFAULT_BPE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if self.maxsize == 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if self.maxsize is not None and len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def info(self):
+        return dict(hits=self.hits, misses=self.misses, size=len(self._data), maxsize=self.maxsize)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+
 class SimpleTokenizer(object):
     def __init__(
             self,
@@ -131,7 +193,8 @@ class SimpleTokenizer(object):
             additional_special_tokens: Optional[List[str]] = None,
             context_length: Optional[int] = DEFAULT_CONTEXT_LENGTH,
             clean: str = 'lower',
-            reduction_mask: str = ''
+            reduction_mask: str = '',
+            cache_size: Optional[int] = DEFAULT_BPE_CACHE_SIZE,
     ):
         self.byte_encoder = bytes_to_unicode()
         self.byte_decoder = {v: k for k, v in self.byte_encoder.items()}
@@ -149,7 +212,8 @@ class SimpleTokenizer(object):
         self.encoder = dict(zip(vocab, range(len(vocab))))
         self.decoder = {v: k for k, v in self.encoder.items()}
         self.bpe_ranks = dict(zip(merges, range(len(merges))))
-        self.cache = {t:t for t in special_tokens}
+        self.special_tokens = {t: t for t in special_tokens}
+        self.cache = BpeCache(cache_size)
         special = "|".join(special_tokens)
         self.pat = re.compile(
             special + r"""|'s|'t|'re|'ve|'m|'ll|'d|[\p{L}]+|[\p{N}]|[^\s\p{L}\p{N}]+""",
@@ -164,46 +228,59 @@ class SimpleTokenizer(object):
         self.reduction_fn = get_reduction_mask_fn(reduction_mask) if reduction_mask else None
 
     def bpe(self, token):
-        if token in self.cache:
-            return self.cache[token]
-        word = tuple(token[:-1]) + ( token[-1] + '</w>',)
-        pairs = get_pairs(word)
-
-        if not pairs:
-            return token+'</w>'
-
-        while True:
-            bigram = min(pairs, key = lambda pair: self.bpe_ranks.get(pair, float('inf')))
-            if bigram not in self.bpe_ranks:
-                break
-            first, second = bigram
-            new_word = []
-            i = 0
-            while i < len(word):
-                try:
-                    j = word.index(first, i)
-                    new_word.extend(word[i:j])
-                    i = j
-                except:
-                    new_word.extend(word[i:])
-                    break
-
-                if word[i] == first and i < len(word)-1 and word[i+1] == second:
-                    new_word.append(first+second)
-                    i += 2
-                else:
-                    new_word.append(word[i])
-                    i += 1
-            new_word = tuple(new_word)
-            word = new_word
-            if len(word) == 1:
-                break
-            else:
-                pairs = get_pairs(word)
-        word = ' '.join(word)
-        self.cache[token] = word
+        if token in self.special_tokens:
+            return token
+        if len(token) == 1:
+            return token + '</w>'
+        cached = self.cache.get(token)
+        if cached is not None:
+            return cached
+
+        symbols = list(token[:-1]) + [token[-1] + '</w>']
+
+        # Merge over a doubly linked list of symbols, w/ a heap of candidate pairs keyed by (merge rank, position).
+        # Popping equal ranks left to right merges all (non-overlapping) occurrences of the best pair in the same
+        # order as the reference min() + rebuild loop, but each merge only touches its two neighbouring pairs.
+        num_symbols = len(symbols)
+        prev_idx = list(range(-1, num_symbols - 1))
+        next_idx = list(range(1, num_symbols + 1))
+        next_idx[-1] = -1
+        bpe_ranks = self.bpe_ranks
+        heap = []
+
+        def _push_pair(i):
+            j = next_idx[i]
+            if j != -1:
+                rank = bpe_ranks.get((symbols[i], symbols[j]))
+                if rank is not None:
+                    heapq.heappush(heap, (rank, i, symbols[i], symbols[j]))
+
+        for i in range(num_symbols - 1):
+            _push_pair(i)
+
+        while heap:
+            _, i, first, second = heapq.heappop(heap)
+            j = next_idx[i]
+            # skip stale entries, either symbol changed (merged) since the pair was pushed
+            if symbols[i] != first or j == -1 or symbols[j] != second:
+                continue
+            symbols[i] = first + second
+            symbols[j] = None
+            next_idx[i] = next_idx[j]
+            if next_idx[j] != -1:
+                prev_idx[next_idx[j]] = i
+            if prev_idx[i] != -1:
+                _push_pair(prev_idx[i])
+            _push_pair(i)
+
+        word = ' '.join(s for s in symbols if s is not None)
+        self.cache.put(token, word)
         return word
 
+    def cache_info(self):
+        """ Return BPE cache statistics (hits, misses, size, maxsize) """
+        return self.cache.info()
+
     def encode(self, text):
         bpe_tokens = []
         text = self.clean_fn(text)
@@ -231,32 +308,123 @@ class SimpleTokenizer(object):
         -------
         A two-dimensional tensor containing the resulting tokens, shape = [number of input strings, context_length]
         """
+        return torch.from_numpy(self.batch_encode(texts, context_length=context_length))
+
+    def batch_encode(
+            self,
+            texts: Union[str, List[str]],
+            context_length: Optional[int] = None,
+            dtype: np.dtype = np.int64,
+            out: Optional[np.ndarray] = None,
+            num_workers: int = 0,
+            use_threads: bool = False,
+            chunk_size: int = 4096,
+    ) -> np.ndarray:
+        """ Tokenize a batch of strings into a single (preallocated) numpy buffer
+
+        Parameters
+        ----------
+        texts : Union[str, List[str]]
+            An input string or a list of input strings to tokenize
+        context_length : int
+            The context length to use; all CLIP models use 77 as the context length
+        dtype : np.dtype
+            Integer dtype of the result buffer if `out` is not provided (int32 is sufficient for the CLIP vocab)
+        out : np.ndarray
+            Optional preallocated buffer of shape [number of input strings, context_length] to fill in place
+        num_workers : int
+            Tokenize in chunks across a pool of this many workers, 0 to tokenize in the calling process
+        use_threads : bool
+            Use a thread pool instead of a process pool for num_workers > 0
+        chunk_size : int
+            Number of strings per pool task
+
+        Returns
+        -------
+        A two-dimensional array containing the resulting tokens, shape = [number of input strings, context_length]
+        """
         if isinstance(texts, str):
             texts = [texts]
 
         context_length = context_length or self.context_length
         assert context_length, 'Please set a valid context length'
 
+        if out is None:
+            out = np.zeros((len(texts), context_length), dtype=dtype)
+        else:
+            assert out.shape == (len(texts), context_length), \
+                f'Output buffer shape {out.shape} does not match ({len(texts)}, {context_length}).'
+
+        if num_workers <= 0 or len(texts) <= chunk_size:
+            return self._encode_into(texts, out)
+
+        starts = range(0, len(texts), chunk_size)
+        if use_threads:
+            # threads write directly into their slice of the shared output buffer
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                list(executor.map(lambda i: self._encode_into(texts[i:i + chunk_size], out[i:i + chunk_size]), starts))
+        else:
+            with ProcessPoolExecutor(
+                    max_workers=num_workers, initializer=_init_encode_worker, initargs=(self,)) as executor:
+                chunks = executor.map(
+                    _encode_worker,
+                    [texts[i:i + chunk_size] for i in starts],
+                    [context_length] * len(starts),
+                    [out.dtype] * len(starts),
+                )
+                for i, chunk in zip(starts, chunks):
+                    out[i:i + chunk_size] = chunk
+        return out
+
+    def _encode_into(self, texts: List[str], out: np.ndarray) -> np.ndarray:
         if self.reduction_fn is not None:
             # use reduction strategy for tokenize if set, otherwise default to truncation below
-            return self.reduction_fn(
+            self.reduction_fn(
                 texts,
-                context_length=context_length,
+                context_length=out.shape[1],
                 sot_token_id=self.sot_token_id,
                 eot_token_id=self.eot_token_id,
                 encode_fn=self.encode,
+                out=out,
             )
+            return out
 
         all_tokens = [[self.sot_token_id] + self.encode(text) + [self.eot_token_id] for text in texts]
-        result = torch.zeros(len(all_tokens), context_length, dtype=torch.long)
+        _fill_truncated(out, all_tokens, self.eot_token_id)
+        return out
+
+
+_worker_tokenizer = None
+
+
+def _init_encode_worker(tokenizer):
+    global _worker_tokenizer
+    _worker_tokenizer = tokenizer
+
+
+def _encode_worker(texts, context_length, dtype):
+    out = np.zeros((len(texts), context_length), dtype=dtype)
+    return _worker_tokenizer._encode_into(texts, out)
 
-        for i, tokens in enumerate(all_tokens):
-            if len(tokens) > context_length:
-                tokens = tokens[:context_length]  # Truncate
-                tokens[-1] = self.eot_token_id
-            result[i, :len(tokens)] = torch.tensor(tokens)
 
-        return result
+def _get_output_buffer(num_texts: int, context_length: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+    if out is None:
+        return np.zeros((num_texts, context_length), dtype=np.int64)
+    assert out.shape == (num_texts, context_length)
+    out.fill(0)
+    return out
+
+
+def _fill_truncated(out: np.ndarray, all_tokens: List[List[int]], eot_token_id: int):
+    """ Write token id lists into the rows of `out` (zero padded), truncating to the row length w/ eot last """
+    out.fill(0)
+    context_length = out.shape[1]
+    for i, tokens in enumerate(all_tokens):
+        if len(tokens) > context_length:
+            tokens = tokens[:context_length]  # Truncate
+            tokens[-1] = eot_token_id
+        out[i, :len(tokens)] = tokens
+    return out
 
 
 _tokenizer = SimpleTokenizer()
@@ -278,12 +446,12 @@ def random_mask_tokenize(
         eot_token_id: int,
         encode_fn: Callable,
         shuffle: bool = False,
+        out: Optional[np.ndarray] = None,
 ):
     all_tokens = [encode_fn(text) for text in texts]
-    result = torch.zeros(len(all_tokens), context_length, dtype=torch.long)
+    result = _get_output_buffer(len(all_tokens), context_length, out)
 
     for i, tokens in enumerate(all_tokens):
-        tokens = torch.tensor(tokens)
         num_tokens = len(tokens)
         if num_tokens > context_length - 2:  # 2 for sot and eot token
             num_keep = context_length - 2
@@ -291,13 +459,13 @@ def random_mask_tokenize(
             indices = indices[:num_keep]
             if not shuffle:
                 indices = indices.msort()
-            tokens = tokens[indices]
+            tokens = np.asarray(tokens)[indices.numpy()]
             num_tokens = num_keep
         result[i, 0] = sot_token_id
         result[i, 1:num_tokens + 1] = tokens
         result[i, num_tokens + 1] = eot_token_id
 
-    return result
+    return torch.from_numpy(result)
 
 
 def simple_mask_tokenize(
@@ -306,9 +474,10 @@ def simple_mask_tokenize(
         sot_token_id: int,
         eot_token_id: int,
         encode_fn: Callable,
+        out: Optional[np.ndarray] = None,
 ):
     all_tokens = [encode_fn(text) for text in texts]
-    result = torch.zeros(len(all_tokens), context_length, dtype=torch.long)
+    result = _get_output_buffer(len(all_tokens), context_length, out)
 
     for i, tokens in enumerate(all_tokens):
         num_tokens = len(tokens)
@@ -317,9 +486,9 @@ def simple_mask_tokenize(
             start_index = random.randint(0, num_tokens - num_keep)  # high is incl
             tokens = tokens[start_index: start_index + num_keep]
         tokens = [sot_token_id] + tokens + [eot_token_id]
-        result[i, :len(tokens)] = torch.tensor(tokens)
+        result[i, :len(tokens)] = tokens
 
-    return result
+    return torch.from_numpy(result)
 
 
 def syntax_mask_tokenize(
@@ -328,6 +497,7 @@ def syntax_mask_tokenize(
         sot_token_id: int,
         eot_token_id: int,
         encode_fn: Callable,
+        out: Optional[np.ndarray] = None,
 ) -> torch.LongTensor:
     """ Returns the tokenized representation of given input string(s).
     Apply syntax masking before tokenize.
@@ -369,16 +539,11 @@ def syntax_mask_tokenize(
     texts = new_texts
 
     all_tokens = [[sot_token_id] + encode_fn(text) + [eot_token_id] for text in texts]
-    result = torch.zeros(len(all_tokens), context_length, dtype=torch.long)
-
-    for i, tokens in enumerate(all_tokens):
-        # still need first truncate because some words produces two tokens
-        if len(tokens) > context_length:
-            tokens = tokens[:context_length]  # Truncate
-            tokens[-1] = eot_token_id
-        result[i, :len(tokens)] = torch.tensor(tokens)
+    result = _get_output_buffer(len(all_tokens), context_length, out)
+    # still need first truncate because some words produces two tokens
+    _fill_truncated(result, all_tokens, eot_token_id)
 
-    return result
+    return torch.from_numpy(result)
 
 
 def get_reduction_mask_fn(type: str):
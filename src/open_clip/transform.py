@@ -1,3 +1,4 @@
+import math
 import numbers
 import random
 import warnings
@@ -239,6 +240,85 @@ def _convert_to_rgb(image):
     return image.convert('RGB')
 
 
+class NormalizeUint8(torch.nn.Module):
+    """Converts a uint8 image, or a [..., C, H, W] batch of them, to float and normalizes it.
+    The result is the same as ToTensor() followed by Normalize on each image.
+
+    Args:
+        mean (sequence): Sequence of means for each channel.
+        std (sequence): Sequence of standard deviations for each channel.
+    """
+
+    def __init__(self, mean, std):
+        super().__init__()
+        self.mean = tuple(mean)
+        self.std = tuple(std)
+
+    def forward(self, img):
+        return F.normalize(img.float().div(255), self.mean, self.std, inplace=True)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(mean={self.mean}, std={self.std})"
+
+
+class ToUint8Tensor(torch.nn.Module):
+    """Converts a PIL image to a uint8 CHW tensor, deferring the float conversion and normalization.
+    Data workers then hand over a quarter of the bytes of float images, `normalize` is applied to
+    whole batches by the training / inference process, on device.
+
+    Args:
+        mean (sequence): Sequence of means for each channel.
+        std (sequence): Sequence of standard deviations for each channel.
+    """
+
+    def __init__(self, mean, std):
+        super().__init__()
+        self.normalize = NormalizeUint8(mean, std)
+
+    def forward(self, pic):
+        return F.pil_to_tensor(pic)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(normalize={self.normalize})"
+
+
+def get_uint8_normalize(transform) -> Optional[NormalizeUint8]:
+    """Returns the batch normalization deferred by a uint8 output image transform, None for float output."""
+    transforms = transform.transforms if isinstance(transform, Compose) else [transform]
+    if transforms and isinstance(transforms[-1], ToUint8Tensor):
+        return transforms[-1].normalize
+    return None
+
+
+def get_decode_size(transform) -> Optional[Tuple[int, int]]:
+    """Returns the smallest (width, height) images can be decoded at w/o losing resolution in the transform.
+
+    The size is derived from the first, resizing stage of the transforms built by image_transform() from the
+    preprocess and augmentation cfgs. JPEG decoders can then decode at the smallest DCT scale (1/2, 1/4, 1/8)
+    keeping both sides at least that large (see PIL's Image.draft). None if the transform is not recognized.
+    """
+    transforms = transform.transforms if isinstance(transform, Compose) else [transform]
+    if not transforms:
+        return None
+    first = transforms[0]
+    if all(hasattr(first, attr) for attr in ('size', 'scale', 'ratio')):
+        # random resized crop, the smallest crop (min scale, most extreme aspect ratio) must still cover the size
+        size = max(to_2tuple(first.size))
+        min_ratio = min(min(first.ratio), 1 / max(first.ratio))
+        side = math.ceil(size / math.sqrt(min(first.scale) * min_ratio))
+        return side, side
+    if isinstance(first, (Resize, ResizeKeepRatio)):
+        size = first.size
+        if isinstance(size, numbers.Number) or len(size) == 1:
+            # shortest edge resize, both sides must be >= the size
+            size = int(size if isinstance(size, numbers.Number) else size[0])
+            return size, size
+        # (height, width) targets, keep both sides >= the largest so any resize mode only shrinks
+        side = max(size)
+        return side, side
+    return None
+
+
 class color_jitter(object):
     """
     Apply Color Jitter to the PIL image with a specified probability.
@@ -280,6 +360,7 @@ def image_transform(
         interpolation: Optional[str] = None,
         fill_color: int = 0,
         aug_cfg: Optional[Union[Dict[str, Any], AugmentationCfg]] = None,
+        uint8_output: bool = False,
 ):
     mean = mean or OPENAI_DATASET_MEAN
     if not isinstance(mean, (list, tuple)):
@@ -303,11 +384,14 @@ def image_transform(
         aug_cfg = aug_cfg or AugmentationCfg()
 
     normalize = Normalize(mean=mean, std=std)
+    # uint8 output stops at a uint8 CHW tensor, see get_uint8_normalize() for the deferred normalization
+    to_tensor = [ToUint8Tensor(mean=mean, std=std)] if uint8_output else [ToTensor(), normalize]
 
     if is_train:
         aug_cfg_dict = {k: v for k, v in asdict(aug_cfg).items() if v is not None}
         use_timm = aug_cfg_dict.pop('use_timm', False)
         if use_timm:
+            assert not uint8_output, 'uint8 output is not supported w/ timm augmentations'
             from timm.data import create_transform  # timm can still be optional
             if isinstance(image_size, (tuple, list)):
                 assert len(image_size) >= 2
@@ -348,10 +432,7 @@ def image_transform(
                 train_transform.extend([
                     gray_scale(aug_cfg.gray_scale_prob)
                 ])
-            train_transform.extend([
-                ToTensor(),
-                normalize,
-            ])
+            train_transform.extend(to_tensor)
             train_transform = Compose(train_transform)
             if aug_cfg_dict:
                 warnings.warn(f'Unused augmentation cfg items, specify `use_timm` to use ({list(aug_cfg_dict.keys())}).')
@@ -382,11 +463,8 @@ def image_transform(
                 transforms = [ResizeKeepRatio(image_size)]
             transforms += [CenterCrop(image_size)]
 
-        transforms.extend([
-            _convert_to_rgb,
-            ToTensor(),
-            normalize,
-        ])
+        transforms.append(_convert_to_rgb)
+        transforms.extend(to_tensor)
         return Compose(transforms)
 
 
@@ -394,6 +472,7 @@ def image_transform_v2(
         cfg: PreprocessCfg,
         is_train: bool,
         aug_cfg: Optional[Union[Dict[str, Any], AugmentationCfg]] = None,
+        uint8_output: bool = False,
 ):
     return image_transform(
         image_size=cfg.size,
@@ -404,4 +483,5 @@ def image_transform_v2(
         resize_mode=cfg.resize_mode,
         fill_color=cfg.fill_color,
         aug_cfg=aug_cfg,
+        uint8_output=uint8_output,
     )
@@ -1,6 +1,8 @@
 from collections import OrderedDict
+from contextlib import nullcontext
 import math
-from typing import Callable, Optional, Sequence, Tuple
+import os
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
 from functools import partial
 
 import torch
@@ -10,6 +12,97 @@ from torch.utils.checkpoint import checkpoint
 
 from .utils import to_2tuple
 from .pos_embed import get_2d_sincos_pos_embed
+from .token_merging import bipartite_soft_matching, merge_wavg
+from .activation_offload import ActivationOffload, parse_layer_selection
+
+# route attention through F.scaled_dot_product_attention (torch >= 2.0), OPENCLIP_FUSED_ATTN=0 to disable
+_HAS_FUSED_ATTN = hasattr(F, 'scaled_dot_product_attention')
+_USE_FUSED_ATTN = _HAS_FUSED_ATTN and int(os.environ.get('OPENCLIP_FUSED_ATTN', 1)) > 0
+
+
+def use_fused_attn() -> bool:
+    return _USE_FUSED_ATTN
+
+
+def set_fused_attn(enable: bool = True):
+    """ Set the attention backend of modules created from here on, existing modules keep their `fused_attn`. """
+    global _USE_FUSED_ATTN
+    assert not enable or _HAS_FUSED_ATTN, 'F.scaled_dot_product_attention requires PyTorch 2.0 or newer.'
+    _USE_FUSED_ATTN = enable
+
+
+def scaled_dot_product_attention(
+        q: torch.Tensor,
+        k: torch.Tensor,
+        v: torch.Tensor,
+        attn_mask: Optional[torch.Tensor] = None,
+        dropout_p: float = 0.,
+        is_causal: bool = False,
+        fused: bool = True,
+):
+    """ Attention over [N, heads, L, head_dim] inputs w/ F.scaled_dot_product_attention semantics
+    (float masks are added, bool masks are True where attending), using eager ops if not `fused`.
+    """
+    if fused:
+        return F.scaled_dot_product_attention(q, k, v, attn_mask=attn_mask, dropout_p=dropout_p, is_causal=is_causal)
+
+    attn = (q * q.shape[-1] ** -0.5) @ k.transpose(-1, -2)
+    if is_causal:
+        causal_mask = torch.ones(q.shape[-2], k.shape[-2], dtype=torch.bool, device=q.device).triu_(1)
+        attn = attn.masked_fill(causal_mask, float('-inf'))
+    if attn_mask is not None:
+        if attn_mask.dtype == torch.bool:
+            attn = attn.masked_fill(~attn_mask, float('-inf'))
+        else:
+            attn = attn + attn_mask
+    attn = attn.softmax(dim=-1)
+    if dropout_p > 0.:
+        attn = F.dropout(attn, p=dropout_p)
+    return attn @ v
+
+
+def _split_heads(x: torch.Tensor, num_heads: int, batch_first: bool = False):
+    # [L, N, C] (or [N, L, C] if batch_first) -> [N, heads, L, head_dim]
+    if batch_first:
+        N, L, C = x.shape
+        return x.reshape(N, L, num_heads, C // num_heads).transpose(1, 2)
+    L, N, C = x.shape
+    return x.reshape(L, N, num_heads, C // num_heads).permute(1, 2, 0, 3)
+
+
+def _merge_heads(x: torch.Tensor, batch_first: bool = False):
+    # [N, heads, L, head_dim] -> [L, N, C] (or [N, L, C] if batch_first)
+    N, H, L, D = x.shape
+    if batch_first:
+        return x.transpose(1, 2).reshape(N, L, H * D)
+    return x.permute(2, 0, 1, 3).reshape(L, N, H * D)
+
+
+def parse_grad_checkpointing(policy: Union[bool, str, None]) -> Optional[Tuple[str, float]]:
+    """ Parse an activation checkpointing policy into (mode, value), None if checkpointing is disabled.
+
+    * True / 'all': every block
+    * 'every:N': every N-th block, starting w/ the first
+    * 'first:K': the first K blocks
+    * 'attn' / 'mlp': only the attention / MLP branch of every block
+    * 'auto:GB': the fewest blocks keeping the estimated activation memory of each transformer under GB
+    """
+    if policy is None or policy is False or policy == 'none':
+        return None
+    if policy is True or policy == 'all':
+        return 'all', 0.
+    mode, _, value = str(policy).partition(':')
+    if mode in ('attn', 'mlp') and not value:
+        return mode, 0.
+    try:
+        if mode in ('every', 'first') and int(value) >= (mode == 'every'):
+            return mode, float(int(value))
+        if mode == 'auto' and float(value) >= 0.:
+            return mode, float(value)
+    except ValueError:
+        pass
+    raise ValueError(
+        f'Unknown grad checkpointing policy {policy}, expected one of all, every:N, first:K, attn, mlp or auto:GB.')
 
 
 class LayerNormFp32(nn.LayerNorm):
@@ -87,6 +180,9 @@ class PatchDropout(nn.Module):
 
 
 class Attention(nn.Module):
+    fused_attn: torch.jit.Final[bool]
+    batch_first: torch.jit.Final[bool]
+
     def __init__(
             self,
             dim,
@@ -96,9 +192,11 @@ class Attention(nn.Module):
             scale_heads=False,
             logit_scale_max=math.log(1. / 0.01),
             attn_drop=0.,
-            proj_drop=0.
+            proj_drop=0.,
+            batch_first=False,
     ):
         super().__init__()
+        self.batch_first = batch_first
         self.scaled_cosine = scaled_cosine
         self.scale_heads = scale_heads
         assert dim % num_heads == 0, 'dim should be divisible by num_heads'
@@ -125,10 +223,39 @@ class Attention(nn.Module):
             self.head_scale = None
         self.out_proj = nn.Linear(dim, dim)
         self.out_drop = nn.Dropout(proj_drop)
+        # scaled cosine and head scale attention stay on the eager path
+        self.fused_attn = use_fused_attn() and not scaled_cosine and not scale_heads
 
     def forward(self, x, attn_mask: Optional[torch.Tensor] = None):
-        L, N, C = x.shape
+        if self.batch_first:
+            N, L, C = x.shape
+        else:
+            L, N, C = x.shape
         q, k, v = F.linear(x, self.in_proj_weight, self.in_proj_bias).chunk(3, dim=-1)
+        if self.fused_attn:
+            if attn_mask is not None:
+                if attn_mask.dtype == torch.bool:
+                    # True marks masked positions here, the inverse of scaled_dot_product_attention
+                    attn_mask = ~attn_mask
+                else:
+                    attn_mask = attn_mask.to(q.dtype)
+                if attn_mask.dim() == 3:
+                    # [N * heads, L, L] -> [N, heads, L, L]
+                    attn_mask = attn_mask.reshape(N, self.num_heads, L, L)
+            x = scaled_dot_product_attention(
+                _split_heads(q, self.num_heads, self.batch_first),
+                _split_heads(k, self.num_heads, self.batch_first),
+                _split_heads(v, self.num_heads, self.batch_first),
+                attn_mask=attn_mask,
+                dropout_p=self.attn_drop.p if self.training else 0.,
+            )
+            x = self.out_proj(_merge_heads(x, self.batch_first))
+            x = self.out_drop(x)
+            return x
+
+        if self.batch_first:
+            # eager path computes in LND
+            q, k, v = q.transpose(0, 1), k.transpose(0, 1), v.transpose(0, 1)
         q = q.contiguous().view(L, N * self.num_heads, -1).transpose(0, 1)
         k = k.contiguous().view(L, N * self.num_heads, -1).transpose(0, 1)
         v = v.contiguous().view(L, N * self.num_heads, -1).transpose(0, 1)
@@ -154,15 +281,20 @@ class Attention(nn.Module):
 
         x = torch.bmm(attn, v)
         if self.head_scale is not None:
-            x = x.view(N, self.num_heads, L, C) * self.head_scale
-            x = x.view(-1, L, C)
-        x = x.transpose(0, 1).reshape(L, N, C)
+            x = x.view(N, self.num_heads, L, self.head_dim) * self.head_scale
+            x = x.view(-1, L, self.head_dim)
+        if self.batch_first:
+            x = x.view(N, self.num_heads, L, -1).transpose(1, 2).reshape(N, L, C)
+        else:
+            x = x.transpose(0, 1).reshape(L, N, C)
         x = self.out_proj(x)
         x = self.out_drop(x)
         return x
 
 
 class AttentionalPooler(nn.Module):
+    fused_attn: torch.jit.Final[bool]
+
     def __init__(
             self,
             d_model: int,
@@ -173,19 +305,44 @@ class AttentionalPooler(nn.Module):
     ):
         super().__init__()
         self.query = nn.Parameter(torch.randn(n_queries, d_model))
-        self.attn = nn.MultiheadAttention(d_model, n_head, kdim=context_dim, vdim=context_dim)
+        self.attn = nn.MultiheadAttention(d_model, n_head, kdim=context_dim, vdim=context_dim, batch_first=True)
         self.ln_q = norm_layer(d_model)
         self.ln_k = norm_layer(context_dim)
+        self.fused_attn = use_fused_attn()
 
     def forward(self, x: torch.Tensor):
-        x = self.ln_k(x).permute(1, 0, 2)  # NLD -> LND
-        N = x.shape[1]
+        x = self.ln_k(x)
+        N = x.shape[0]
         q = self.ln_q(self.query)
-        out = self.attn(q.unsqueeze(1).expand(-1, N, -1), x, x, need_weights=False)[0]
-        return out.permute(1, 0, 2)  # LND -> NLD
+        if self.fused_attn and not torch.jit.is_scripting():
+            return self._fused_attention(q, x)
+        return self.attn(q.unsqueeze(0).expand(N, -1, -1), x, x, need_weights=False)[0]
+
+    @torch.jit.unused
+    def _fused_attention(self, q: torch.Tensor, x: torch.Tensor):
+        # same parameters as nn.MultiheadAttention, separate q / k / v weights if context_dim != d_model
+        if self.attn._qkv_same_embed_dim:
+            w_q, w_k, w_v = self.attn.in_proj_weight.chunk(3)
+        else:
+            w_q, w_k, w_v = self.attn.q_proj_weight, self.attn.k_proj_weight, self.attn.v_proj_weight
+        b_q = b_k = b_v = None
+        if self.attn.in_proj_bias is not None:
+            b_q, b_k, b_v = self.attn.in_proj_bias.chunk(3)
+
+        num_heads = self.attn.num_heads
+        # the queries are shared by the batch, project them once
+        q = _split_heads(F.linear(q, w_q, b_q).unsqueeze(0), num_heads, True).expand(x.shape[0], -1, -1, -1)
+        k = _split_heads(F.linear(x, w_k, b_k), num_heads, True)
+        v = _split_heads(F.linear(x, w_v, b_v), num_heads, True)
+        out = scaled_dot_product_attention(
+            q, k, v, dropout_p=self.attn.dropout if self.training else 0.)
+        return self.attn.out_proj(_merge_heads(out, True))
 
 
 class ResidualAttentionBlock(nn.Module):
+    fused_attn: torch.jit.Final[bool]
+    batch_first: torch.jit.Final[bool]
+
     def __init__(
             self,
             d_model: int,
@@ -195,11 +352,13 @@ class ResidualAttentionBlock(nn.Module):
             act_layer: Callable = nn.GELU,
             norm_layer: Callable = LayerNorm,
             is_cross_attention: bool = False,
+            batch_first: bool = False,
     ):
         super().__init__()
+        self.batch_first = batch_first
 
         self.ln_1 = norm_layer(d_model)
-        self.attn = nn.MultiheadAttention(d_model, n_head)
+        self.attn = nn.MultiheadAttention(d_model, n_head, batch_first=batch_first)
         self.ls_1 = LayerScale(d_model, ls_init_value) if ls_init_value is not None else nn.Identity()
         if is_cross_attention:
             self.ln_1_kv = norm_layer(d_model)
@@ -212,6 +371,7 @@ class ResidualAttentionBlock(nn.Module):
             ("c_proj", nn.Linear(mlp_width, d_model))
         ]))
         self.ls_2 = LayerScale(d_model, ls_init_value) if ls_init_value is not None else nn.Identity()
+        self.fused_attn = use_fused_attn()
 
     def attention(
             self,
@@ -219,7 +379,11 @@ class ResidualAttentionBlock(nn.Module):
             k_x: Optional[torch.Tensor] = None,
             v_x: Optional[torch.Tensor] = None,
             attn_mask: Optional[torch.Tensor] = None,
+            is_causal: bool = False,
     ):
+        if self.fused_attn:
+            return self._fused_attention(q_x, k_x=k_x, v_x=v_x, attn_mask=attn_mask, is_causal=is_causal)
+
         k_x = k_x if k_x is not None else q_x
         v_x = v_x if v_x is not None else q_x
 
@@ -228,20 +392,178 @@ class ResidualAttentionBlock(nn.Module):
             q_x, k_x, v_x, need_weights=False, attn_mask=attn_mask
         )[0]
 
+    def _fused_attention(
+            self,
+            q_x: torch.Tensor,
+            k_x: Optional[torch.Tensor] = None,
+            v_x: Optional[torch.Tensor] = None,
+            attn_mask: Optional[torch.Tensor] = None,
+            is_causal: bool = False,
+    ):
+        # nn.MultiheadAttention parameters, F.scaled_dot_product_attention compute
+        num_heads = self.attn.num_heads
+        if k_x is None and v_x is None:
+            q, k, v = F.linear(q_x, self.attn.in_proj_weight, self.attn.in_proj_bias).chunk(3, dim=-1)
+        else:
+            k_x = k_x if k_x is not None else q_x
+            v_x = v_x if v_x is not None else q_x
+            w_q, w_k, w_v = self.attn.in_proj_weight.chunk(3)
+            b_q: Optional[torch.Tensor] = None
+            b_k: Optional[torch.Tensor] = None
+            b_v: Optional[torch.Tensor] = None
+            in_proj_bias = self.attn.in_proj_bias
+            if in_proj_bias is not None:
+                b_q, b_k, b_v = in_proj_bias.chunk(3)
+            q, k, v = F.linear(q_x, w_q, b_q), F.linear(k_x, w_k, b_k), F.linear(v_x, w_v, b_v)
+
+        q = _split_heads(q, num_heads, self.batch_first)
+        k = _split_heads(k, num_heads, self.batch_first)
+        v = _split_heads(v, num_heads, self.batch_first)
+        if is_causal:
+            # causal mask passed along for the eager path only, the fused kernel builds its own
+            attn_mask = None
+        elif attn_mask is not None:
+            attn_mask = attn_mask.to(q.dtype)
+            if attn_mask.dim() == 3:
+                # [N * heads, L, S] -> [N, heads, L, S]
+                attn_mask = attn_mask.reshape(q.shape[0], num_heads, q.shape[2], k.shape[2])
+        x = scaled_dot_product_attention(
+            q, k, v,
+            attn_mask=attn_mask,
+            dropout_p=self.attn.dropout if self.training else 0.,
+            is_causal=is_causal,
+        )
+        return self.attn.out_proj(_merge_heads(x, self.batch_first))
+
     def forward(
             self,
             q_x: torch.Tensor,
             k_x: Optional[torch.Tensor] = None,
             v_x: Optional[torch.Tensor] = None,
             attn_mask: Optional[torch.Tensor] = None,
+            is_causal: bool = False,
+    ):
+        x = q_x + self._attn_branch(q_x, k_x=k_x, v_x=v_x, attn_mask=attn_mask, is_causal=is_causal)
+        x = x + self._mlp_branch(x)
+        return x
+
+    def _attn_branch(
+            self,
+            q_x: torch.Tensor,
+            k_x: Optional[torch.Tensor] = None,
+            v_x: Optional[torch.Tensor] = None,
+            attn_mask: Optional[torch.Tensor] = None,
+            is_causal: bool = False,
     ):
         k_x = self.ln_1_kv(k_x) if hasattr(self, "ln_1_kv") and k_x is not None else None
         v_x = self.ln_1_kv(v_x) if hasattr(self, "ln_1_kv") and v_x is not None else None
+        return self.ls_1(self.attention(
+            q_x=self.ln_1(q_x), k_x=k_x, v_x=v_x, attn_mask=attn_mask, is_causal=is_causal))
+
+    def _mlp_branch(self, x: torch.Tensor):
+        return self.ls_2(self.mlp(self.ln_2(x)))
+
+    @torch.jit.unused
+    def forward_checkpointed(
+            self,
+            q_x: torch.Tensor,
+            k_x: Optional[torch.Tensor] = None,
+            v_x: Optional[torch.Tensor] = None,
+            attn_mask: Optional[torch.Tensor] = None,
+            is_causal: bool = False,
+            policy: str = 'block',
+    ):
+        """ Forward w/ activation checkpointing of the whole block ('block') or of its 'attn' / 'mlp' branch only."""
+        # TODO: handle kwargs https://github.com/pytorch/pytorch/issues/79887#issuecomment-1161758372
+        if policy == 'block':
+            return checkpoint(self, q_x, k_x, v_x, attn_mask, is_causal)
+        if policy == 'attn':
+            x = q_x + checkpoint(self._attn_branch, q_x, k_x, v_x, attn_mask, is_causal)
+        else:
+            x = q_x + self._attn_branch(q_x, k_x=k_x, v_x=v_x, attn_mask=attn_mask, is_causal=is_causal)
+        if policy == 'mlp':
+            return x + checkpoint(self._mlp_branch, x)
+        return x + self._mlp_branch(x)
 
-        x = q_x + self.ls_1(self.attention(q_x=self.ln_1(q_x), k_x=k_x, v_x=v_x, attn_mask=attn_mask))
+    def cached_attention(
+            self,
+            q_x: torch.Tensor,
+            kv_cache: Dict[str, torch.Tensor],
+            k_x: Optional[torch.Tensor] = None,
+            attn_mask: Optional[torch.Tensor] = None,
+    ):
+        """ Attention w/ keys / values cached across calls, kept as [N, heads, S, head_dim] in `kv_cache`.
+
+        Self-attention appends the keys / values of the new positions in `q_x` to the cache. For cross-attention
+        (`k_x` given) the keys / values are projected from `k_x` on the first call and reused afterwards.
+        """
+        C = q_x.shape[-1]
+        num_heads = self.attn.num_heads
+
+        weight, bias = self.attn.in_proj_weight, self.attn.in_proj_bias
+        q = F.linear(q_x, weight[:C], bias[:C] if bias is not None else None)
+        if k_x is None or 'k' not in kv_cache:
+            kv_x = q_x if k_x is None else k_x
+            k, v = F.linear(kv_x, weight[C:], bias[C:] if bias is not None else None).chunk(2, dim=-1)
+            k, v = _split_heads(k, num_heads, self.batch_first), _split_heads(v, num_heads, self.batch_first)
+            if k_x is None and 'k' in kv_cache:
+                k = torch.cat([kv_cache['k'], k], dim=2)
+                v = torch.cat([kv_cache['v'], v], dim=2)
+            kv_cache['k'], kv_cache['v'] = k, v
+        else:
+            k, v = kv_cache['k'], kv_cache['v']
+
+        x = scaled_dot_product_attention(
+            _split_heads(q, num_heads, self.batch_first), k, v,
+            attn_mask=attn_mask.to(q.dtype) if attn_mask is not None else None,
+            fused=self.fused_attn,
+        )
+        return self.attn.out_proj(_merge_heads(x, self.batch_first))
+
+    def forward_cached(
+            self,
+            q_x: torch.Tensor,
+            kv_cache: Dict[str, torch.Tensor],
+            k_x: Optional[torch.Tensor] = None,
+            attn_mask: Optional[torch.Tensor] = None,
+    ):
+        """ Incremental forward for autoregressive decoding, `q_x` holds only the positions not yet in `kv_cache`."""
+        if k_x is not None and 'k' not in kv_cache:
+            k_x = self.ln_1_kv(k_x)
+        x = q_x + self.ls_1(self.cached_attention(self.ln_1(q_x), kv_cache, k_x=k_x, attn_mask=attn_mask))
         x = x + self.ls_2(self.mlp(self.ln_2(x)))
         return x
 
+    def forward_merged(
+            self,
+            x: torch.Tensor,
+            size: torch.Tensor,
+            merge_ratio: float,
+            class_token: bool = True,
+    ):
+        """ Forward merging `merge_ratio` of the tokens between attention and MLP (ToMe), `x` is NLD in any layout.
+
+        `size` [N, L] holds the number of patches each token stands for. It is added as log(size) to the attention
+        logits (proportional attention) and merged along w/ the tokens. Tokens are matched by their keys.
+        """
+        num_heads = self.attn.num_heads
+        q, k, v = F.linear(self.ln_1(x), self.attn.in_proj_weight, self.attn.in_proj_bias).chunk(3, dim=-1)
+        q, k, v = _split_heads(q, num_heads, True), _split_heads(k, num_heads, True), _split_heads(v, num_heads, True)
+        attn = scaled_dot_product_attention(
+            q, k, v,
+            attn_mask=size.log()[:, None, None, :].to(q.dtype),
+            fused=self.fused_attn,
+        )
+        x = x + self.ls_1(self.attn.out_proj(_merge_heads(attn, True)))
+
+        r = int((x.shape[1] - int(class_token)) * merge_ratio)
+        if r > 0:
+            merge = bipartite_soft_matching(k.mean(dim=1), r, class_token=class_token)
+            x, size = merge_wavg(merge, x, size)
+
+        x = x + self.ls_2(self.mlp(self.ln_2(x)))
+        return x, size
+
 
 class CustomResidualAttentionBlock(nn.Module):
     def __init__(
@@ -256,6 +578,7 @@ class CustomResidualAttentionBlock(nn.Module):
             scale_heads: bool = False,
             scale_attn: bool = False,
             scale_fc: bool = False,
+            batch_first: bool = False,
     ):
         super().__init__()
 
@@ -264,6 +587,7 @@ class CustomResidualAttentionBlock(nn.Module):
             d_model, n_head,
             scaled_cosine=scale_cosine_attn,
             scale_heads=scale_heads,
+            batch_first=batch_first,
         )
         self.ln_attn = norm_layer(d_model) if scale_attn else nn.Identity()
         self.ls_1 = LayerScale(d_model, ls_init_value) if ls_init_value is not None else nn.Identity()
@@ -289,6 +613,8 @@ def _expand_token(token, batch_size: int):
 
 
 class Transformer(nn.Module):
+    batch_first: torch.jit.Final[bool]
+
     def __init__(
             self,
             width: int,
@@ -298,15 +624,26 @@ class Transformer(nn.Module):
             ls_init_value: float = None,
             act_layer: Callable = nn.GELU,
             norm_layer: Callable = LayerNorm,
+            batch_first: bool = False,
     ):
         super().__init__()
         self.width = width
         self.layers = layers
+        self.batch_first = batch_first  # NLD in / out if True, LND otherwise
         self.grad_checkpointing = False
+        self.grad_checkpointing_policy = ('all', 0.)
+        self.activation_offload_layers: List[int] = []
 
         self.resblocks = nn.ModuleList([
             ResidualAttentionBlock(
-                width, heads, mlp_ratio, ls_init_value=ls_init_value, act_layer=act_layer, norm_layer=norm_layer)
+                width,
+                heads,
+                mlp_ratio,
+                ls_init_value=ls_init_value,
+                act_layer=act_layer,
+                norm_layer=norm_layer,
+                batch_first=batch_first,
+            )
             for _ in range(layers)
         ])
 
@@ -315,18 +652,107 @@ class Transformer(nn.Module):
             return self.resblocks[0].mlp.c_fc.int8_original_dtype
         return self.resblocks[0].mlp.c_fc.weight.dtype
 
-    def forward(self, x: torch.Tensor, attn_mask: Optional[torch.Tensor] = None):
+    @torch.jit.ignore
+    def set_grad_checkpointing(self, enable: Union[bool, str] = True):
+        """ Enable activation checkpointing of the resblocks, `enable` is a policy (see parse_grad_checkpointing)."""
+        policy = parse_grad_checkpointing(enable)
+        self.grad_checkpointing = policy is not None
+        if policy is not None:
+            self.grad_checkpointing_policy = policy
+
+    @torch.jit.ignore
+    def set_activation_offload(self, layers: Union[bool, str, Sequence[int]] = True):
+        """ Offload the activations saved by the selected resblocks to host memory (see parse_layer_selection)."""
+        self.activation_offload_layers = parse_layer_selection(layers, len(self.resblocks))
+
+    @torch.jit.ignore
+    def offload_contexts(self) -> List:
+        """ Context for each layer of a forward, saving activations to host memory for the offloaded layers."""
+        offload = ActivationOffload() if self.activation_offload_layers else None
+        return [
+            offload.layer(i) if offload is not None and i in self.activation_offload_layers else nullcontext()
+            for i in range(len(self.resblocks))
+        ]
+
+    @torch.jit.ignore
+    def checkpoint_plan(self, x: torch.Tensor, blocks_per_layer: int = 1) -> List[str]:
+        """ Checkpointing of each layer for input `x`, 'block', 'attn', 'mlp' or '' (not checkpointed)."""
+        mode, value = self.grad_checkpointing_policy
+        num_layers = len(self.resblocks)
+        if mode in ('attn', 'mlp'):
+            return [mode] * num_layers
+        if mode == 'every':
+            return ['block' if i % int(value) == 0 else '' for i in range(num_layers)]
+        if mode == 'first':
+            num_checkpointed = int(value)
+        elif mode == 'auto':
+            num_checkpointed = self._num_checkpointed_for_budget(x, value * 2 ** 30, blocks_per_layer)
+        else:
+            num_checkpointed = num_layers
+        return ['block' if i < num_checkpointed else '' for i in range(num_layers)]
+
+    def _num_checkpointed_for_budget(self, x: torch.Tensor, budget_bytes: float, blocks_per_layer: int = 1):
+        block = self.resblocks[0]
+        seq_len = x.shape[1] if self.batch_first else x.shape[0]
+        itemsize = 2 if torch.is_autocast_enabled() else x.element_size()
+        input_bytes = x.numel() * itemsize
+        # activations kept for backward by one block, in units of its input: ln_1 in / out, q / k/ v, attention
+        # out, ln_2 in / out and the MLP hidden before / after the activation
+        mlp_ratio = block.mlp.c_fc.out_features / self.width
+        layer_bytes = input_bytes * (8 + 2 * mlp_ratio)
+        if not block.fused_attn:
+            # attention probabilities and their softmax input
+            layer_bytes += 2 * x.numel() // self.width * block.attn.num_heads * seq_len * itemsize
+        layer_bytes *= blocks_per_layer
+
+        # checkpointed layers keep their input only
+        num_layers = len(self.resblocks)
+        for num_checkpointed in range(num_layers + 1):
+            if (num_layers - num_checkpointed) * layer_bytes + num_checkpointed * input_bytes <= budget_bytes:
+                return num_checkpointed
+        return num_layers
+
+    def forward(self, x: torch.Tensor, attn_mask: Optional[torch.Tensor] = None, is_causal: bool = False):
+        # is_causal: attn_mask is the plain causal mask, fused attention can skip it
+        if (self.grad_checkpointing or len(self.activation_offload_layers) > 0) and not torch.jit.is_scripting():
+            return self._forward_memory_efficient(x, attn_mask=attn_mask, is_causal=is_causal)
         for r in self.resblocks:
-            if self.grad_checkpointing and not torch.jit.is_scripting():
-                # TODO: handle kwargs https://github.com/pytorch/pytorch/issues/79887#issuecomment-1161758372
-                x = checkpoint(r, x, None, None, attn_mask)
-            else:
-                x = r(x, attn_mask=attn_mask)
+            x = r(x, attn_mask=attn_mask, is_causal=is_causal)
+        return x
+
+    @torch.jit.unused
+    def _forward_memory_efficient(
+            self,
+            x: torch.Tensor,
+            attn_mask: Optional[torch.Tensor] = None,
+            is_causal: bool = False,
+    ):
+        plan = self.checkpoint_plan(x) if self.grad_checkpointing else [''] * len(self.resblocks)
+        for r, policy, offload_context in zip(self.resblocks, plan, self.offload_contexts()):
+            with offload_context:
+                if policy:
+                    x = r.forward_checkpointed(x, attn_mask=attn_mask, is_causal=is_causal, policy=policy)
+                else:
+                    x = r(x, attn_mask=attn_mask, is_causal=is_causal)
+        return x
+
+    def forward_cached(
+            self,
+            x: torch.Tensor,
+            kv_caches: List[Dict[str, torch.Tensor]],
+            attn_mask: Optional[torch.Tensor] = None,
+    ):
+        """ Incremental forward w/ one key / value cache per block in `kv_caches` (filled on first call)."""
+        if not kv_caches:
+            kv_caches.extend({} for _ in self.resblocks)
+        for r, kv_cache in zip(self.resblocks, kv_caches):
+            x = r.forward_cached(x, kv_cache, attn_mask=attn_mask)
         return x
 
 
 class VisionTransformer(nn.Module):
     output_tokens: torch.jit.Final[bool]
+    token_merging: bool
 
     def __init__(
             self,
@@ -349,6 +775,8 @@ class VisionTransformer(nn.Module):
             act_layer: Callable = nn.GELU,
             norm_layer: Callable = LayerNorm,
             output_tokens: bool = False,
+            batch_first: bool = False,
+            token_merge_ratio: Union[float, Sequence[float]] = 0.,
     ):
         super().__init__()
         assert pool_type in ('tok', 'avg', 'none')
@@ -390,7 +818,9 @@ class VisionTransformer(nn.Module):
             ls_init_value=ls_init_value,
             act_layer=act_layer,
             norm_layer=norm_layer,
+            batch_first=batch_first,
         )
+        self.set_token_merging(token_merge_ratio)
 
         if attentional_pool:
             if isinstance(attentional_pool, str):
@@ -486,8 +916,33 @@ class VisionTransformer(nn.Module):
         pass
 
     @torch.jit.ignore
-    def set_grad_checkpointing(self, enable=True):
-        self.transformer.grad_checkpointing = enable
+    def set_grad_checkpointing(self, enable: Union[bool, str] = True):
+        self.transformer.set_grad_checkpointing(enable)
+
+    @torch.jit.ignore
+    def set_activation_offload(self, layers: Union[bool, str, Sequence[int]] = True):
+        self.transformer.set_activation_offload(layers)
+
+    @torch.jit.ignore
+    def set_token_merging(self, ratio: Union[float, Sequence[float]] = 0.):
+        """ Merge `ratio` of the tokens in each block at inference (ToMe, https://arxiv.org/abs/2210.09461).
+
+        A sequence sets the ratio per block, 0 disables merging. With merging enabled the number of tokens
+        returned w/ `output_tokens` is reduced accordingly.
+        """
+        if isinstance(ratio, (int, float)):
+            ratio = [ratio] * self.transformer.layers
+        assert len(ratio) == self.transformer.layers, 'one merge ratio per block expected'
+        assert all(0. <= r <= 0.5 for r in ratio), 'merge ratios must be in [0, 0.5]'
+        self.token_merge_ratio = [float(r) for r in ratio]
+        self.token_merging = any(r > 0. for r in ratio)
+
+    @torch.jit.unused
+    def _forward_merged(self, x: torch.Tensor):
+        size = torch.ones(x.shape[:2], device=x.device)
+        for ratio, block in zip(self.token_merge_ratio, self.transformer.resblocks):
+            x, size = block.forward_merged(x, size, ratio)
+        return x
 
     def _global_pool(self, x: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
         if self.pool_type == 'avg':
@@ -512,9 +967,14 @@ class VisionTransformer(nn.Module):
         x = self.patch_dropout(x)
         x = self.ln_pre(x)
 
-        x = x.permute(1, 0, 2)  # NLD -> LND
-        x = self.transformer(x)
-        x = x.permute(1, 0, 2)  # LND -> NLD
+        if self.token_merging and not self.training and not torch.jit.is_scripting():
+            x = self._forward_merged(x)
+        elif self.transformer.batch_first:
+            x = self.transformer(x)
+        else:
+            x = x.permute(1, 0, 2)  # NLD -> LND
+            x = self.transformer(x)
+            x = x.permute(1, 0, 2)  # LND -> NLD
 
         if self.attn_pool is not None:
             if self.attn_pool_contrastive is not None:
@@ -580,9 +1040,11 @@ class TextTransformer(nn.Module):
             pad_id: int = 0,
             pool_type: str = 'argmax',
             proj_bias: bool = False,
+            trim_padding: bool = False,
             act_layer: Callable = nn.GELU,
             norm_layer: Callable = LayerNorm,
             output_tokens: bool = False,
+            batch_first: bool = False,
     ):
         super().__init__()
         assert pool_type in ('first', 'last', 'argmax', 'none')
@@ -610,6 +1072,7 @@ class TextTransformer(nn.Module):
             ls_init_value=ls_init_value,
             act_layer=act_layer,
             norm_layer=norm_layer,
+            batch_first=batch_first,
         )
         self.ln_final = norm_layer(width)
 
@@ -623,6 +1086,9 @@ class TextTransformer(nn.Module):
         else:
             self.text_projection = nn.Parameter(torch.empty(width, output_dim))
 
+        self.trim_padding = False
+        self.set_trim_padding(trim_padding)
+
         self.init_parameters()
 
     def init_parameters(self):
@@ -649,8 +1115,24 @@ class TextTransformer(nn.Module):
                 nn.init.normal_(self.text_projection, std=self.transformer.width ** -0.5)
 
     @torch.jit.ignore
-    def set_grad_checkpointing(self, enable=True):
-        self.transformer.grad_checkpointing = enable
+    def set_grad_checkpointing(self, enable: Union[bool, str] = True):
+        self.transformer.set_grad_checkpointing(enable)
+
+    @torch.jit.ignore
+    def set_activation_offload(self, layers: Union[bool, str, Sequence[int]] = True):
+        self.transformer.set_activation_offload(layers)
+
+    def supports_trim_padding(self):
+        # causal attention + EOT (argmax) pooling never look past the EOT token
+        return self.attn_mask is not None and self.cls_emb is None and self.pool_type == 'argmax' \
+            and not self.output_tokens
+
+    @torch.jit.ignore
+    def set_trim_padding(self, enable=True):
+        """ Trim each batch to its longest sequence (up to the EOT token) before running the transformer. """
+        assert not enable or self.supports_trim_padding(), \
+            'Trimming padding requires a causal mask and argmax pooling w/o cls token or token outputs.'
+        self.trim_padding = enable
 
     def build_causal_mask(self):
         # lazily create causal attention mask, with full attention between the tokens
@@ -670,6 +1152,9 @@ class TextTransformer(nn.Module):
         return additive_mask
 
     def forward(self, text):
+        if self.trim_padding:
+            # EOT is the highest token id, nothing after the last EOT of the batch affects the pooled output
+            text = text[:, :int(text.argmax(dim=-1).max()) + 1]
         cast_dtype = self.transformer.get_cast_dtype()
         seq_len = text.shape[1]
 
@@ -681,11 +1166,17 @@ class TextTransformer(nn.Module):
             cls_mask = self.build_cls_mask(text, cast_dtype)
             if attn_mask is not None:
                 attn_mask = attn_mask[None, :seq_len, :seq_len] + cls_mask[:, :seq_len, :seq_len]
+        elif attn_mask is not None:
+            attn_mask = attn_mask[:seq_len, :seq_len]
 
         x = x + self.positional_embedding[:seq_len].to(cast_dtype)
-        x = x.permute(1, 0, 2)  # NLD -> LND
-        x = self.transformer(x, attn_mask=attn_mask)
-        x = x.permute(1, 0, 2)  # LND -> NLD
+        is_causal = attn_mask is not None and self.cls_emb is None
+        if self.transformer.batch_first:
+            x = self.transformer(x, attn_mask=attn_mask, is_causal=is_causal)
+        else:
+            x = x.permute(1, 0, 2)  # NLD -> LND
+            x = self.transformer(x, attn_mask=attn_mask, is_causal=is_causal)
+            x = x.permute(1, 0, 2)  # LND -> NLD
 
         # x.shape = [batch_size, n_ctx, transformer.width]
         if self.cls_emb is not None:
@@ -707,6 +1198,48 @@ class TextTransformer(nn.Module):
 
         return pooled
 
+    def supports_kv_cache(self):
+        # incremental decoding needs a causal mask and token outputs for every position
+        return self.attn_mask is not None and (self.cls_emb is not None or self.pool_type in ('argmax', 'none'))
+
+    def forward_cached(
+            self,
+            text,
+            kv_caches: List[Dict[str, torch.Tensor]],
+            offset: Union[int, torch.Tensor] = 0,
+            attn_mask: Optional[torch.Tensor] = None,
+    ):
+        """ Token embeddings (as returned w/ `output_tokens`) for `text` at positions `offset` onwards.
+
+        Keys / values of the previous positions are read from, and the new ones appended to `kv_caches`.
+        The appended CLS token of CoCa only attends to the text and is not needed for decoding, so it is skipped.
+        For rows at different positions (continuous batching) pass a per-row `offset` tensor along w/ an `attn_mask`
+        covering the cached keys of each row.
+        """
+        assert self.supports_kv_cache()
+        cast_dtype = self.transformer.get_cast_dtype()
+        seq_len = text.shape[1]
+
+        x = self.token_embedding(text).to(cast_dtype)
+        if isinstance(offset, torch.Tensor):
+            positions = offset[:, None] + torch.arange(seq_len, device=offset.device)
+            x = x + self.positional_embedding[positions].to(cast_dtype)
+            assert attn_mask is not None, 'attn_mask is required w/ per-row offsets'
+        else:
+            x = x + self.positional_embedding[offset:offset + seq_len].to(cast_dtype)
+        if attn_mask is None:
+            attn_mask = self.attn_mask[offset:offset + seq_len, :offset + seq_len]
+        if self.transformer.batch_first:
+            x = self.transformer.forward_cached(x, kv_caches, attn_mask=attn_mask)
+        else:
+            x = x.permute(1, 0, 2)  # NLD -> LND
+            x = self.transformer.forward_cached(x, kv_caches, attn_mask=attn_mask)
+            x = x.permute(1, 0, 2)  # LND -> NLD
+
+        if self.cls_emb is None:
+            x = self.ln_final(x)
+        return x
+
 
 class MultimodalTransformer(Transformer):
     def __init__(
@@ -720,6 +1253,7 @@ class MultimodalTransformer(Transformer):
             act_layer: Callable = nn.GELU,
             norm_layer: Callable = LayerNorm,
             output_dim: int = 512,
+            batch_first: bool = False,
     ):
 
         super().__init__(
@@ -730,6 +1264,7 @@ class MultimodalTransformer(Transformer):
             ls_init_value=ls_init_value,
             act_layer=act_layer,
             norm_layer=norm_layer,
+            batch_first=batch_first,
         )
         self.context_length = context_length
         self.cross_attn = nn.ModuleList([
@@ -741,6 +1276,7 @@ class MultimodalTransformer(Transformer):
                 act_layer=act_layer,
                 norm_layer=norm_layer,
                 is_cross_attention=True,
+                batch_first=batch_first,
             )
             for _ in range(layers)
         ])
@@ -777,20 +1313,20 @@ class MultimodalTransformer(Transformer):
         return mask
 
     def forward(self, image_embs, text_embs):
-        text_embs = text_embs.permute(1, 0, 2)  # NLD -> LNDsq
-        image_embs = image_embs.permute(1, 0, 2)  # NLD -> LND
-        seq_len = text_embs.shape[0]
-
-        for resblock, cross_attn in zip(self.resblocks, self.cross_attn):
-            if self.grad_checkpointing and not torch.jit.is_scripting():
-                # TODO: handle kwargs https://github.com/pytorch/pytorch/issues/79887#issuecomment-1161758372
-                text_embs = checkpoint(resblock, text_embs, None, None, self.attn_mask[:seq_len, :seq_len])
-                text_embs = checkpoint(cross_attn, text_embs, image_embs, image_embs, None)
-            else:
-                text_embs = resblock(text_embs, attn_mask=self.attn_mask[:seq_len, :seq_len])
+        if not self.batch_first:
+            text_embs = text_embs.permute(1, 0, 2)  # NLD -> LNDsq
+            image_embs = image_embs.permute(1, 0, 2)  # NLD -> LND
+        seq_len = text_embs.shape[1] if self.batch_first else text_embs.shape[0]
+
+        if (self.grad_checkpointing or len(self.activation_offload_layers) > 0) and not torch.jit.is_scripting():
+            text_embs = self._forward_layers_memory_efficient(
+                image_embs, text_embs, self.attn_mask[:seq_len, :seq_len])
+        else:
+            for resblock, cross_attn in zip(self.resblocks, self.cross_attn):
+                text_embs = resblock(text_embs, attn_mask=self.attn_mask[:seq_len, :seq_len], is_causal=True)
                 text_embs = cross_attn(text_embs, k_x=image_embs, v_x=image_embs)
 
-        x = text_embs.permute(1, 0, 2)  # LND -> NLD
+        x = text_embs if self.batch_first else text_embs.permute(1, 0, 2)  # LND -> NLD
         x = self.ln_final(x)
 
         if self.text_projection is not None:
@@ -798,6 +1334,63 @@ class MultimodalTransformer(Transformer):
 
         return x
 
-    @torch.jit.ignore
-    def set_grad_checkpointing(self, enable=True):
-        self.grad_checkpointing = enable
+    def forward_cached(
+            self,
+            image_embs: torch.Tensor,
+            text_embs: torch.Tensor,
+            kv_caches: List[Dict[str, torch.Tensor]],
+            cross_kv_caches: List[Dict[str, torch.Tensor]],
+            offset: int = 0,
+            attn_mask: Optional[torch.Tensor] = None,
+    ):
+        """ Incremental forward for `text_embs` at positions `offset` onwards.
+
+        Self-attention keys / values of previous positions are kept in `kv_caches`, the image keys / values of the
+        cross-attention are projected once on the first call and kept in `cross_kv_caches`. An explicit `attn_mask`
+        replaces the causal mask slice at `offset`.
+        """
+        if not kv_caches:
+            kv_caches.extend({} for _ in self.resblocks)
+        if not cross_kv_caches:
+            cross_kv_caches.extend({} for _ in self.cross_attn)
+        if not self.batch_first:
+            text_embs = text_embs.permute(1, 0, 2)  # NLD -> LND
+            image_embs = image_embs.permute(1, 0, 2)  # NLD -> LND
+        seq_len = text_embs.shape[1] if self.batch_first else text_embs.shape[0]
+        if attn_mask is None:
+            attn_mask = self.attn_mask[offset:offset + seq_len, :offset + seq_len]
+
+        for resblock, cross_attn, kv_cache, cross_kv_cache in zip(
+                self.resblocks, self.cross_attn, kv_caches, cross_kv_caches):
+            text_embs = resblock.forward_cached(text_embs, kv_cache, attn_mask=attn_mask)
+            text_embs = cross_attn.forward_cached(text_embs, cross_kv_cache, k_x=image_embs)
+
+        x = text_embs if self.batch_first else text_embs.permute(1, 0, 2)  # LND -> NLD
+        x = self.ln_final(x)
+
+        if self.text_projection is not None:
+            x = x @ self.text_projection
+
+        return x
+
+    @torch.jit.unused
+    def _forward_layers_memory_efficient(
+            self,
+            image_embs: torch.Tensor,
+            text_embs: torch.Tensor,
+            attn_mask: torch.Tensor,
+    ):
+        # a layer is a self-attention and a cross-attention block
+        plan = self.checkpoint_plan(text_embs, blocks_per_layer=2) if self.grad_checkpointing \
+            else [''] * len(self.resblocks)
+        for resblock, cross_attn, policy, offload_context in zip(
+                self.resblocks, self.cross_attn, plan, self.offload_contexts()):
+            with offload_context:
+                if policy:
+                    text_embs = resblock.forward_checkpointed(
+                        text_embs, attn_mask=attn_mask, is_causal=True, policy=policy)
+                    text_embs = cross_attn.forward_checkpointed(text_embs, image_embs, image_embs, policy=policy)
+                else:
+                    text_embs = resblock(text_embs, attn_mask=attn_mask, is_causal=True)
+                    text_embs = cross_attn(text_embs, k_x=image_embs, v_x=image_embs)
+        return text_embs
@@ -1,3 +1,7 @@
+import hashlib
+import json
+import logging
+import os
 from functools import partial
 from itertools import islice
 from typing import Callable, List, Optional, Sequence, Union
@@ -5,6 +9,13 @@ from typing import Callable, List, Optional, Sequence, Union
 import torch
 import torch.nn.functional as F
 
+from .transformer import TextTransformer
+
+# parameters that never affect encode_text, left out of the classifier cache key
+_NON_TEXT_PREFIXES = ('visual.', 'text_decoder.', 'logit_scale', 'logit_bias')
+# parameter name prefix of torch.compile'd models
+_COMPILED_PREFIX = '_orig_mod.'
+
 
 def batched(iterable, n):
     """Batch data into lists of length *n*. The last batch may be shorter.
@@ -18,6 +29,134 @@ def batched(iterable, n):
         yield batch
 
 
+def _fn_name(fn):
+    if fn is None:
+        return None
+    if isinstance(fn, partial):
+        return f'{_fn_name(fn.func)}({sorted(fn.keywords.items())})'
+    return getattr(fn, '__qualname__', type(fn).__name__)
+
+
+def _tokenizer_config(tokenizer):
+    cfg = dict(type=type(tokenizer).__name__)
+    for attr in ('context_length', 'vocab_size', 'sot_token_id', 'eot_token_id', 'strip_sep_token'):
+        if hasattr(tokenizer, attr):
+            cfg[attr] = getattr(tokenizer, attr)
+    for attr in ('clean_fn', 'reduction_fn'):
+        if hasattr(tokenizer, attr):
+            cfg[attr] = _fn_name(getattr(tokenizer, attr))
+    if hasattr(tokenizer, 'tokenizer'):
+        # HF / SigLIP tokenizer wrappers
+        cfg['name_or_path'] = getattr(tokenizer.tokenizer, 'name_or_path', None)
+    return cfg
+
+
+def _text_config(model):
+    # architecture settings outside of the state dict that change encode_text (non-persistent causal mask, pooling)
+    model = getattr(model, _COMPILED_PREFIX[:-1], model)
+    cfg = dict(type=type(model).__name__)
+    if hasattr(model, 'text_pool_type'):
+        # CLIP w/ built-in text tower
+        cfg['text_pool_type'] = model.text_pool_type
+        cfg['causal'] = model.attn_mask is not None
+    text = getattr(model, 'text', None)
+    if text is not None:
+        cfg['text_type'] = type(text).__name__
+        for attr in ('pool_type', 'pad_id', 'output_tokens'):
+            if hasattr(text, attr):
+                cfg[f'text_{attr}'] = getattr(text, attr)
+        if hasattr(text, 'attn_mask'):
+            cfg['text_causal'] = text.attn_mask is not None
+        if hasattr(text, 'pooler'):
+            # HF text towers
+            cfg['text_pooler'] = type(text.pooler).__name__
+    return cfg
+
+
+def _autocast_config():
+    # the classifier is built under the training precision's autocast (if any)
+    cfg = dict(enabled=torch.is_autocast_enabled())
+    if cfg['enabled']:
+        cfg['dtype'] = str(torch.get_autocast_gpu_dtype())
+    return cfg
+
+
+def get_zero_shot_classifier_cache_key(
+        model,
+        tokenizer,
+        classnames: Sequence[str],
+        templates: Sequence[Union[Callable, str]],
+):
+    """ Content hash identifying zero-shot classifier weights.
+    Covers the text tower state dict and config, the autocast state, the tokenizer config and the prompts
+    rendered from classnames x templates (so callable templates are keyed by their output).
+    """
+    use_format = isinstance(templates[0], str)
+    h = hashlib.sha256()
+    h.update(json.dumps(_tokenizer_config(tokenizer), sort_keys=True, default=str).encode('utf-8'))
+    h.update(json.dumps(_text_config(model), sort_keys=True, default=str).encode('utf-8'))
+    h.update(json.dumps(_autocast_config(), sort_keys=True).encode('utf-8'))
+    h.update(json.dumps(
+        [len(classnames), len(templates)] +
+        [template.format(c) if use_format else template(c) for c in classnames for template in templates]
+    ).encode('utf-8'))
+    for name, tensor in model.state_dict().items():
+        if name.startswith(_COMPILED_PREFIX):
+            name = name[len(_COMPILED_PREFIX):]
+        if name.startswith(_NON_TEXT_PREFIXES):
+            continue
+        tensor = tensor.detach().cpu()
+        h.update(f'{name}:{tensor.dtype}:{tuple(tensor.shape)}'.encode('utf-8'))
+        # upcast so bf16 / fp16 can go through numpy, exact for both
+        tensor = tensor.float() if tensor.is_floating_point() else tensor
+        h.update(tensor.contiguous().numpy().tobytes())
+    return h.hexdigest()
+
+
+def _supports_trimmed_text(model):
+    # causal attention + EOT (argmax) pooling never look past the EOT token, trailing padding can be dropped
+    if hasattr(model, 'text_pool_type'):
+        # CLIP w/ built-in text tower
+        return model.attn_mask is not None and model.text_pool_type == 'argmax'
+    text = getattr(model, 'text', None)
+    if isinstance(text, TextTransformer):
+        return text.supports_trim_padding()
+    return False
+
+
+def _encode_prompts(
+        model,
+        tokenizer,
+        prompts: Sequence[str],
+        batch_size: Optional[int] = None,
+        device: Union[str, torch.device] = 'cpu',
+        use_tqdm: bool = False,
+):
+    """ Encode (normalized) `prompts` in batches of similar token length, each trimmed to its longest prompt
+    when that doesn't change the text features.
+    """
+    tokens = tokenizer(prompts)
+    trim = _supports_trimmed_text(model)
+    # position of the last non-pad token + 1
+    lengths = tokens.shape[1] - (tokens != 0).flip(1).int().argmax(dim=1)
+    # longest first so a batch that doesn't fit shows up right away
+    batches = torch.argsort(lengths, descending=True).split(batch_size or len(prompts))
+    if use_tqdm:
+        import tqdm
+        batches = tqdm.tqdm(batches)
+
+    embeddings = None
+    for batch_indices in batches:
+        batch_tokens = tokens[batch_indices]
+        if trim:
+            batch_tokens = batch_tokens[:, :int(lengths[batch_indices].max())]
+        batch_embeddings = model.encode_text(batch_tokens.to(device), normalize=True)
+        if embeddings is None:
+            embeddings = batch_embeddings.new_empty((len(prompts), batch_embeddings.shape[-1]))
+        embeddings[batch_indices.to(embeddings.device)] = batch_embeddings
+    return embeddings
+
+
 def build_zero_shot_classifier(
         model,
         tokenizer,
@@ -26,6 +165,8 @@ def build_zero_shot_classifier(
         num_classes_per_batch: Optional[int] = 10,
         device: Union[str, torch.device] = 'cpu',
         use_tqdm: bool = False,
+        cache_dir: Optional[str] = None,
+        bucket_prompts: bool = True,
 ):
     """ Build zero-shot classifier weights by iterating over class names in batches
     Args:
@@ -36,12 +177,58 @@ def build_zero_shot_classifier(
         num_classes_per_batch: The number of classes to batch together in each forward, all if None
         device: Device to use.
         use_tqdm: Enable TQDM progress bar.
+        cache_dir: Directory of a persistent classifier cache, keyed by `get_zero_shot_classifier_cache_key`
+        bucket_prompts: Encode unique prompts sorted by token length w/ padding trimmed per batch, instead of
+            fixed groups of classes (batches hold num_classes_per_batch * len(templates) prompts either way)
     """
     assert isinstance(templates, Sequence) and len(templates) > 0
     assert isinstance(classnames, Sequence) and len(classnames) > 0
+    if cache_dir:
+        cache_file = os.path.join(
+            cache_dir, get_zero_shot_classifier_cache_key(model, tokenizer, classnames, templates) + '.pt')
+        if os.path.isfile(cache_file):
+            logging.info(f'Loading zero-shot classifier from cache {cache_file}.')
+            return torch.load(cache_file, map_location=device)
+
+        zeroshot_weights = build_zero_shot_classifier(
+            model,
+            tokenizer,
+            classnames,
+            templates,
+            num_classes_per_batch=num_classes_per_batch,
+            device=device,
+            use_tqdm=use_tqdm,
+            bucket_prompts=bucket_prompts,
+        )
+        os.makedirs(cache_dir, exist_ok=True)
+        # write then rename so concurrent readers never see a partial file
+        tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+        torch.save(zeroshot_weights.cpu(), tmp_file)
+        os.replace(tmp_file, cache_file)
+        return zeroshot_weights
+
     use_format = isinstance(templates[0], str)
     num_templates = len(templates)
     num_classes = len(classnames)
+    if bucket_prompts:
+        prompts = [template.format(c) if use_format else template(c) for c in classnames for template in templates]
+        # duplicate prompts (e.g. repeated classnames) are encoded once and scattered back
+        unique_prompts = {p: i for i, p in enumerate(dict.fromkeys(prompts))}
+        prompt_indices = torch.tensor([unique_prompts[p] for p in prompts])
+        with torch.no_grad():
+            embeddings = _encode_prompts(
+                model,
+                tokenizer,
+                list(unique_prompts),
+                batch_size=num_classes_per_batch * num_templates if num_classes_per_batch else None,
+                device=device,
+                use_tqdm=use_tqdm,
+            )
+            class_embeddings = embeddings[prompt_indices.to(embeddings.device)]
+            class_embeddings = class_embeddings.reshape(num_classes, num_templates, -1).mean(dim=1)
+            class_embeddings = class_embeddings / class_embeddings.norm(dim=1, keepdim=True)
+        return class_embeddings.T
+
     if use_tqdm:
         import tqdm
         num_iter = 1 if num_classes_per_batch is None else ((num_classes - 1) // num_classes_per_batch + 1)
@@ -0,0 +1,82 @@
+import argparse
+import time
+
+import torch
+import pandas as pd
+
+import open_clip
+from open_clip.utils import to_2tuple
+
+parser = argparse.ArgumentParser(description='OpenCLIP Attention Backend Benchmark')
+
+parser.add_argument('--models', default='ViT-B-32,ViT-B-16,coca_ViT-B-32', type=str,
+                    help='Comma separated model configs to benchmark')
+parser.add_argument('--batch-size', default=8, type=int)
+parser.add_argument('--repeats', default=5, type=int, help='Number of timed forwards per config')
+parser.add_argument('--threads', default=0, type=int, help='Number of CPU threads, torch default if 0')
+parser.add_argument('--device', default='cpu', type=str)
+parser.add_argument('--results-file', default='', type=str, metavar='FILENAME',
+                    help='Output csv file for results')
+
+
+def set_fused_attn(model, enable):
+    for m in model.modules():
+        if hasattr(m, 'fused_attn'):
+            m.fused_attn = enable
+
+
+def benchmark_fn(fn, repeats, device):
+    fn()  # warmup
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        out = fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeats, out
+
+
+def main():
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    device = torch.device(args.device)
+
+    results = []
+    for model_name in args.models.split(','):
+        model = open_clip.create_model(model_name, device=device)
+        model.eval()
+        tokenizer = open_clip.get_tokenizer(model_name)
+        images = torch.randn(args.batch_size, 3, *to_2tuple(model.visual.image_size), device=device)
+        text = tokenizer(['a photo of a cat sitting on a chair'] * args.batch_size).to(device)
+
+        outputs = {}
+        for fused in (False, True):
+            set_fused_attn(model, fused)
+            with torch.no_grad():
+                image_time, image_features = benchmark_fn(lambda: model.encode_image(images), args.repeats, device)
+                text_time, text_features = benchmark_fn(lambda: model.encode_text(text), args.repeats, device)
+            outputs[fused] = (image_features, text_features)
+            results.append({
+                'model': model_name,
+                'fused_attn': fused,
+                'image_ms': round(image_time * 1000, 2),
+                'text_ms': round(text_time * 1000, 2),
+            })
+            print(results[-1])
+
+        results[-1]['image_speedup'] = round(results[-2]['image_ms'] / results[-1]['image_ms'], 2)
+        results[-1]['text_speedup'] = round(results[-2]['text_ms'] / results[-1]['text_ms'], 2)
+        results[-1]['max_abs_diff'] = max(
+            (f - e).abs().max().item() for f, e in zip(outputs[True], outputs[False]))
+
+    df = pd.DataFrame(results)
+    print('=' * 100)
+    print(df)
+    if args.results_file:
+        df.to_csv(args.results_file, index=False)
+
+
+if __name__ == '__main__':
+    main()
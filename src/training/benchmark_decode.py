@@ -0,0 +1,82 @@
+import argparse
+import io
+import time
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from open_clip import get_decode_size, image_transform
+from training.data import open_image
+
+parser = argparse.ArgumentParser(description='OpenCLIP JPEG draft mode decode benchmark (single worker)')
+
+parser.add_argument('--source-sizes', default='640x480,1600x1200,2048x1536', type=str,
+                    help='Comma separated WxH sizes of the encoded source JPEGs')
+parser.add_argument('--image-size', default=224, type=int, help='Transform output image size')
+parser.add_argument('--num-images', default=32, type=int, help='Number of distinct source images per size')
+parser.add_argument('--quality', default=90, type=int, help='JPEG quality of the source images')
+parser.add_argument('--min-time', default=2., type=float, help='Minimum seconds to decode + transform per setting')
+parser.add_argument('--results-file', default='', type=str, metavar='FILENAME',
+                    help='Output csv file for results')
+
+
+def make_jpegs(width, height, num_images, quality):
+    """Encode smooth random images w/ some noise, closer to photos than pure noise in entropy."""
+    rng = np.random.RandomState(0)
+    jpegs = []
+    for _ in range(num_images):
+        low_res = rng.randint(0, 256, size=(8, 8, 3), dtype=np.uint8)
+        image = Image.fromarray(low_res).resize((width, height), Image.BICUBIC)
+        noise = rng.randint(-8, 9, size=(height, width, 3))
+        image = Image.fromarray(np.clip(np.asarray(image, dtype=np.int64) + noise, 0, 255).astype(np.uint8))
+        stream = io.BytesIO()
+        image.save(stream, format='JPEG', quality=quality)
+        jpegs.append(stream.getvalue())
+    return jpegs
+
+
+def benchmark_decode(jpegs, transform, decode_size, min_time):
+    num_samples = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < min_time:
+        for jpeg in jpegs:
+            with io.BytesIO(jpeg) as stream:
+                transform(open_image(stream, decode_size).convert('RGB'))
+        num_samples += len(jpegs)
+    return num_samples / (time.perf_counter() - start)
+
+
+def main():
+    args = parser.parse_args()
+
+    results = []
+    for source_size in args.source_sizes.split(','):
+        width, height = (int(s) for s in source_size.split('x'))
+        jpegs = make_jpegs(width, height, args.num_images, args.quality)
+        for is_train in (True, False):
+            transform = image_transform(args.image_size, is_train=is_train)
+            decode_size = get_decode_size(transform)
+            with io.BytesIO(jpegs[0]) as stream:
+                decoded_size = open_image(stream, decode_size).size
+            full = benchmark_decode(jpegs, transform, None, args.min_time)
+            draft = benchmark_decode(jpegs, transform, decode_size, args.min_time)
+            results.append({
+                'source_size': source_size,
+                'is_train': is_train,
+                'decode_size': 'x'.join(str(s) for s in decoded_size),
+                'full_samples_per_s': round(full, 1),
+                'draft_samples_per_s': round(draft, 1),
+                'speedup': round(draft / full, 2),
+            })
+            print(results[-1])
+
+    df = pd.DataFrame(results)
+    print('=' * 100)
+    print(df)
+    if args.results_file:
+        df.to_csv(args.results_file, index=False)
+
+
+if __name__ == '__main__':
+    main()
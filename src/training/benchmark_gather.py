@@ -0,0 +1,135 @@
+import argparse
+import os
+import socket
+import time
+
+import torch
+import torch.distributed as dist
+import torch.distributed.nn
+import torch.multiprocessing as mp
+import torch.nn.functional as F
+import pandas as pd
+from torch import nn
+
+from open_clip.loss import AsyncImageGather, ClipLoss
+
+parser = argparse.ArgumentParser(description='OpenCLIP feature gather benchmark (gloo, CPU)')
+
+parser.add_argument('--world-size', default=4, type=int, help='Number of processes')
+parser.add_argument('--batch-size', default=256, type=int, help='Per process batch size')
+parser.add_argument('--embed-dim', default=512, type=int, help='Feature dimension')
+parser.add_argument('--width', default=1024, type=int, help='Width of the (MLP) image and text towers')
+parser.add_argument('--depth', default=4, type=int, help='Number of layers of the image and text towers')
+parser.add_argument('--steps', default=20, type=int, help='Number of timed steps')
+parser.add_argument('--warmup', default=5, type=int, help='Number of untimed warmup steps')
+parser.add_argument('--local-loss', default=False, action='store_true')
+parser.add_argument('--gather-with-grad', default=False, action='store_true')
+parser.add_argument('--results-file', default='', type=str, metavar='FILENAME',
+                    help='Output csv file for results')
+
+MODES = ('unfused', 'fused', 'async')
+
+
+class UnfusedClipLoss(ClipLoss):
+    """ClipLoss w/ the previous gather, one all_gather per feature into freshly allocated buffers."""
+
+    def gather_features(self, image_features, text_features, buffers=None):
+        if self.gather_with_grad:
+            all_image_features = torch.cat(torch.distributed.nn.all_gather(image_features), dim=0)
+            all_text_features = torch.cat(torch.distributed.nn.all_gather(text_features), dim=0)
+        else:
+            gathered_image_features = [torch.zeros_like(image_features) for _ in range(self.world_size)]
+            gathered_text_features = [torch.zeros_like(text_features) for _ in range(self.world_size)]
+            dist.all_gather(gathered_image_features, image_features)
+            dist.all_gather(gathered_text_features, text_features)
+            if not self.local_loss:
+                gathered_image_features[self.rank] = image_features
+                gathered_text_features[self.rank] = text_features
+            all_image_features = torch.cat(gathered_image_features, dim=0)
+            all_text_features = torch.cat(gathered_text_features, dim=0)
+        return all_image_features, all_text_features
+
+
+def _mlp(width, depth, embed_dim):
+    layers = []
+    for _ in range(depth):
+        layers += [nn.Linear(width, width), nn.GELU()]
+    return nn.Sequential(*layers, nn.Linear(width, embed_dim))
+
+
+class Towers(nn.Module):
+    def __init__(self, width, depth, embed_dim):
+        super().__init__()
+        self.visual = _mlp(width, depth, embed_dim)
+        self.text = _mlp(width, depth, embed_dim)
+
+    def forward(self, image, text):
+        return F.normalize(self.visual(image), dim=-1), F.normalize(self.text(text), dim=-1)
+
+
+def benchmark_mode(mode, rank, args):
+    torch.manual_seed(0)
+    model = Towers(args.width, args.depth, args.embed_dim)
+    loss_cls = UnfusedClipLoss if mode == 'unfused' else ClipLoss
+    loss = loss_cls(
+        local_loss=args.local_loss, gather_with_grad=args.gather_with_grad, rank=rank, world_size=args.world_size)
+    if mode == 'async':
+        loss.async_gather = AsyncImageGather(args.local_loss, args.gather_with_grad, rank, args.world_size)
+        loss.async_gather.register(model)
+
+    image = torch.randn(args.batch_size, args.width)
+    text = torch.randn(args.batch_size, args.width)
+    logit_scale = torch.tensor(10.)
+    for step in range(args.warmup + args.steps):
+        if step == args.warmup:
+            dist.barrier()
+            start = time.perf_counter()
+        model.zero_grad()
+        image_features, text_features = model(image, text)
+        loss(image_features, text_features, logit_scale).backward()
+    dist.barrier()
+    return (time.perf_counter() - start) / args.steps
+
+
+def _benchmark_worker(rank, port, args, queue):
+    os.environ['MASTER_ADDR'] = '127.0.0.1'
+    os.environ['MASTER_PORT'] = str(port)
+    # leave the cores to the other processes
+    torch.set_num_threads(max(os.cpu_count() // args.world_size, 1))
+    dist.init_process_group('gloo', rank=rank, world_size=args.world_size)
+    step_times = {mode: benchmark_mode(mode, rank, args) for mode in MODES}
+    if rank == 0:
+        queue.put(step_times)
+    dist.destroy_process_group()
+
+
+def main():
+    args = parser.parse_args()
+
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    queue = mp.get_context('spawn').SimpleQueue()
+    mp.spawn(_benchmark_worker, args=(port, args, queue), nprocs=args.world_size)
+    step_times = queue.get()
+
+    results = []
+    for mode in MODES:
+        results.append({
+            'mode': mode,
+            'world_size': args.world_size,
+            'batch_size': args.batch_size,
+            'step_time_ms': round(step_times[mode] * 1000, 2),
+            'speedup': round(step_times['unfused'] / step_times[mode], 3),
+        })
+        print(results[-1])
+
+    df = pd.DataFrame(results)
+    print('=' * 100)
+    print(df)
+    if args.results_file:
+        df.to_csv(args.results_file, index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+import argparse
+import time
+
+import torch
+import pandas as pd
+
+import open_clip
+
+parser = argparse.ArgumentParser(description='OpenCLIP CoCa Generation Benchmark')
+
+parser.add_argument('--model', default='coca_ViT-B-32', type=str, help='CoCa model name')
+parser.add_argument('--pretrained', default='', type=str, help='Pretrained weights, random init if not set')
+parser.add_argument('--batch-size', default=4, type=int, help='Number of images to caption at once')
+parser.add_argument('--seq-len', default=30, type=int, help='Generated sequence length')
+parser.add_argument('--generation-types', default='top_k,top_p,beam_search', type=str,
+                    help='Comma separated generation types to benchmark')
+parser.add_argument('--num-beams', default=6, type=int)
+parser.add_argument('--num-beam-groups', default=3, type=int)
+parser.add_argument('--repeats', default=3, type=int, help='Number of timed generate calls per config')
+parser.add_argument('--device', default='cpu', type=str)
+parser.add_argument('--results-file', default='', type=str, metavar='FILENAME',
+                    help='Output csv file for results')
+
+
+def benchmark_generate(model, images, generation_type, use_cache, args):
+    kwargs = dict(
+        generation_type=generation_type,
+        seq_len=args.seq_len,
+        num_beams=args.num_beams,
+        num_beam_groups=args.num_beam_groups,
+        use_cache=use_cache,
+    )
+    if generation_type != 'beam_search':
+        # force full length sequences so sampling runs w/ and w/o cache do the same amount of work
+        kwargs.update(min_seq_len=args.seq_len - 1, fixed_output_length=True)
+
+    torch.manual_seed(0)
+    model.generate(images, **kwargs)  # warmup
+    elapsed, num_tokens = 0., 0
+    for _ in range(args.repeats):
+        torch.manual_seed(0)
+        if images.device.type == 'cuda':
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        output = model.generate(images, **kwargs)
+        if images.device.type == 'cuda':
+            torch.cuda.synchronize()
+        elapsed += time.perf_counter() - start
+        num_tokens += output.shape[0] * (output.shape[1] - 1)  # sot token is not generated
+    return elapsed / args.repeats, num_tokens / elapsed, output
+
+
+def main():
+    args = parser.parse_args()
+    device = torch.device(args.device)
+
+    model, _, _ = open_clip.create_model_and_transforms(args.model, pretrained=args.pretrained or None, device=device)
+    model.eval()
+    image_size = model.visual.image_size
+    images = torch.randn(args.batch_size, 3, *image_size, device=device)
+
+    results = []
+    for generation_type in args.generation_types.split(','):
+        outputs = {}
+        for use_cache in (False, True):
+            elapsed, tokens_per_s, outputs[use_cache] = benchmark_generate(
+                model, images, generation_type, use_cache, args)
+            results.append({
+                'generation_type': generation_type,
+                'use_cache': use_cache,
+                'time_ms': round(elapsed * 1000, 2),
+                'tokens_per_s': round(tokens_per_s, 1),
+            })
+            print(results[-1])
+        results[-1]['speedup'] = round(results[-1]['tokens_per_s'] / results[-2]['tokens_per_s'], 2)
+        results[-1]['identical'] = torch.equal(outputs[False], outputs[True])
+
+    df = pd.DataFrame(results)
+    print('=' * 100)
+    print(df)
+    if args.results_file:
+        df.to_csv(args.results_file, index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import argparse
+import time
+
+import torch
+import pandas as pd
+from torch.profiler import profile, ProfilerActivity
+
+import open_clip
+from open_clip.utils import to_2tuple
+
+parser = argparse.ArgumentParser(description='OpenCLIP Transformer Layout (LND vs NLD) Benchmark')
+
+parser.add_argument('--models', default='ViT-B-32,ViT-B-16,coca_ViT-B-32', type=str,
+                    help='Comma separated model configs to benchmark')
+parser.add_argument('--batch-size', default=8, type=int)
+parser.add_argument('--repeats', default=5, type=int, help='Number of timed forwards per config')
+parser.add_argument('--threads', default=0, type=int, help='Number of CPU threads, torch default if 0')
+parser.add_argument('--device', default='cpu', type=str)
+parser.add_argument('--results-file', default='', type=str, metavar='FILENAME',
+                    help='Output csv file for results')
+
+# ops materializing a layout change
+LAYOUT_OPS = ('aten::permute', 'aten::transpose', 'aten::contiguous', 'aten::copy_', 'aten::clone')
+
+
+def create_model(model_name, batch_first, device):
+    model_cfg = open_clip.get_model_config(model_name)
+    overrides = {}
+    for cfg_key in ('vision_cfg', 'text_cfg', 'multimodal_cfg'):
+        if cfg_key in model_cfg:
+            overrides[cfg_key] = dict(model_cfg[cfg_key], batch_first=batch_first)
+    return open_clip.create_model(model_name, device=device, **overrides)
+
+
+def benchmark_fn(fn, repeats, device):
+    fn()  # warmup
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        out = fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeats, out
+
+
+def profile_fn(fn, device):
+    activities = [ProfilerActivity.CPU]
+    if device.type == 'cuda':
+        activities.append(ProfilerActivity.CUDA)
+    with profile(activities=activities, profile_memory=True) as prof:
+        fn()
+    events = prof.key_averages()
+    layout_ops = {e.key: e.count for e in events if e.key in LAYOUT_OPS}
+    mem_key = 'cuda_memory_usage' if device.type == 'cuda' else 'cpu_memory_usage'
+    # positive deltas only, the memory allocated by the ops themselves
+    alloc_bytes = sum(max(getattr(e, f'self_{mem_key}', 0), 0) for e in events)
+    return layout_ops, alloc_bytes
+
+
+def main():
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    device = torch.device(args.device)
+
+    results = []
+    for model_name in args.models.split(','):
+        tokenizer = open_clip.get_tokenizer(model_name)
+        outputs = {}
+        state_dict = None
+        for batch_first in (False, True):
+            model = create_model(model_name, batch_first, device)
+            if state_dict is None:
+                state_dict = model.state_dict()
+            else:
+                model.load_state_dict(state_dict)
+            model.eval()
+            images = torch.randn(args.batch_size, 3, *to_2tuple(model.visual.image_size), device=device)
+            text = tokenizer(['a photo of a cat sitting on a chair'] * args.batch_size).to(device)
+
+            def _forward():
+                return model.encode_image(images), model.encode_text(text)
+
+            with torch.no_grad():
+                elapsed, outputs[batch_first] = benchmark_fn(_forward, args.repeats, device)
+                layout_ops, alloc_bytes = profile_fn(_forward, device)
+            results.append({
+                'model': model_name,
+                'batch_first': batch_first,
+                'forward_ms': round(elapsed * 1000, 2),
+                'layout_ops': sum(layout_ops.values()),
+                'permutes': layout_ops.get('aten::permute', 0) + layout_ops.get('aten::transpose', 0),
+                'copies': layout_ops.get('aten::contiguous', 0) + layout_ops.get('aten::copy_', 0)
+                + layout_ops.get('aten::clone', 0),
+                'alloc_mb': round(alloc_bytes / 2 ** 20, 2),
+            })
+            print(results[-1])
+
+        results[-1]['speedup'] = round(results[-2]['forward_ms'] / results[-1]['forward_ms'], 2)
+        results[-1]['max_abs_diff'] = max(
+            (f - e).abs().max().item() for f, e in zip(outputs[True], outputs[False]))
+
+    df = pd.DataFrame(results)
+    print('=' * 100)
+    print(df)
+    if args.results_file:
+        df.to_csv(args.results_file, index=False)
+
+
+if __name__ == '__main__':
+    main()
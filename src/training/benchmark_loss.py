@@ -0,0 +1,97 @@
+import argparse
+import multiprocessing
+import resource
+import time
+
+import torch
+import torch.nn.functional as F
+import pandas as pd
+
+from open_clip.loss import ClipLoss
+
+parser = argparse.ArgumentParser(description='OpenCLIP ClipLoss Benchmark')
+
+parser.add_argument('--batch-sizes', default='1024,4096,16384,32768', type=str,
+                    help='Comma separated (global) batch sizes to benchmark')
+parser.add_argument('--chunk-size', default=1024, type=int, help='Logit column block size for the chunked loss')
+parser.add_argument('--embed-dim', default=512, type=int, help='Feature dimension')
+parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu', type=str)
+parser.add_argument('--results-file', default='', type=str, metavar='FILENAME',
+                    help='Output csv file for results')
+
+
+def _run_loss(batch_size, embed_dim, chunk_size, device):
+    image_features = F.normalize(torch.randn(batch_size, embed_dim, device=device), dim=-1).requires_grad_()
+    text_features = F.normalize(torch.randn(batch_size, embed_dim, device=device), dim=-1).requires_grad_()
+    logit_scale = torch.tensor(1 / 0.07, device=device, requires_grad=True)
+    loss_fn = ClipLoss(chunk_size=chunk_size)
+
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        base_memory = torch.cuda.memory_allocated()
+    else:
+        base_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    start = time.perf_counter()
+    loss = loss_fn(image_features, text_features, logit_scale)
+    loss.backward()
+
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+        peak_memory = torch.cuda.max_memory_allocated() - base_memory
+    else:
+        # ru_maxrss is reported in KiB on Linux, high water mark of the whole process
+        peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - base_memory
+    return time.perf_counter() - start, peak_memory, loss.item()
+
+
+def _run_loss_worker(queue, *args):
+    try:
+        queue.put(_run_loss(*args))
+    except RuntimeError as e:
+        queue.put(e)
+
+
+def benchmark_loss(batch_size, embed_dim, chunk_size, device):
+    """Run one loss fwd / bwd in a fresh process so CPU peak memory (max RSS) isn't polluted by prior runs."""
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_run_loss_worker, args=(queue, batch_size, embed_dim, chunk_size, torch.device(device)))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    if isinstance(result, Exception):
+        print(f'Error for batch size {batch_size}, chunk size {chunk_size}: {result}')
+        return None
+    return result
+
+
+def main():
+    args = parser.parse_args()
+
+    results = []
+    for batch_size in [int(b) for b in args.batch_sizes.split(',')]:
+        for chunk_size in (None, args.chunk_size):
+            result = benchmark_loss(batch_size, args.embed_dim, chunk_size, args.device)
+            if result is None:
+                continue
+            elapsed, peak_memory, loss = result
+            results.append({
+                'batch_size': batch_size,
+                'chunk_size': chunk_size or 0,
+                'time_ms': round(elapsed * 1000, 2),
+                'peak_mem_mb': round(peak_memory / 2 ** 20, 2),
+                'loss': round(loss, 5),
+            })
+            print(results[-1])
+
+    df = pd.DataFrame(results)
+    print('=' * 100)
+    print(df)
+    if args.results_file:
+        df.to_csv(args.results_file, index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import argparse
+import time
+
+import torch
+import torch.nn.functional as F
+import pandas as pd
+
+import open_clip
+from open_clip.utils import to_2tuple
+
+parser = argparse.ArgumentParser(description='OpenCLIP Token Merging (ToMe) Accuracy vs Throughput Benchmark')
+
+parser.add_argument('--models', default='ViT-B-16,ViT-L-14', type=str,
+                    help='Comma separated model configs to benchmark')
+parser.add_argument('--pretrained', default='', type=str, help='Pretrained weights, random init if not set')
+parser.add_argument('--ratios', default='0,0.05,0.1,0.15,0.2', type=str,
+                    help='Comma separated per-block merge ratios to benchmark')
+parser.add_argument('--batch-size', default=32, type=int)
+parser.add_argument('--num-batches', default=4, type=int, help='Number of synthetic batches per ratio')
+parser.add_argument('--num-classes', default=1000, type=int,
+                    help='Number of random class embeddings used for the prediction agreement')
+parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu', type=str)
+parser.add_argument('--results-file', default='', type=str, metavar='FILENAME',
+                    help='Output csv file for results')
+
+
+def encode_images(model, images, device):
+    features = []
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    with torch.no_grad():
+        for batch in images:
+            features.append(model.encode_image(batch.to(device), normalize=True))
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return time.perf_counter() - start, torch.cat(features)
+
+
+def main():
+    args = parser.parse_args()
+    device = torch.device(args.device)
+
+    results = []
+    for model_name in args.models.split(','):
+        model, _, _ = open_clip.create_model_and_transforms(
+            model_name, pretrained=args.pretrained or None, device=device)
+        model.eval()
+        assert hasattr(model.visual, 'set_token_merging'), f'{model_name} has no VisionTransformer image tower'
+
+        torch.manual_seed(0)
+        images = torch.randn(args.num_batches, args.batch_size, 3, *to_2tuple(model.visual.image_size))
+        classifier = F.normalize(torch.randn(model.visual.output_dim, args.num_classes, device=device), dim=0)
+        encode_images(model, images[:1], device)  # warmup
+
+        # first ratio is the reference for speedup and agreement, keep 0 first to compare against no merging
+        reference = reference_predictions = base_throughput = None
+        for ratio in args.ratios.split(','):
+            model.visual.set_token_merging(float(ratio))
+            elapsed, features = encode_images(model, images, device)
+            throughput = images.shape[0] * images.shape[1] / elapsed
+            predictions = (features @ classifier).argmax(dim=-1)
+            if reference is None:
+                reference, reference_predictions, base_throughput = features, predictions, throughput
+            results.append({
+                'model': model_name,
+                'ratio': float(ratio),
+                'images_per_s': round(throughput, 1),
+                'speedup': round(throughput / base_throughput, 2),
+                'cosine_sim': round(F.cosine_similarity(features, reference).mean().item(), 4),
+                'top1_agreement': round((predictions == reference_predictions).float().mean().item(), 4),
+            })
+            print(results[-1])
+        model.visual.set_token_merging(0.)
+
+    df = pd.DataFrame(results)
+    print('=' * 100)
+    print(df)
+    if args.results_file:
+        df.to_csv(args.results_file, index=False)
+
+
+if __name__ == '__main__':
+    main()
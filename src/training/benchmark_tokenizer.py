@@ -0,0 +1,150 @@
+import argparse
+import random
+import time
+
+import numpy as np
+import pandas as pd
+
+from open_clip.tokenizer import SimpleTokenizer, get_pairs
+
+parser = argparse.ArgumentParser(description='OpenCLIP Tokenizer Benchmark')
+
+parser.add_argument('--captions', default='', type=str,
+                    help='Caption corpus, a .txt file (one caption per line) or a .csv / .tsv file. '
+                         'A synthetic corpus is generated from the vocab if not set.')
+parser.add_argument('--csv-caption-key', default='title', type=str,
+                    help='For csv-like corpus files, the name of the key for the captions.')
+parser.add_argument('--csv-separator', default='\t', type=str,
+                    help='For csv-like corpus files, which separator to use.')
+parser.add_argument('--num-captions', default=20000, type=int, help='Max number of captions to tokenize')
+parser.add_argument('--cache-sizes', default='0,10000,100000', type=str,
+                    help='Comma separated BPE cache sizes to benchmark, use "none" for unbounded')
+parser.add_argument('--num-workers', default=0, type=int,
+                    help='Also benchmark batch_encode w/ a process pool of this many workers')
+parser.add_argument('--results-file', default='', type=str, metavar='FILENAME',
+                    help='Output csv file for results')
+
+
+class ReferenceTokenizer(SimpleTokenizer):
+    """SimpleTokenizer w/ the original OpenAI CLIP BPE merge loop and unbounded dict cache, for comparison."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.ref_cache = dict(self.special_tokens)
+
+    def bpe(self, token):
+        if token in self.ref_cache:
+            return self.ref_cache[token]
+        word = tuple(token[:-1]) + (token[-1] + '</w>',)
+        pairs = get_pairs(word)
+
+        if not pairs:
+            return token + '</w>'
+
+        while True:
+            bigram = min(pairs, key=lambda pair: self.bpe_ranks.get(pair, float('inf')))
+            if bigram not in self.bpe_ranks:
+                break
+            first, second = bigram
+            new_word = []
+            i = 0
+            while i < len(word):
+                try:
+                    j = word.index(first, i)
+                    new_word.extend(word[i:j])
+                    i = j
+                except ValueError:
+                    new_word.extend(word[i:])
+                    break
+
+                if word[i] == first and i < len(word) - 1 and word[i + 1] == second:
+                    new_word.append(first + second)
+                    i += 2
+                else:
+                    new_word.append(word[i])
+                    i += 1
+            word = tuple(new_word)
+            if len(word) == 1:
+                break
+            else:
+                pairs = get_pairs(word)
+        word = ' '.join(word)
+        self.ref_cache[token] = word
+        return word
+
+
+def load_captions(args, tokenizer):
+    if not args.captions:
+        rng = random.Random(0)
+        words = [t.replace('</w>', ' ') for t in tokenizer.encoder if t not in tokenizer.special_tokens]
+        return [''.join(rng.choices(words, k=rng.randint(5, 25))) for _ in range(args.num_captions)]
+    if args.captions.split('.')[-1] in ('csv', 'tsv'):
+        df = pd.read_csv(args.captions, sep=args.csv_separator, nrows=args.num_captions)
+        return [str(c) for c in df[args.csv_caption_key].tolist()]
+    with open(args.captions, 'r') as f:
+        return [line.strip() for _, line in zip(range(args.num_captions), f)]
+
+
+def benchmark_encode(tokenizer, captions):
+    # clean the text up front so only the regex split + BPE + vocab lookup is timed
+    captions = [tokenizer.clean_fn(c) for c in captions]
+    clean_fn, tokenizer.clean_fn = tokenizer.clean_fn, lambda x: x
+    start = time.perf_counter()
+    tokens = [tokenizer.encode(c) for c in captions]
+    elapsed = time.perf_counter() - start
+    tokenizer.clean_fn = clean_fn
+    return elapsed, tokens
+
+
+def main():
+    args = parser.parse_args()
+
+    reference = ReferenceTokenizer()
+    captions = load_captions(args, reference)
+    print(f'Benchmarking {len(captions)} captions.')
+
+    results = []
+    ref_elapsed, ref_tokens = benchmark_encode(reference, captions)
+    results.append({
+        'impl': 'reference',
+        'cache_size': 'none',
+        'captions_per_s': round(len(captions) / ref_elapsed, 1),
+        'cache_entries': len(reference.ref_cache),
+    })
+
+    for cache_size in args.cache_sizes.split(','):
+        cache_size = None if cache_size.lower() == 'none' else int(cache_size)
+        tokenizer = SimpleTokenizer(cache_size=cache_size)
+        elapsed, tokens = benchmark_encode(tokenizer, captions)
+        assert tokens == ref_tokens, 'Tokenization differs from reference implementation.'
+        info = tokenizer.cache_info()
+        hit_rate = info['hits'] / max(1, info['hits'] + info['misses'])
+        results.append({
+            'impl': 'heap',
+            'cache_size': 'none' if cache_size is None else cache_size,
+            'captions_per_s': round(len(captions) / elapsed, 1),
+            'cache_entries': info['size'],
+            'cache_hit_rate': round(hit_rate, 4),
+        })
+
+    # full batch path, clean + encode + write into one preallocated buffer
+    for num_workers in sorted({0, args.num_workers}):
+        tokenizer = SimpleTokenizer()
+        start = time.perf_counter()
+        tokenizer.batch_encode(captions, dtype=np.int32, num_workers=num_workers)
+        elapsed = time.perf_counter() - start
+        results.append({
+            'impl': f'batch_encode (workers={num_workers})',
+            'cache_size': tokenizer.cache.maxsize,
+            'captions_per_s': round(len(captions) / elapsed, 1),
+        })
+
+    df = pd.DataFrame(results)
+    print('=' * 100)
+    print(df)
+    if args.results_file:
+        df.to_csv(args.results_file, index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+import argparse
+import time
+
+import torch
+import pandas as pd
+
+import open_clip
+from open_clip import build_zero_shot_classifier, IMAGENET_CLASSNAMES, OPENAI_IMAGENET_TEMPLATES
+
+parser = argparse.ArgumentParser(description='OpenCLIP Zero-Shot Classifier Build Benchmark')
+
+parser.add_argument('--model', default='ViT-B-32', type=str, help='Model name')
+parser.add_argument('--pretrained', default='', type=str, help='Pretrained weights, random init if not set')
+parser.add_argument('--num-classes-per-batch', default='1,10,50', type=str,
+                    help='Comma separated classes per batch to benchmark, use "none" for all at once')
+parser.add_argument('--num-classes', default=1000, type=int, help='Number of ImageNet classes to use')
+parser.add_argument('--num-templates', default=80, type=int, help='Number of OpenAI ImageNet templates to use')
+parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu', type=str)
+parser.add_argument('--results-file', default='', type=str, metavar='FILENAME',
+                    help='Output csv file for results')
+
+
+def benchmark_build(model, tokenizer, classnames, templates, num_classes_per_batch, bucket_prompts, device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    classifier = build_zero_shot_classifier(
+        model,
+        tokenizer,
+        classnames,
+        templates,
+        num_classes_per_batch=num_classes_per_batch,
+        device=device,
+        bucket_prompts=bucket_prompts,
+    )
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return time.perf_counter() - start, classifier
+
+
+def main():
+    args = parser.parse_args()
+    device = torch.device(args.device)
+
+    model, _, _ = open_clip.create_model_and_transforms(args.model, pretrained=args.pretrained or None, device=device)
+    model.eval()
+    tokenizer = open_clip.get_tokenizer(args.model)
+    classnames = IMAGENET_CLASSNAMES[:args.num_classes]
+    templates = OPENAI_IMAGENET_TEMPLATES[:args.num_templates]
+    print(f'Benchmarking {len(classnames)} classes x {len(templates)} templates.')
+
+    results = []
+    for num_classes_per_batch in args.num_classes_per_batch.split(','):
+        num_classes_per_batch = None if num_classes_per_batch.lower() == 'none' else int(num_classes_per_batch)
+        classifiers = {}
+        for bucket_prompts in (False, True):
+            elapsed, classifiers[bucket_prompts] = benchmark_build(
+                model, tokenizer, classnames, templates, num_classes_per_batch, bucket_prompts, device)
+            results.append({
+                'num_classes_per_batch': num_classes_per_batch or len(classnames),
+                'bucket_prompts': bucket_prompts,
+                'time_s': round(elapsed, 3),
+                'prompts_per_s': round(len(classnames) * len(templates) / elapsed, 1),
+            })
+            print(results[-1])
+        results[-1]['speedup'] = round(results[-2]['time_s'] / results[-1]['time_s'], 2)
+        results[-1]['max_abs_diff'] = (classifiers[True] - classifiers[False]).abs().max().item()
+
+    df = pd.DataFrame(results)
+    print('=' * 100)
+    print(df)
+    if args.results_file:
+        df.to_csv(args.results_file, index=False)
+
+
+if __name__ == '__main__':
+    main()
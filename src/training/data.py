@@ -1,13 +1,18 @@
 import ast
+import io
 import json
 import logging
 import math
 import os
 import random
+import re
 import sys
+import tarfile
 import braceexpand
 from dataclasses import dataclass
+from functools import partial
 from multiprocessing import Value
+from typing import Callable, Optional
 
 import numpy as np
 import pandas as pd
@@ -15,25 +20,78 @@ import torch
 import torchvision.datasets as datasets
 import webdataset as wds
 from PIL import Image
-from torch.utils.data import Dataset, DataLoader, SubsetRandomSampler, IterableDataset, get_worker_info
+from torch.utils.data import Dataset, DataLoader, Subset, SubsetRandomSampler, IterableDataset, get_worker_info
 from torch.utils.data.distributed import DistributedSampler
 from webdataset.filters import _shuffle
 from webdataset.tariterators import base_plus_ext, url_opener, tar_file_expander, valid_sample
 
+from open_clip import get_decode_size, get_uint8_normalize
+
 try:
     import horovod.torch as hvd
 except ImportError:
     hvd = None
 
 
+def open_image(fp, decode_size=None):
+    """Open an image, JPEGs w/ a decode_size (width, height) are decoded at the smallest DCT scale keeping
+    both sides >= decode_size (PIL draft mode), a fraction of the full decode time for large images."""
+    image = Image.open(fp)
+    if decode_size is not None:
+        image.draft('RGB', decode_size)
+    return image
+
+
+class ImageDecoder:
+    """Decodes encoded image bytes to an RGB PIL image, w/ JPEG draft mode decoding at decode_size if set."""
+
+    def __init__(self, decode_size=None):
+        self.decode_size = decode_size
+
+    def __call__(self, data):
+        with io.BytesIO(data) as stream:
+            return open_image(stream, self.decode_size).convert('RGB')
+
+
+class DraftImageLoader:
+    """ImageFolder loader w/ JPEG draft mode decoding at decode_size."""
+
+    def __init__(self, decode_size):
+        self.decode_size = decode_size
+
+    def __call__(self, path):
+        with open(path, 'rb') as f:
+            return open_image(f, self.decode_size).convert('RGB')
+
+
+def get_dataset_decode_size(args, preprocess_fn):
+    # only w/ --jpeg-draft, None (full decode) if the transform's target size is unknown
+    if not getattr(args, 'jpeg_draft', False):
+        return None
+    decode_size = get_decode_size(preprocess_fn)
+    if decode_size is None:
+        logging.warning('Could not infer the image decode size from the transform, JPEG draft decoding disabled.')
+    return decode_size
+
+
 class CsvDataset(Dataset):
-    def __init__(self, input_filename, transforms, img_key, caption_key, sep="\t", tokenizer=None):
+    def __init__(
+            self,
+            input_filename,
+            transforms,
+            img_key,
+            caption_key,
+            sep="\t",
+            tokenizer=None,
+            decode_size=None,
+    ):
         logging.debug(f'Loading csv data from {input_filename}.')
         df = pd.read_csv(input_filename, sep=sep)
 
         self.images = df[img_key].tolist()
         self.captions = df[caption_key].tolist()
         self.transforms = transforms
+        self.decode_size = decode_size
         logging.debug('Done loading data.')
 
         self.tokenize = tokenizer
@@ -42,11 +100,210 @@ class CsvDataset(Dataset):
         return len(self.captions)
 
     def __getitem__(self, idx):
-        images = self.transforms(Image.open(str(self.images[idx])))
+        images = self.transforms(open_image(str(self.images[idx]), self.decode_size))
         texts = self.tokenize([str(self.captions[idx])])[0]
         return images, texts
 
 
+class PretokenizedTextStore:
+    """ Memory-mapped caption tokens written by `training.pretokenize`, looked up by webdataset `__key__`.
+
+    Files (for a store at `path`):
+        {path}.json: metadata (num_samples, context_length, tokenizer)
+        {path}.tokens.npy: [num_samples, context_length] int32 tokens, in shard order
+        {path}.keys.npy: sorted sample keys (bytes)
+        {path}.rows.npy: row in tokens for each sorted key
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(f'{path}.json', 'r') as f:
+            self.info = json.load(f)
+        self.context_length = self.info['context_length']
+        self._tokens = self._keys = self._rows = None
+
+    def _open(self):
+        # opened lazily (per dataloader worker process), memmaps must not be pickled w/ the dataset
+        self._tokens = np.load(f'{self.path}.tokens.npy', mmap_mode='r')
+        self._keys = np.load(f'{self.path}.keys.npy', mmap_mode='r')
+        self._rows = np.load(f'{self.path}.rows.npy', mmap_mode='r')
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_tokens'] = state['_keys'] = state['_rows'] = None
+        return state
+
+    def __len__(self):
+        return self.info['num_samples']
+
+    def __getitem__(self, key):
+        if self._tokens is None:
+            self._open()
+        key_bytes = key.encode('utf-8')
+        idx = np.searchsorted(self._keys, key_bytes)
+        if idx == len(self._keys) or self._keys[idx] != key_bytes:
+            raise KeyError(f'Sample {key} not found in pre-tokenized text store {self.path}.')
+        return torch.from_numpy(self._tokens[self._rows[idx]].astype(np.int64))
+
+    def add_tokens(self, sample):
+        sample['text'] = self[sample['__key__']]
+        return sample
+
+
+class SampleFilterIndex:
+    """ Keys of the samples selected from a sidecar metadata index, to filter webdataset shards by `__key__`.
+
+    The index is a table w/ a `__key__` column and one column per sample attribute (clip score, resolution,
+    language id, ...), stored as .parquet, .npz (one array per column) or .csv / .tsv. Samples are kept if
+    they match the pandas `expr` (e.g. "language == 'en' and width >= 256") and all `min_values` thresholds,
+    samples missing from the index are dropped. An optional `__url__` column w/ the shard of each sample (matched
+    by file name) allows counting the selected samples of a subset of the indexed shards.
+    """
+
+    def __init__(self, path, expr=None, min_values=None, key_column='__key__', url_column='__url__'):
+        self.path = path
+        table = self._load(path)
+        keep = np.ones(len(table), dtype=bool)
+        if expr:
+            keep &= table.eval(expr).to_numpy(dtype=bool)
+        for column, min_value in (min_values or {}).items():
+            keep &= table[column].to_numpy() >= min_value
+        keys = table[key_column].to_numpy()[keep]
+        if keys.dtype == object and len(keys) and isinstance(keys[0], bytes):
+            keys = keys.astype(bytes)
+        elif keys.dtype.kind != 'S':
+            keys = np.char.encode(keys.astype(str), 'utf-8')
+        # sorted fixed width bytes, compact to pickle to the dataloader workers and searched w/o hashing
+        self._keys = np.sort(keys)
+        logging.info(f'Sample filter index {path}: kept {len(self._keys)} of {len(table)} samples.')
+
+        # number of selected samples per shard file name, if the index records the shard of each sample
+        self.shard_counts = None
+        if url_column in table:
+            urls = table[url_column].astype(str)
+            self.shard_counts = {os.path.basename(url): 0 for url in urls.unique()}
+            for url, count in urls[keep].value_counts().items():
+                self.shard_counts[os.path.basename(url)] += int(count)
+
+    def num_samples(self, urls):
+        """ Number of selected samples in the shards `urls`, None if the index has no shard column. """
+        if self.shard_counts is None:
+            return None
+        names = [os.path.basename(url) for url in urls]
+        missing = [name for name in names if name not in self.shard_counts]
+        if missing:
+            logging.warning(
+                f'{len(missing)} of {len(names)} shards are not in sample filter index {self.path}, '
+                f'all their samples are dropped (e.g. {missing[0]}).')
+        return sum(self.shard_counts.get(name, 0) for name in names)
+
+    @staticmethod
+    def _load(path):
+        if path.endswith('.parquet'):
+            return pd.read_parquet(path)
+        if path.endswith('.npz'):
+            with np.load(path) as f:
+                return pd.DataFrame({k: f[k] for k in f.files})
+        return pd.read_csv(path, sep='\t' if path.endswith('.tsv') else ',')
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        key_bytes = key.encode('utf-8')
+        idx = np.searchsorted(self._keys, key_bytes)
+        return idx < len(self._keys) and self._keys[idx] == key_bytes
+
+
+def get_filter_index(args, is_train):
+    filter_index_path = getattr(args, 'train_data_filter_index', None) if is_train else None
+    if not filter_index_path:
+        return None
+    return SampleFilterIndex(
+        filter_index_path,
+        expr=getattr(args, 'train_data_filter', None),
+        min_values=getattr(args, 'train_data_filter_min', None),
+    )
+
+
+TAR_INDEX_SUFFIX = '.idx'
+_MAX_OPEN_SHARDS = 256  # per dataloader worker
+
+
+def load_tar_index(url):
+    """Read the (member name, data offset, size) rows of the offset index written by `training.index_tars`."""
+    members = []
+    with open(url + TAR_INDEX_SUFFIX, 'r', encoding='utf-8') as f:
+        for line in f:
+            fname, offset, size = line.rstrip('\n').rsplit('\t', 2)
+            members.append((fname, int(offset), int(size)))
+    return members
+
+
+class IndexedTarDataset(Dataset):
+    """ Map-style dataset over uncompressed webdataset shards w/ the offset indices of `training.index_tars`.
+
+    The image (first of jpg, png, jpeg, webp) and caption members of a sample are read w/ one `os.pread` each,
+    shards are never scanned, so any sample order (exact global shuffle, restart at a sample) is cheap.
+    """
+
+    def __init__(self, urls, transforms, tokenizer=None, decode_size=None, key_filter=None):
+        self.urls, _ = expand_urls(urls)
+        self.transforms = transforms
+        self.tokenize = tokenizer
+        self.decode_size = decode_size
+        rows = []
+        for shard_id, url in enumerate(self.urls):
+            samples = {}
+            for fname, offset, size in load_tar_index(url):
+                prefix, suffix = base_plus_ext(fname)
+                if prefix is not None:
+                    samples.setdefault(prefix, {})[suffix.lower()] = (offset, size)
+            for key, members in samples.items():
+                image_key = next((k for k in _IMAGE_KEYS if k in members), None)
+                if image_key is None or 'txt' not in members:
+                    continue
+                if key_filter is not None and key not in key_filter:
+                    continue
+                rows.append((shard_id, *members[image_key], *members['txt']))
+        # [num_samples, 5] shard id, image offset, image size, caption offset, caption size
+        self._members = np.array(rows, dtype=np.int64).reshape(-1, 5)
+        self._fds = {}
+        logging.debug(f'Indexed {len(self._members)} samples in {len(self.urls)} shards.')
+
+    def __getstate__(self):
+        # file descriptors are opened lazily per dataloader worker process
+        state = self.__dict__.copy()
+        state['_fds'] = {}
+        return state
+
+    def __del__(self):
+        self._close()
+
+    def _close(self):
+        for fd in self.__dict__.get('_fds', {}).values():
+            os.close(fd)
+        self._fds = {}
+
+    def _read(self, shard_id, offset, size):
+        fd = self._fds.get(shard_id)
+        if fd is None:
+            if len(self._fds) >= _MAX_OPEN_SHARDS:
+                self._close()
+            fd = self._fds[shard_id] = os.open(self.urls[shard_id], os.O_RDONLY)
+        return os.pread(fd, size, offset)
+
+    def __len__(self):
+        return len(self._members)
+
+    def __getitem__(self, idx):
+        shard_id, image_offset, image_size, text_offset, text_size = self._members[idx].tolist()
+        with io.BytesIO(self._read(shard_id, image_offset, image_size)) as stream:
+            images = self.transforms(open_image(stream, self.decode_size).convert('RGB'))
+        texts = self.tokenize([self._read(shard_id, text_offset, text_size).decode('utf-8')])[0]
+        return images, texts
+
+
 class SharedEpoch:
     def __init__(self, epoch: int = 0):
         self.shared_epoch = Value('i', epoch)
@@ -63,6 +320,8 @@ class DataInfo:
     dataloader: DataLoader
     sampler: DistributedSampler = None
     shared_epoch: SharedEpoch = None
+    # normalizes the uint8 image batches of uint8 output transforms, on device
+    normalize: Optional[Callable] = None
 
     def set_epoch(self, epoch):
         if self.shared_epoch is not None:
@@ -122,7 +381,8 @@ def get_imagenet(args, preprocess_fns, split):
 
     if split == "v2":
         from imagenetv2_pytorch import ImageNetV2Dataset
-        dataset = ImageNetV2Dataset(location=args.imagenet_v2, transform=preprocess_val)
+        preprocess_fn = preprocess_val
+        dataset = ImageNetV2Dataset(location=args.imagenet_v2, transform=preprocess_fn)
     else:
         if is_train:
             data_path = args.imagenet_train
@@ -132,7 +392,11 @@ def get_imagenet(args, preprocess_fns, split):
             preprocess_fn = preprocess_val
         assert data_path
 
-        dataset = datasets.ImageFolder(data_path, transform=preprocess_fn)
+        decode_size = get_dataset_decode_size(args, preprocess_fn)
+        if decode_size is not None:
+            dataset = datasets.ImageFolder(data_path, transform=preprocess_fn, loader=DraftImageLoader(decode_size))
+        else:
+            dataset = datasets.ImageFolder(data_path, transform=preprocess_fn)
 
     if is_train:
         idxs = np.zeros(len(dataset.targets))
@@ -158,7 +422,7 @@ def get_imagenet(args, preprocess_fns, split):
         sampler=sampler,
     )
 
-    return DataInfo(dataloader=dataloader, sampler=sampler)
+    return DataInfo(dataloader=dataloader, sampler=sampler, normalize=get_uint8_normalize(preprocess_fn))
 
 
 def count_samples(dataloader):
@@ -177,6 +441,54 @@ def filter_no_caption_or_no_image(sample):
     return has_caption and has_image
 
 
+_IMAGE_KEYS = ('jpg', 'png', 'jpeg', 'webp')
+
+
+def select_image_and_caption(sample):
+    """Keeps the first image member (as wds.rename(image="jpg;png;jpeg;webp")), still encoded, and the decoded
+    caption of a sample. Other members (extra images, ...) are dropped w/o being decoded, json metadata is kept
+    encoded for sample filters."""
+    selected = {k: sample[k] for k in ('__key__', '__url__', 'json') if k in sample}
+    selected['image'] = next(sample[k] for k in _IMAGE_KEYS if k in sample)
+    selected['text'] = sample['txt'].decode('utf-8')
+    return selected
+
+
+class CaptionMinWords:
+    """Sample filter keeping samples w/ at least `min_words` words in their (decoded) caption."""
+
+    def __init__(self, min_words):
+        self.min_words = min_words
+
+    def __call__(self, sample):
+        return len(sample['text'].split()) >= self.min_words
+
+
+class JsonMinValues:
+    """Sample filter keeping samples whose json metadata has all keys of `min_values` w/ values >= the minimum."""
+
+    def __init__(self, min_values):
+        self.min_values = min_values
+
+    def __call__(self, sample):
+        if 'json' not in sample:
+            return False
+        meta = json.loads(sample['json'])
+        return all(meta.get(k) is not None and meta[k] >= v for k, v in self.min_values.items())
+
+
+def get_sample_filters(args, is_train):
+    # filters of the training samples set from the command line, run before the image is decoded
+    if not is_train:
+        return []
+    sample_filters = []
+    if getattr(args, 'train_data_caption_min_words', None):
+        sample_filters.append(CaptionMinWords(args.train_data_caption_min_words))
+    if getattr(args, 'train_data_json_min', None):
+        sample_filters.append(JsonMinValues(args.train_data_json_min))
+    return sample_filters
+
+
 def log_and_continue(exn):
     """Call in an exception handler to ignore any exception, issue a warning, and continue."""
     logging.warning(f'Handling webdataset error ({repr(exn)}). Ignoring.')
@@ -211,10 +523,43 @@ def group_by_keys_nothrow(data, keys=base_plus_ext, lcase=True, suffixes=None, h
         yield current_sample
 
 
-def tarfile_to_samples_nothrow(src, handler=log_and_continue):
+_TAR_META_RE = re.compile(r"__[^/]*__($|/)")
+
+
+def filtered_tar_file_expander(data, key_filter, handler=log_and_continue):
+    """Expand tar streams into files like `tar_file_expander`, but only read out the members of samples whose
+    key is in `key_filter`, the data of the rejected members is skipped over in the stream w/o being copied.
+    """
+    for source in data:
+        url = source["url"]
+        try:
+            assert isinstance(source, dict) and "stream" in source
+            stream = tarfile.open(fileobj=source["stream"], mode="r|*")
+            for tarinfo in stream:
+                # don't keep the headers of past members, also on the (many) skipped ones
+                stream.members = []
+                fname = tarinfo.name
+                if not tarinfo.isreg() or _TAR_META_RE.match(fname):
+                    continue
+                prefix, _ = base_plus_ext(fname)
+                if prefix is None or prefix not in key_filter:
+                    continue
+                yield dict(fname=fname, data=stream.extractfile(tarinfo).read(), __url__=url)
+        except Exception as exn:
+            exn.args = exn.args + (source.get("stream"), source.get("url"))
+            if handler(exn):
+                continue
+            else:
+                break
+
+
+def tarfile_to_samples_nothrow(src, handler=log_and_continue, key_filter=None):
     # NOTE this is a re-impl of the webdataset impl with group_by_keys that doesn't throw
     streams = url_opener(src, handler=handler)
-    files = tar_file_expander(streams, handler=handler)
+    if key_filter is not None:
+        files = filtered_tar_file_expander(streams, key_filter, handler=handler)
+    else:
+        files = tar_file_expander(streams, handler=handler)
     samples = group_by_keys_nothrow(files, handler=handler)
     return samples
 
@@ -325,15 +670,28 @@ class ResampledShards2(IterableDataset):
                 yield dict(url=self.rng.choices(self.urls, weights=self.weights, k=1)[0])
 
 
-def get_wds_dataset(args, preprocess_img, is_train, epoch=0, floor=False, tokenizer=None):
+def get_wds_dataset(args, preprocess_img, is_train, epoch=0, floor=False, tokenizer=None, sample_filters=()):
+    """Webdataset of (image, text) batches.
+
+    `sample_filters` are cheap predicates run on each sample (decoded 'text' caption, encoded 'image' and 'json')
+    before its image is decoded, samples are dropped if any returns False. The filters set from the command line
+    (--train-data-caption-min-words, --train-data-json-min) are added to them for training.
+    """
     input_shards = args.train_data if is_train else args.val_data
     assert input_shards is not None
     resampled = getattr(args, 'dataset_resampled', False) and is_train
 
+    filter_index = get_filter_index(args, is_train)
+
     num_shards = None
     if is_train:
         if args.train_num_samples is not None:
             num_samples = args.train_num_samples
+        elif filter_index is not None:
+            # the selected samples of the --train-data shards, the index may cover a larger shard pool
+            num_samples = filter_index.num_samples(expand_urls(input_shards)[0])
+            assert num_samples is not None, \
+                'A --train-data-filter-index w/o a `__url__` column requires --train-num-samples.'
         else:
             num_samples, num_shards = get_dataset_size(input_shards)
             if not num_samples:
@@ -346,6 +704,14 @@ def get_wds_dataset(args, preprocess_img, is_train, epoch=0, floor=False, tokeni
 
     shared_epoch = SharedEpoch(epoch=epoch)  # create a shared epoch store to sync epoch to dataloader worker proc
 
+    text_store = None
+    text_tokens = getattr(args, 'train_data_tokens' if is_train else 'val_data_tokens', None)
+    if text_tokens:
+        text_store = PretokenizedTextStore(text_tokens)
+        context_length = getattr(tokenizer, 'context_length', None)
+        assert context_length is None or context_length == text_store.context_length, \
+            f'Pre-tokenized text context length ({text_store.context_length}) != tokenizer ({context_length}).'
+
     if is_train and args.train_data_upsampling_factors is not None:
         assert resampled, "--train_data_upsampling_factors is only supported when sampling with replacement (with --dataset-resampled)."
     
@@ -374,7 +740,8 @@ def get_wds_dataset(args, preprocess_img, is_train, epoch=0, floor=False, tokeni
             ])
         pipeline.extend([
             # at this point, we have an iterator over the shards assigned to each worker at each node
-            tarfile_to_samples_nothrow,  # wds.tarfile_to_samples(handler=log_and_continue),
+            # rejected samples of the filter index are skipped before their tar members are read out
+            partial(tarfile_to_samples_nothrow, key_filter=filter_index),
             wds.shuffle(
                 bufsize=_SAMPLE_SHUFFLE_SIZE,
                 initial=_SAMPLE_SHUFFLE_INITIAL,
@@ -386,11 +753,24 @@ def get_wds_dataset(args, preprocess_img, is_train, epoch=0, floor=False, tokeni
             # at this point, we have an iterator over the shards assigned to each worker
             wds.tarfile_to_samples(handler=log_and_continue),
         ])
+    # Only the chosen image member and the caption are decoded, the image after the (cheap) sample filters
     pipeline.extend([
         wds.select(filter_no_caption_or_no_image),
-        wds.decode("pilrgb", handler=log_and_continue),
-        wds.rename(image="jpg;png;jpeg;webp", text="txt"),
-        wds.map_dict(image=preprocess_img, text=lambda text: tokenizer(text)[0]),
+        wds.map(select_image_and_caption, handler=log_and_continue),
+    ])
+    sample_filters = list(sample_filters) + get_sample_filters(args, is_train)
+    pipeline.extend(wds.select(sample_filter) for sample_filter in sample_filters)
+    pipeline.append(wds.map_dict(
+        image=ImageDecoder(get_dataset_decode_size(args, preprocess_img)), handler=log_and_continue))
+    if text_store is not None:
+        # captions were tokenized offline, look the tokens up by sample key instead of re-tokenizing every epoch
+        pipeline.extend([
+            wds.map(text_store.add_tokens, handler=log_and_continue),
+            wds.map_dict(image=preprocess_img),
+        ])
+    else:
+        pipeline.append(wds.map_dict(image=preprocess_img, text=lambda text: tokenizer(text)[0]))
+    pipeline.extend([
         wds.to_tuple("image", "text"),
         wds.batched(args.batch_size, partial=not is_train)
     ])
@@ -440,7 +820,42 @@ def get_wds_dataset(args, preprocess_img, is_train, epoch=0, floor=False, tokeni
     dataloader.num_batches = num_batches
     dataloader.num_samples = num_samples
 
-    return DataInfo(dataloader=dataloader, shared_epoch=shared_epoch)
+    return DataInfo(dataloader=dataloader, shared_epoch=shared_epoch, normalize=get_uint8_normalize(preprocess_img))
+
+
+def get_indexed_tar_dataset(args, preprocess_fn, is_train, epoch=0, tokenizer=None):
+    input_shards = args.train_data if is_train else args.val_data
+    assert input_shards
+    dataset = IndexedTarDataset(
+        input_shards,
+        preprocess_fn,
+        tokenizer=tokenizer,
+        decode_size=get_dataset_decode_size(args, preprocess_fn),
+        key_filter=get_filter_index(args, is_train),
+    )
+    if not is_train and args.val_num_samples:
+        # an eval subset only reads its own samples, w/o scanning the shards
+        dataset = Subset(dataset, range(min(args.val_num_samples, len(dataset))))
+    num_samples = len(dataset)
+    sampler = None
+    if is_train:
+        # a global shuffle that only depends on (seed, epoch), also w/o distributed training
+        sampler = DistributedSampler(
+            dataset, num_replicas=args.world_size, rank=args.rank, shuffle=True, seed=args.seed)
+
+    dataloader = DataLoader(
+        dataset,
+        batch_size=args.batch_size,
+        shuffle=False,
+        num_workers=args.workers,
+        pin_memory=True,
+        sampler=sampler,
+        drop_last=is_train,
+    )
+    dataloader.num_samples = num_samples
+    dataloader.num_batches = len(dataloader)
+
+    return DataInfo(dataloader, sampler, normalize=get_uint8_normalize(preprocess_fn))
 
 
 def get_csv_dataset(args, preprocess_fn, is_train, epoch=0, tokenizer=None):
@@ -452,7 +867,8 @@ def get_csv_dataset(args, preprocess_fn, is_train, epoch=0, tokenizer=None):
         img_key=args.csv_img_key,
         caption_key=args.csv_caption_key,
         sep=args.csv_separator,
-        tokenizer=tokenizer
+        tokenizer=tokenizer,
+        decode_size=get_dataset_decode_size(args, preprocess_fn),
     )
     num_samples = len(dataset)
     sampler = DistributedSampler(dataset) if args.distributed and is_train else None
@@ -470,7 +886,7 @@ def get_csv_dataset(args, preprocess_fn, is_train, epoch=0, tokenizer=None):
     dataloader.num_samples = num_samples
     dataloader.num_batches = len(dataloader)
 
-    return DataInfo(dataloader, sampler)
+    return DataInfo(dataloader, sampler, normalize=get_uint8_normalize(preprocess_fn))
 
 
 class SyntheticDataset(Dataset):
@@ -520,7 +936,7 @@ def get_synthetic_dataset(args, preprocess_fn, is_train, epoch=0, tokenizer=None
     dataloader.num_samples = num_samples
     dataloader.num_batches = len(dataloader)
 
-    return DataInfo(dataloader, sampler)
+    return DataInfo(dataloader, sampler, normalize=get_uint8_normalize(preprocess_fn))
 
 
 def get_dataset_fn(data_path, dataset_type):
@@ -530,6 +946,8 @@ def get_dataset_fn(data_path, dataset_type):
         return get_csv_dataset
     elif dataset_type == "synthetic":
         return get_synthetic_dataset
+    elif dataset_type == "indexed-tar":
+        return get_indexed_tar_dataset
     elif dataset_type == "auto":
         ext = data_path.split('.')[-1]
         if ext in ['csv', 'tsv']:
@@ -0,0 +1,69 @@
+""" Offset indexing of webdataset shards for random access.
+
+Reads the tar headers of each (uncompressed, local) shard once and writes a `{shard}.idx` file beside it with
+one `member name, data offset, size` row per member, so that `--dataset-type indexed-tar` can read single samples
+w/ `os.pread` instead of streaming whole shards.
+
+    python -m training.index_tars --data "/data/{00000..01023}.tar" --workers 8
+"""
+import argparse
+import logging
+import os
+import tarfile
+from multiprocessing import Pool
+
+from training.data import expand_urls, TAR_INDEX_SUFFIX
+
+parser = argparse.ArgumentParser(description='OpenCLIP webdataset shard offset indexing')
+
+parser.add_argument('--data', type=str, required=True,
+                    help='Webdataset shards to index, brace notation and `::` separated sources supported.')
+parser.add_argument('--workers', type=int, default=0, help='Number of shards indexed in parallel.')
+parser.add_argument('--overwrite', default=False, action='store_true', help='Re-index shards w/ an index.')
+
+
+def index_tar(url, overwrite=False):
+    """ Write the offset index of the shard at `url`, returns the number of indexed members """
+    index_filename = url + TAR_INDEX_SUFFIX
+    if not overwrite and os.path.exists(index_filename):
+        return None
+    num_members = 0
+    tmp_filename = index_filename + '.tmp'
+    # 'r:' only accepts uncompressed tars, member data offsets of compressed ones aren't file offsets
+    with tarfile.open(url, 'r:') as tar, open(tmp_filename, 'w', encoding='utf-8') as f:
+        for tarinfo in tar:
+            if not tarinfo.isreg():
+                continue
+            assert '\t' not in tarinfo.name and '\n' not in tarinfo.name, f'Unsupported member name {tarinfo.name}'
+            f.write(f'{tarinfo.name}\t{tarinfo.offset_data}\t{tarinfo.size}\n')
+            num_members += 1
+            tar.members = []  # headers are only needed once, don't keep them all
+    os.replace(tmp_filename, index_filename)
+    return num_members
+
+
+def _index_tar(args):
+    url, overwrite = args
+    return url, index_tar(url, overwrite=overwrite)
+
+
+def main():
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    urls, _ = expand_urls(args.data)
+    jobs = [(url, args.overwrite) for url in urls]
+    if args.workers > 0:
+        with Pool(args.workers) as pool:
+            results = list(pool.imap_unordered(_index_tar, jobs))
+    else:
+        results = [_index_tar(job) for job in jobs]
+    for url, num_members in results:
+        if num_members is None:
+            logging.info(f'Skipped {url}, already indexed.')
+        else:
+            logging.info(f'Indexed {num_members} members of {url}.')
+
+
+if __name__ == '__main__':
+    main()
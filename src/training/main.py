@@ -29,6 +29,7 @@ except ImportError:
     hvd = None
 
 from open_clip import create_model_and_transforms, trace_model, get_tokenizer, create_loss
+from open_clip.loss import AsyncImageGather
 from training.data import get_data
 from training.distributed import is_master, init_distributed_device, broadcast_object
 from training.logger import setup_logging
@@ -211,6 +212,16 @@ def main(args):
         assert args.accum_freq == 1
         #FIXME: support distillation with coca.
         assert 'coca' not in args.model.lower()
+    if args.async_gather:
+        # one gather per train mode forward, consumed by the following loss computation
+        assert args.accum_freq == 1 and not args.distill, 'Async gather requires --accum-freq 1 and no distillation.'
+        assert not args.horovod and not args.siglip, 'Async gather is only supported for the torch.distributed gather.'
+    if args.grad_cache:
+        # w/o accumulation the plain step runs, there is nothing to cache
+        assert args.accum_freq > 1, '--grad-cache requires --accum-freq > 1.'
+    if args.trim_text_padding:
+        # the CoCa text tower outputs tokens (w/ a cls token) for the decoder, padding can't be trimmed
+        assert 'coca' not in args.model.lower(), '--trim-text-padding is not supported w/ CoCa models.'
 
     if isinstance(args.force_image_size, (tuple, list)) and len(args.force_image_size) == 1:
         # arg is nargs, single (square) image size list -> int
@@ -237,6 +248,7 @@ def main(args):
         aug_cfg=args.aug_cfg,
         pretrained_image=args.pretrained_image,
         output_dict=True,
+        uint8_output=args.uint8_images,
         **model_kwargs,
     )
     if args.distill:
@@ -276,7 +288,13 @@ def main(args):
             freeze_layer_norm=args.lock_text_freeze_layer_norm)
 
     if args.grad_checkpointing:
-        model.set_grad_checkpointing()
+        model.set_grad_checkpointing(args.grad_checkpointing)
+
+    if args.activation_offload:
+        model.set_activation_offload(args.activation_offload)
+
+    if args.trim_text_padding:
+        model.set_text_trim_padding()
 
     if is_master(args):
         logging.info("Model:")
@@ -325,7 +343,12 @@ def main(args):
             eps=args.eps,
         )
         if args.horovod:
-            optimizer = hvd.DistributedOptimizer(optimizer, named_parameters=model.named_parameters())
+            # w/ gradient accumulation, only all-reduce on the last of the accum_freq backward passes
+            optimizer = hvd.DistributedOptimizer(
+                optimizer,
+                named_parameters=model.named_parameters(),
+                backward_passes_per_step=args.accum_freq,
+            )
             hvd.broadcast_parameters(model.state_dict(), root_rank=0)
             hvd.broadcast_optimizer_state(optimizer, root_rank=0)
 
@@ -428,6 +451,9 @@ def main(args):
         return
 
     loss = create_loss(args)
+    if args.async_gather and args.world_size > 1:
+        loss.async_gather = AsyncImageGather(args.local_loss, args.gather_with_grad, args.rank, args.world_size)
+        loss.async_gather.register(original_model)
 
     for epoch in range(start_epoch, args.epochs):
         if is_master(args):
@@ -59,11 +59,63 @@ def parse_args(args):
         default=None,
         help="Number of samples in dataset. Useful for webdataset if not available in info file.",
     )
+    parser.add_argument(
+        "--train-data-tokens",
+        type=str,
+        default=None,
+        help="Path prefix of a pre-tokenized caption store for --train-data (webdataset only, "
+             "see `python -m training.pretokenize`). Captions are looked up by sample key instead of tokenized.",
+    )
+    parser.add_argument(
+        "--val-data-tokens",
+        type=str,
+        default=None,
+        help="Path prefix of a pre-tokenized caption store for --val-data (webdataset only).",
+    )
+    parser.add_argument(
+        "--train-data-filter-index",
+        type=str,
+        default=None,
+        help="Sidecar metadata index (.parquet, .npz or .csv w/ a `__key__` column) of the --train-data samples "
+             "(webdataset and indexed-tar). Only the samples selected by --train-data-filter / "
+             "--train-data-filter-min are read out of the shards and decoded, samples missing from the index are "
+             "dropped. W/o a `__url__` (shard) column in the index, --train-num-samples is required.",
+    )
+    parser.add_argument(
+        "--train-data-filter",
+        type=str,
+        default=None,
+        help="pandas expression over the --train-data-filter-index columns selecting the samples to train on, "
+             "e.g. \"language == 'en' and width >= 256\".",
+    )
+    parser.add_argument(
+        "--train-data-filter-min",
+        nargs='*',
+        default={},
+        action=ParseKwargs,
+        help="Minimum values of --train-data-filter-index columns selecting the samples to train on, "
+             "e.g. clip_score=0.28 height=224.",
+    )
+    parser.add_argument(
+        "--train-data-caption-min-words",
+        type=int,
+        default=None,
+        help="Drop --train-data samples w/ fewer caption words, before their image is decoded (webdataset only).",
+    )
+    parser.add_argument(
+        "--train-data-json-min",
+        nargs='*',
+        default={},
+        action=ParseKwargs,
+        help="Minimum values of keys of the per sample json metadata, e.g. similarity=0.3 width=224. Other "
+             "--train-data samples are dropped before their image is decoded (webdataset only).",
+    )
     parser.add_argument(
         "--dataset-type",
-        choices=["webdataset", "csv", "synthetic", "auto"],
+        choices=["webdataset", "indexed-tar", "csv", "synthetic", "auto"],
         default="auto",
-        help="Which type of dataset to process."
+        help="Which type of dataset to process. indexed-tar reads webdataset shards indexed by "
+             "`python -m training.index_tars` at random, w/ an exact global shuffle."
     )
     parser.add_argument(
         "--dataset-resampled",
@@ -177,6 +229,13 @@ def parse_args(args):
     parser.add_argument(
         "--zeroshot-frequency", type=int, default=2, help="How often to run zero shot."
     )
+    parser.add_argument(
+        "--zeroshot-cache-dir",
+        type=str,
+        default=None,
+        help="Directory to cache zero-shot classifier weights in, keyed by a hash of the text tower weights, "
+             "tokenizer and prompts. Skips rebuilding the classifier when the text tower is unchanged (e.g. locked).",
+    )
     parser.add_argument(
         "--val-frequency", type=int, default=1, help="How often to run evaluation with val data."
     )
@@ -244,12 +303,48 @@ def parse_args(args):
         default=None, type=str, choices=['shortest', 'longest', 'squash'],
         help="Override default image resize (& crop) mode during inference"
     )
+    parser.add_argument(
+        "--uint8-images",
+        default=False,
+        action='store_true',
+        help="Dataloader workers output uint8 images, converted to float and normalized per batch on device.",
+    )
+    parser.add_argument(
+        "--jpeg-draft",
+        default=False,
+        action='store_true',
+        help="Decode JPEGs at the smallest DCT scale (1/2, 1/4, 1/8) still covering the transform's target size "
+             "(PIL draft mode), for webdataset, csv and imagenet datasets.",
+    )
     parser.add_argument('--aug-cfg', nargs='*', default={}, action=ParseKwargs)
     parser.add_argument(
         "--grad-checkpointing",
+        default=None,
+        nargs='?',
+        const='all',
+        type=str,
+        metavar='POLICY',
+        help="Enable gradient checkpointing. Optional policy: 'all' (default), 'every:N' (every N-th block), "
+             "'first:K' (first K blocks), 'attn' / 'mlp' (attention / MLP branch of every block) or 'auto:GB' "
+             "(fewest blocks keeping the estimated activations of each transformer under GB).",
+    )
+    parser.add_argument(
+        "--activation-offload",
+        default=None,
+        nargs='?',
+        const='all',
+        type=str,
+        metavar='LAYERS',
+        help="Offload the activations saved for backward to pinned host memory, prefetched back in backward "
+             "(transformer towers on CUDA). Optional layer selection: 'all' (default), 'every:N', 'first:K', "
+             "'last:K' or comma separated layer indices.",
+    )
+    parser.add_argument(
+        "--trim-text-padding",
         default=False,
         action='store_true',
-        help="Enable gradient checkpointing.",
+        help="Trim each text batch to its longest sequence before the text transformer (causal, argmax pooled "
+             "text towers only).",
     )
     parser.add_argument(
         "--local-loss",
@@ -263,6 +358,20 @@ def parse_args(args):
         action="store_true",
         help="enable full distributed gradient for feature gather"
     )
+    parser.add_argument(
+        "--async-gather",
+        default=False,
+        action="store_true",
+        help="start gathering the image features as soon as the image tower has computed them, "
+             "overlapping the collective w/ the text tower forward pass"
+    )
+    parser.add_argument(
+        "--loss-chunk-size",
+        type=int,
+        default=None,
+        help="Compute the contrastive loss in blocks of this many logit columns (online logsumexp), "
+             "memory scales with batch * chunk instead of batch * global batch."
+    )
     parser.add_argument(
         '--force-image-size', type=int, nargs='+', default=None,
         help='Override default image size'
@@ -306,6 +415,13 @@ def parse_args(args):
     parser.add_argument(
         "--accum-freq", type=int, default=1, help="Update the model every --acum-freq steps."
     )
+    parser.add_argument(
+        "--grad-cache",
+        default=False,
+        action='store_true',
+        help="With --accum-freq > 1, compute the loss once over the cached features of all batches and backprop its "
+             "feature gradients through each re-done forward pass, instead of --accum-freq loss computations.",
+    )
     # arguments for distributed training
     parser.add_argument(
         "--dist-url",
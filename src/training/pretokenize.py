@@ -0,0 +1,128 @@
+""" Offline caption pre-tokenization for webdataset shards.
+
+Walks the shards once, tokenizes every caption and writes a memory-mapped token store indexed by sample `__key__`
+that `get_wds_dataset` can read via `--train-data-tokens` / `--val-data-tokens` instead of tokenizing in the
+dataloader workers every epoch.
+
+    python -m training.pretokenize --data "/data/{00000..01023}.tar" --output /data/tokens --model ViT-B-32
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+
+from open_clip import get_tokenizer
+from training.data import expand_urls, tarfile_to_samples_nothrow, PretokenizedTextStore
+
+parser = argparse.ArgumentParser(description='OpenCLIP webdataset caption pre-tokenization')
+
+parser.add_argument('--data', type=str, required=True,
+                    help='Webdataset shards to tokenize, brace notation and `::` separated sources supported.')
+parser.add_argument('--output', type=str, required=True,
+                    help='Path prefix of the token store, writes {output}.json / .tokens.npy / .keys.npy / .rows.npy')
+parser.add_argument('--model', type=str, default='RN50', help='Model name to select the tokenizer.')
+parser.add_argument('--context-length', type=int, default=None, help='Override tokenizer context length.')
+parser.add_argument('--caption-key', type=str, default='txt', help='Sample member holding the caption.')
+parser.add_argument('--batch-size', type=int, default=4096, help='Number of captions to tokenize at once.')
+parser.add_argument('--workers', type=int, default=0, help='Tokenizer pool workers (SimpleTokenizer only).')
+
+
+def _tokenize(tokenizer, texts, workers=0):
+    if hasattr(tokenizer, 'batch_encode'):
+        return tokenizer.batch_encode(texts, dtype=np.int32, num_workers=workers)
+    return tokenizer(texts).numpy().astype(np.int32)
+
+
+def pretokenize_shards(
+        urls,
+        output,
+        tokenizer,
+        caption_key='txt',
+        batch_size=4096,
+        workers=0,
+        tokenizer_name='',
+):
+    """ Tokenize the captions of all samples in `urls` into a token store at `output` """
+    urls, _ = expand_urls(urls)
+    context_length = tokenizer.context_length
+    tmp_filename = f'{output}.tokens.tmp'
+    keys, texts = [], []
+    num_samples = 0
+
+    with open(tmp_filename, 'wb') as tmp_file:
+        def _flush():
+            tmp_file.write(_tokenize(tokenizer, texts, workers=workers).tobytes())
+            texts.clear()
+
+        for url in urls:
+            logging.info(f'Tokenizing {url}.')
+            for sample in tarfile_to_samples_nothrow([dict(url=url)]):
+                if caption_key not in sample:
+                    continue
+                keys.append(sample['__key__'].encode('utf-8'))
+                texts.append(sample[caption_key].decode('utf-8'))
+                num_samples += 1
+                if len(texts) >= batch_size:
+                    _flush()
+        if texts:
+            _flush()
+
+    # prepend a .npy header now that the number of rows is known
+    with open(f'{output}.tokens.npy', 'wb') as f:
+        header = {'descr': np.lib.format.dtype_to_descr(np.dtype(np.int32)), 'fortran_order': False,
+                  'shape': (num_samples, context_length)}
+        np.lib.format.write_array_header_1_0(f, header)
+        with open(tmp_filename, 'rb') as tmp_file:
+            shutil.copyfileobj(tmp_file, f)
+    os.remove(tmp_filename)
+
+    keys = np.array(keys)
+    rows = np.argsort(keys, kind='stable')
+    keys = keys[rows]
+    duplicates = keys[1:] == keys[:-1]
+    if np.any(duplicates):
+        raise ValueError(
+            f'Sample keys must be unique across shards to index the token store, '
+            f'found duplicate key {keys[1:][duplicates][0]}.')
+    np.save(f'{output}.keys.npy', keys)
+    np.save(f'{output}.rows.npy', rows.astype(np.int64))
+
+    with open(f'{output}.json', 'w') as f:
+        json.dump(dict(
+            num_samples=num_samples,
+            context_length=context_length,
+            tokenizer=tokenizer_name,
+            caption_key=caption_key,
+        ), f)
+
+    return PretokenizedTextStore(output)
+
+
+def main():
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    tokenizer_kwargs = {}
+    if args.context_length:
+        tokenizer_kwargs['context_length'] = args.context_length
+    tokenizer = get_tokenizer(args.model, **tokenizer_kwargs)
+    if getattr(tokenizer, 'reduction_fn', None) is not None:
+        logging.warning('Tokenizer uses a random reduction mask, it will be fixed per sample by pre-tokenization.')
+
+    store = pretokenize_shards(
+        args.data,
+        args.output,
+        tokenizer,
+        caption_key=args.caption_key,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        tokenizer_name=args.model,
+    )
+    logging.info(f'Wrote {len(store)} tokenized captions to {args.output}.')
+
+
+if __name__ == '__main__':
+    main()
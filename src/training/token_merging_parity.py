@@ -0,0 +1,102 @@
+import argparse
+import time
+
+import torch
+import pandas as pd
+from torch.utils.data import DataLoader, Subset
+from torchvision import datasets
+
+import open_clip
+from open_clip import build_zero_shot_classifier, IMAGENET_CLASSNAMES, OPENAI_IMAGENET_TEMPLATES
+from training.zero_shot import accuracy
+
+parser = argparse.ArgumentParser(description='OpenCLIP Token Merging (ToMe) Zero-Shot Parity')
+
+parser.add_argument('--model', default='ViT-L-14', type=str, help='Model name')
+parser.add_argument('--pretrained', default='openai', type=str, help='Pretrained weights')
+parser.add_argument('--imagenet-val', required=True, type=str, help='Path to imagenet val set (ImageFolder layout)')
+parser.add_argument('--ratios', default='0,0.05,0.1,0.15,0.2', type=str,
+                    help='Comma separated per-block merge ratios to evaluate, the first one is the reference')
+parser.add_argument('--num-samples', default=0, type=int, help='Evaluate on N images spread over the val set if > 0')
+parser.add_argument('--batch-size', default=64, type=int)
+parser.add_argument('--workers', default=4, type=int)
+parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu', type=str)
+parser.add_argument('--results-file', default='', type=str, metavar='FILENAME',
+                    help='Output csv file for results')
+
+
+def evaluate(model, classifier, dataloader, device):
+    predictions, top1, top5, n = [], 0., 0., 0
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    with torch.no_grad():
+        for images, target in dataloader:
+            images, target = images.to(device), target.to(device)
+            logits = 100. * model.encode_image(images, normalize=True) @ classifier
+            acc1, acc5 = accuracy(logits, target, topk=(1, 5))
+            top1 += acc1
+            top5 += acc5
+            n += images.shape[0]
+            predictions.append(logits.argmax(dim=-1))
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return time.perf_counter() - start, torch.cat(predictions), top1 / n, top5 / n
+
+
+def main():
+    args = parser.parse_args()
+    device = torch.device(args.device)
+
+    model, _, preprocess = open_clip.create_model_and_transforms(
+        args.model, pretrained=args.pretrained or None, device=device)
+    model.eval()
+    assert hasattr(model.visual, 'set_token_merging'), f'{args.model} has no VisionTransformer image tower'
+    tokenizer = open_clip.get_tokenizer(args.model)
+
+    dataset = datasets.ImageFolder(args.imagenet_val, transform=preprocess)
+    if args.num_samples:
+        # spread the subset over all classes
+        step = max(len(dataset) // args.num_samples, 1)
+        dataset = Subset(dataset, list(range(0, len(dataset), step))[:args.num_samples])
+    dataloader = DataLoader(dataset, batch_size=args.batch_size, num_workers=args.workers)
+
+    # the text tower is not affected by token merging, build the classifier once
+    classifier = build_zero_shot_classifier(
+        model,
+        tokenizer=tokenizer,
+        classnames=IMAGENET_CLASSNAMES,
+        templates=OPENAI_IMAGENET_TEMPLATES,
+        num_classes_per_batch=10,
+        device=device,
+        use_tqdm=True,
+    )
+
+    results = []
+    reference = None
+    for ratio in args.ratios.split(','):
+        model.visual.set_token_merging(float(ratio))
+        elapsed, predictions, top1, top5 = evaluate(model, classifier, dataloader, device)
+        if reference is None:
+            reference = (predictions, top1, elapsed)
+        results.append({
+            'model': args.model,
+            'ratio': float(ratio),
+            'top1': round(top1, 4),
+            'top5': round(top5, 4),
+            'top1_delta': round(top1 - reference[1], 4),
+            'prediction_agreement': round((predictions == reference[0]).float().mean().item(), 4),
+            'images_per_s': round(len(dataset) / elapsed, 1),
+            'speedup': round(reference[2] / elapsed, 2),
+        })
+        print(results[-1])
+
+    df = pd.DataFrame(results)
+    print('=' * 100)
+    print(df)
+    if args.results_file:
+        df.to_csv(args.results_file, index=False)
+
+
+if __name__ == '__main__':
+    main()
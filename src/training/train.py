@@ -3,6 +3,7 @@ import logging
 import math
 import os
 import time
+from contextlib import contextmanager, nullcontext
 
 import numpy as np
 import torch
@@ -61,6 +62,35 @@ def backward(total_loss, scaler):
         total_loss.backward()
 
 
+def to_input_images(images, device, input_dtype, normalize=None):
+    """Move an image batch to the device, normalizing uint8 images there if a normalize stage is passed."""
+    if normalize is not None:
+        images = normalize(images.to(device=device, non_blocking=True))
+    return images.to(device=device, dtype=input_dtype, non_blocking=True)
+
+
+def no_sync(model, enable=True):
+    """Context skipping the DDP gradient all-reduce of the forward / backward passes run inside, if enabled."""
+    if enable and hasattr(model, 'no_sync'):
+        return model.no_sync()
+    return nullcontext()
+
+
+def get_rng_state(device):
+    return torch.get_rng_state(), torch.cuda.get_rng_state(device) if device.type == 'cuda' else None
+
+
+@contextmanager
+def replay_rng_state(rng_state, device):
+    """Context re-running the random ops (dropout, patch dropout) seen after get_rng_state(), RNG restored on exit."""
+    cpu_state, cuda_state = rng_state
+    with torch.random.fork_rng(devices=[device] if cuda_state is not None else []):
+        torch.set_rng_state(cpu_state)
+        if cuda_state is not None:
+            torch.cuda.set_rng_state(cuda_state, device)
+        yield
+
+
 def train_one_epoch(model, data, loss, epoch, optimizer, scaler, scheduler, dist_model, args, tb_writer=None):
     device = torch.device(args.device)
     autocast = get_autocast(args.precision)
@@ -72,11 +102,14 @@ def train_one_epoch(model, data, loss, epoch, optimizer, scaler, scheduler, dist
 
     data['train'].set_epoch(epoch)  # set epoch in process safe manner via sampler or shared_epoch
     dataloader = data['train'].dataloader
+    normalize = data['train'].normalize
     num_batches_per_epoch = dataloader.num_batches // args.accum_freq
     sample_digits = math.ceil(math.log(dataloader.num_samples + 1, 10))
 
     if args.accum_freq > 1:
         accum_images, accum_texts, accum_features = [], [], {}
+        if args.grad_cache:
+            accum_rng_states = []
 
     losses_m = {}
     batch_time_m = AverageMeter()
@@ -90,7 +123,7 @@ def train_one_epoch(model, data, loss, epoch, optimizer, scaler, scheduler, dist
             scheduler(step)
 
         images, texts = batch
-        images = images.to(device=device, dtype=input_dtype, non_blocking=True)
+        images = to_input_images(images, device, input_dtype, normalize)
         texts = texts.to(device=device, non_blocking=True)
 
         data_time_m.update(time.time() - end)
@@ -110,6 +143,61 @@ def train_one_epoch(model, data, loss, epoch, optimizer, scaler, scheduler, dist
                 losses["loss"] = total_loss
 
             backward(total_loss, scaler)
+        elif args.grad_cache:
+            # First, cache the features and RNG state without any gradient tracking. The inputs are kept as loaded.
+            with torch.no_grad():
+                accum_rng_states.append(get_rng_state(device))
+                with autocast():
+                    model_out = model(images, texts)
+
+                for key, val in model_out.items():
+                    accum_features.setdefault(key, []).append(val)
+                accum_images.append(batch[0])
+                accum_texts.append(batch[1])
+
+            # If (i + 1) % accum_freq is not zero, move on to the next batch.
+            if ((i + 1) % args.accum_freq) > 0:
+                continue
+
+            # One loss forward / backward over the features of all accum_freq batches, for the feature gradients.
+            inputs = {}
+            for key, val in accum_features.items():
+                # logit scale / bias are the same model output for every batch
+                val = val[-1] if key in ("logit_scale", "logit_bias") else torch.cat(val)
+                inputs[key] = val.requires_grad_() if val.is_floating_point() else val
+            split_sizes = [len(val) for val in accum_features["image_features"]]
+            accum_features = {}
+
+            with autocast():
+                losses = loss(**inputs, output_dict=True)
+                total_loss = sum(losses.values())
+                losses["loss"] = total_loss
+            backward(total_loss, scaler)
+            logit_scale = inputs["logit_scale"].detach()
+            feature_grads = {key: val.grad for key, val in inputs.items() if val.grad is not None}
+            del inputs
+
+            # Now, re-do the forward pass of each batch w/ the same randomness and backprop its feature gradients.
+            # The (scaled) gradients come from the loss, so backward() must not scale them again.
+            optimizer.zero_grad()
+            for j in range(args.accum_freq):
+                images = to_input_images(accum_images[j], device, input_dtype, normalize)
+                texts = accum_texts[j].to(device=device, non_blocking=True)
+                with no_sync(model, enable=j < args.accum_freq - 1), replay_rng_state(accum_rng_states[j], device):
+                    with autocast():
+                        model_out = model(images, texts)
+
+                    outputs, output_grads = [], []
+                    for key, grad in feature_grads.items():
+                        if key in ("logit_scale", "logit_bias"):
+                            if j < args.accum_freq - 1:
+                                continue
+                        else:
+                            grad = grad.split(split_sizes)[j]
+                        outputs.append(model_out[key])
+                        output_grads.append(grad)
+                    torch.autograd.backward(outputs, output_grads)
+                    del model_out, outputs, output_grads
         else:
             # First, cache the features without any gradient tracking.
             with torch.no_grad():
@@ -136,30 +224,32 @@ def train_one_epoch(model, data, loss, epoch, optimizer, scaler, scheduler, dist
             # Now, ready to take gradients for the last accum_freq batches.
             # Re-do the forward pass for those batches, and use the cached features from the other batches as negatives.
             # Call backwards each time, but only step optimizer at the end.
+            # Gradients accumulate locally, DDP only all-reduces them in the backward of the last batch.
             optimizer.zero_grad()
             for j in range(args.accum_freq):
                 images = accum_images[j]
                 texts = accum_texts[j]
-                with autocast():
-                    model_out = model(images, texts)
+                with no_sync(model, enable=j < args.accum_freq - 1):
+                    with autocast():
+                        model_out = model(images, texts)
 
-                    inputs_no_accum = {}
-                    inputs_no_accum["logit_scale"] = logit_scale = model_out.pop("logit_scale")
-                    if "logit_bias" in model_out:
-                        inputs_no_accum["logit_bias"] = model_out.pop("logit_bias")
+                        inputs_no_accum = {}
+                        inputs_no_accum["logit_scale"] = logit_scale = model_out.pop("logit_scale")
+                        if "logit_bias" in model_out:
+                            inputs_no_accum["logit_bias"] = model_out.pop("logit_bias")
 
-                    inputs = {}
-                    for key, val in accum_features.items():
-                        accumulated = accum_features[key]
-                        inputs[key] = torch.cat(accumulated[:j] + [model_out[key]] + accumulated[j + 1:])
+                        inputs = {}
+                        for key, val in accum_features.items():
+                            accumulated = accum_features[key]
+                            inputs[key] = torch.cat(accumulated[:j] + [model_out[key]] + accumulated[j + 1:])
 
-                    losses = loss(**inputs, **inputs_no_accum, output_dict=True)
-                    del inputs
-                    del inputs_no_accum
-                    total_loss = sum(losses.values())
-                    losses["loss"] = total_loss
+                        losses = loss(**inputs, **inputs_no_accum, output_dict=True)
+                        del inputs
+                        del inputs_no_accum
+                        total_loss = sum(losses.values())
+                        losses["loss"] = total_loss
 
-                backward(total_loss, scaler)
+                    backward(total_loss, scaler)
 
         if scaler is not None:
             if args.horovod:
@@ -183,6 +273,8 @@ def train_one_epoch(model, data, loss, epoch, optimizer, scaler, scheduler, dist
         # reset gradient accum, if enabled
         if args.accum_freq > 1:
             accum_images, accum_texts, accum_features = [], [], {}
+            if args.grad_cache:
+                accum_rng_states = []
 
         # Note: we clamp to 4.6052 = ln(100), as in the original paper.
         with torch.no_grad():
@@ -263,6 +355,7 @@ def evaluate(model, data, epoch, args, tb_writer=None, tokenizer=None):
 
     if 'val' in data and (args.val_frequency and ((epoch % args.val_frequency) == 0 or epoch == args.epochs)):
         dataloader = data['val'].dataloader
+        normalize = data['val'].normalize
         num_samples = 0
         samples_per_val = dataloader.num_samples
 
@@ -274,7 +367,7 @@ def evaluate(model, data, epoch, args, tb_writer=None, tokenizer=None):
         with torch.no_grad():
             for i, batch in enumerate(dataloader):
                 images, texts = batch
-                images = images.to(device=device, dtype=input_dtype, non_blocking=True)
+                images = to_input_images(images, device, input_dtype, normalize)
                 texts = texts.to(device=device, non_blocking=True)
 
                 with autocast():
@@ -357,18 +450,24 @@ def evaluate(model, data, epoch, args, tb_writer=None, tokenizer=None):
     return metrics
 
 
-def get_clip_metrics(image_features, text_features, logit_scale):
-    metrics = {}
-    logits_per_image = (logit_scale * image_features @ text_features.t()).detach().cpu()
-    logits_per_text = logits_per_image.t().detach().cpu()
+def get_clip_metrics(image_features, text_features, logit_scale, chunk_size=1024):
+    """ Compute retrieval metrics (mean / median rank, R@k) in both directions.
 
-    logits = {"image_to_text": logits_per_image, "text_to_image": logits_per_text}
-    ground_truth = torch.arange(len(text_features)).view(-1, 1)
+    Queries are processed in blocks of `chunk_size` rows against the full gallery, and the rank of each
+    ground truth pair is found by counting the gallery scores that beat it. Peak memory is
+    O(chunk_size * N) instead of the O(N * N) logit matrix + argsort of the naive approach.
+    """
+    metrics = {}
+    image_features = image_features.detach()
+    text_features = text_features.detach()
 
-    for name, logit in logits.items():
-        ranking = torch.argsort(logit, descending=True)
-        preds = torch.where(ranking == ground_truth)[1]
-        preds = preds.detach().cpu().numpy()
+    features = {
+        "image_to_text": (image_features, text_features),
+        "text_to_image": (text_features, image_features),
+    }
+    for name, (query_features, gallery_features) in features.items():
+        preds = _get_ground_truth_ranks(query_features, gallery_features, logit_scale, chunk_size=chunk_size)
+        preds = preds.cpu().numpy()
         metrics[f"{name}_mean_rank"] = preds.mean() + 1
         metrics[f"{name}_median_rank"] = np.floor(np.median(preds)) + 1
         for k in [1, 5, 10]:
@@ -377,6 +476,20 @@ def get_clip_metrics(image_features, text_features, logit_scale):
     return metrics
 
 
+def _get_ground_truth_ranks(query_features, gallery_features, logit_scale, chunk_size=1024):
+    # zero-based rank of gallery item i for query i, i.e. the number of gallery items scoring strictly higher
+    num_queries = len(query_features)
+    chunk_size = chunk_size or num_queries
+    ranks = torch.empty(num_queries, dtype=torch.long, device=query_features.device)
+    for start in range(0, num_queries, chunk_size):
+        end = min(start + chunk_size, num_queries)
+        logits = logit_scale * query_features[start:end] @ gallery_features.t()
+        rows = torch.arange(end - start, device=logits.device)
+        positive = logits[rows, rows + start].unsqueeze(1)
+        ranks[start:end] = (logits > positive).sum(dim=1)
+    return ranks
+
+
 def maybe_compute_generative_loss(model_out):
     if "logits" in model_out and "labels" in model_out:
         token_logits = model_out["logits"]
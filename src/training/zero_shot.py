@@ -14,13 +14,16 @@ def accuracy(output, target, topk=(1,)):
     return [float(correct[:k].reshape(-1).float().sum(0, keepdim=True).cpu().numpy()) for k in topk]
 
 
-def run(model, classifier, dataloader, args):
+def run(model, classifier, dataloader, args, normalize=None):
     autocast = get_autocast(args.precision)
     input_dtype = get_input_dtype(args.precision)
 
     with torch.no_grad():
         top1, top5, n = 0., 0., 0.
         for images, target in tqdm(dataloader, unit_scale=args.batch_size):
+            if normalize is not None:
+                # uint8 batch, normalized on device
+                images = normalize(images.to(device=args.device))
             images = images.to(device=args.device, dtype=input_dtype)
             target = target.to(args.device)
 
@@ -66,16 +69,17 @@ def zero_shot_eval(model, data, epoch, args, tokenizer=None):
             num_classes_per_batch=10,
             device=args.device,
             use_tqdm=True,
+            cache_dir=args.zeroshot_cache_dir,
         )
 
     logging.info('Using classifier')
     results = {}
     if 'imagenet-val' in data:
-        top1, top5 = run(model, classifier, data['imagenet-val'].dataloader, args)
+        top1, top5 = run(model, classifier, data['imagenet-val'].dataloader, args, data['imagenet-val'].normalize)
         results['imagenet-zeroshot-val-top1'] = top1
         results['imagenet-zeroshot-val-top5'] = top5
     if 'imagenet-v2' in data:
-        top1, top5 = run(model, classifier, data['imagenet-v2'].dataloader, args)
+        top1, top5 = run(model, classifier, data['imagenet-v2'].dataloader, args, data['imagenet-v2'].normalize)
         results['imagenetv2-zeroshot-val-top1'] = top1
         results['imagenetv2-zeroshot-val-top5'] = top5
 
@@ -0,0 +1,83 @@
+import pytest
+import torch
+
+from open_clip import CLIP
+from open_clip.coca_model import CoCa
+from open_clip.activation_offload import ActivationOffload, parse_layer_selection
+
+
+def _tiny_clip(device):
+    torch.manual_seed(0)
+    model = CLIP(
+        embed_dim=16,
+        vision_cfg=dict(image_size=32, patch_size=4, width=32, head_width=16, layers=3),
+        text_cfg=dict(context_length=16, width=32, heads=4, layers=3),
+    )
+    return model.to(device)
+
+
+def _grads(model, device):
+    model.zero_grad()
+    torch.manual_seed(0)
+    image = torch.randn(2, 3, 32, 32, device=device)
+    text = torch.randint(1, 1000, (2, 16), device=device)
+    image_features, text_features, _ = model(image, text)
+    (image_features @ text_features.T).sum().backward()
+    return {n: p.grad.clone() for n, p in model.named_parameters() if p.grad is not None}
+
+
+def test_parse_layer_selection():
+    assert parse_layer_selection(True, 4) == [0, 1, 2, 3]
+    assert parse_layer_selection('none', 4) == []
+    assert parse_layer_selection('every:2', 4) == [0, 2]
+    assert parse_layer_selection('first:3', 4) == [0, 1, 2]
+    assert parse_layer_selection('last:1', 4) == [3]
+    assert parse_layer_selection('3,1', 4) == [1, 3]
+    assert parse_layer_selection([2, 0], 4) == [0, 2]
+    with pytest.raises(ValueError):
+        parse_layer_selection('every:0', 4)
+    with pytest.raises(AssertionError):
+        parse_layer_selection([4], 4)
+
+
+def test_activation_offload_cpu_noop():
+    offload = ActivationOffload(min_numel=1)
+    x = torch.randn(8, 8, requires_grad=True)
+    with offload.layer(0):
+        y = (x * 2).sin()
+    y.sum().backward()
+    assert not offload.slots
+    assert torch.allclose(x.grad, 2 * (x * 2).cos())
+
+
+@pytest.mark.parametrize("device", [
+    'cpu',
+    pytest.param('cuda', marks=pytest.mark.skipif(not torch.cuda.is_available(), reason='requires CUDA')),
+])
+@pytest.mark.parametrize("grad_checkpointing", [False, 'every:2'])
+def test_activation_offload(device, grad_checkpointing):
+    model = _tiny_clip(device)
+    expected = _grads(model, device)
+    model.set_grad_checkpointing(grad_checkpointing)
+    model.set_activation_offload('every:2')
+    assert model.transformer.activation_offload_layers == [0, 2]
+    grads = _grads(model, device)
+    assert grads.keys() == expected.keys()
+    for name, grad in grads.items():
+        assert torch.allclose(grad, expected[name], atol=1e-5), name
+
+
+def test_coca_activation_offload():
+    torch.manual_seed(0)
+    model = CoCa(
+        embed_dim=32,
+        multimodal_cfg=dict(context_length=16, width=32, heads=4, layers=2),
+        text_cfg=dict(context_length=16, width=32, heads=4, layers=2, embed_cls=True, output_tokens=True),
+        vision_cfg=dict(image_size=32, patch_size=8, width=32, head_width=16, layers=2,
+                        attentional_pool=True, attn_pooler_heads=4, output_tokens=True),
+    )
+    model.set_activation_offload()
+    assert model.text_decoder.activation_offload_layers == [0, 1]
+    out = model(torch.randn(2, 3, 32, 32), torch.randint(1, 1000, (2, 16)))
+    out['logits'].sum().backward()
+    assert model.text_decoder.resblocks[0].attn.in_proj_weight.grad is not None
@@ -0,0 +1,141 @@
+import pytest
+import torch
+
+from open_clip import CLIP
+from open_clip.transformer import Attention, AttentionalPooler, ResidualAttentionBlock, TextTransformer, \
+    scaled_dot_product_attention
+
+pytestmark = pytest.mark.skipif(
+    not hasattr(torch.nn.functional, 'scaled_dot_product_attention'),
+    reason='F.scaled_dot_product_attention requires PyTorch 2.0')
+
+
+def _set_fused_attn(model, enable):
+    for m in model.modules():
+        if hasattr(m, 'fused_attn'):
+            m.fused_attn = enable
+
+
+def _fused_and_eager(model, *args, **kwargs):
+    model.eval()
+    with torch.no_grad():
+        _set_fused_attn(model, True)
+        fused = model(*args, **kwargs)
+        _set_fused_attn(model, False)
+        eager = model(*args, **kwargs)
+    return fused, eager
+
+
+def _causal_mask(n):
+    return torch.empty(n, n).fill_(float('-inf')).triu_(1)
+
+
+@pytest.mark.parametrize("is_causal", [False, True])
+def test_scaled_dot_product_attention(is_causal):
+    q, k, v = torch.randn(3, 2, 4, 10, 8).unbind(0)
+    attn_mask = None if is_causal else torch.randn(10, 10)
+    fused = scaled_dot_product_attention(q, k, v, attn_mask=attn_mask, is_causal=is_causal, fused=True)
+    eager = scaled_dot_product_attention(q, k, v, attn_mask=attn_mask, is_causal=is_causal, fused=False)
+    assert torch.allclose(fused, eager, atol=1e-5)
+
+
+def test_residual_attention_block():
+    torch.manual_seed(0)
+    block = ResidualAttentionBlock(32, 4)
+    x = torch.randn(10, 3, 32)
+    fused, eager = _fused_and_eager(block, x)
+    assert torch.allclose(fused, eager, atol=1e-5)
+
+    # is_causal skips the mask on the fused path only
+    fused, eager = _fused_and_eager(block, x, attn_mask=_causal_mask(10), is_causal=True)
+    assert torch.allclose(fused, eager, atol=1e-5)
+
+
+def test_cross_attention_block():
+    torch.manual_seed(0)
+    block = ResidualAttentionBlock(32, 4, is_cross_attention=True)
+    x, context = torch.randn(10, 3, 32), torch.randn(7, 3, 32)
+    fused, eager = _fused_and_eager(block, x, k_x=context, v_x=context)
+    assert torch.allclose(fused, eager, atol=1e-5)
+
+
+@pytest.mark.parametrize("scaled_cosine,scale_heads", [(False, False), (True, False), (False, True)])
+def test_custom_attention(scaled_cosine, scale_heads):
+    torch.manual_seed(0)
+    attn = Attention(32, 4, scaled_cosine=scaled_cosine, scale_heads=scale_heads)
+    assert attn.fused_attn == (not scaled_cosine and not scale_heads)
+    x = torch.randn(10, 3, 32)
+    fused, eager = _fused_and_eager(attn, x, attn_mask=_causal_mask(10))
+    assert torch.allclose(fused, eager, atol=1e-5)
+
+
+@pytest.mark.parametrize("context_dim", [32, 48])
+def test_attentional_pooler(context_dim):
+    torch.manual_seed(0)
+    pooler = AttentionalPooler(32, context_dim, n_head=4, n_queries=5)
+    x = torch.randn(3, 10, context_dim)
+    fused, eager = _fused_and_eager(pooler, x)
+    assert torch.allclose(fused, eager, atol=1e-5)
+
+
+@pytest.mark.parametrize("embed_cls", [False, True])
+def test_text_transformer(embed_cls):
+    torch.manual_seed(0)
+    model = TextTransformer(context_length=16, width=32, heads=4, layers=2, embed_cls=embed_cls)
+    text = torch.randint(1, 1000, (3, 16))
+    fused, eager = _fused_and_eager(model, text)
+    assert torch.allclose(fused, eager, atol=1e-5)
+
+
+def test_clip_encode_text():
+    torch.manual_seed(0)
+    model = CLIP(
+        embed_dim=16,
+        vision_cfg=dict(image_size=32, patch_size=8, width=32, head_width=16, layers=1),
+        text_cfg=dict(context_length=16, width=32, heads=4, layers=2),
+    )
+    text = torch.randint(1, 1000, (3, 16))
+    image = torch.randn(3, 3, 32, 32)
+    (fused_image, fused_text, _), (eager_image, eager_text, _) = _fused_and_eager(model, image, text)
+    assert torch.allclose(fused_image, eager_image, atol=1e-5)
+    assert torch.allclose(fused_text, eager_text, atol=1e-5)
+
+
+@pytest.mark.parametrize("fused", [False, True])
+@pytest.mark.parametrize("scaled_cosine,scale_heads", [(False, False), (True, False), (False, True)])
+def test_batch_first_attention(fused, scaled_cosine, scale_heads):
+    torch.manual_seed(0)
+    attn = Attention(32, 4, scaled_cosine=scaled_cosine, scale_heads=scale_heads).eval()
+    attn_bf = Attention(32, 4, scaled_cosine=scaled_cosine, scale_heads=scale_heads, batch_first=True).eval()
+    attn_bf.load_state_dict(attn.state_dict())
+    _set_fused_attn(attn, fused)
+    _set_fused_attn(attn_bf, fused)
+    x = torch.randn(3, 10, 32)
+    with torch.no_grad():
+        expected = attn(x.transpose(0, 1), attn_mask=_causal_mask(10)).transpose(0, 1)
+        out = attn_bf(x, attn_mask=_causal_mask(10))
+    assert torch.allclose(out, expected, atol=1e-5)
+
+
+@pytest.mark.parametrize("fused", [False, True])
+def test_batch_first_clip(fused):
+    def _clip(batch_first):
+        torch.manual_seed(0)
+        return CLIP(
+            embed_dim=16,
+            vision_cfg=dict(image_size=32, patch_size=8, width=32, head_width=16, layers=1, batch_first=batch_first),
+            text_cfg=dict(context_length=16, width=32, heads=4, layers=2, batch_first=batch_first),
+        ).eval()
+
+    model, model_bf = _clip(False), _clip(True)
+    # same parameter names, checkpoints load unchanged
+    model_bf.load_state_dict(model.state_dict())
+    _set_fused_attn(model, fused)
+    _set_fused_attn(model_bf, fused)
+    text = torch.randint(1, 1000, (3, 16))
+    image = torch.randn(3, 3, 32, 32)
+    with torch.no_grad():
+        image_features, text_features, _ = model(image, text)
+        image_features_bf, text_features_bf, _ = model_bf(image, text)
+    assert torch.allclose(image_features_bf, image_features, atol=1e-5)
+    assert torch.allclose(text_features_bf, text_features, atol=1e-5)
@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+import torch
+
+from open_clip.coca_model import CoCa
+from open_clip.generation import CaptionEngine, AsyncCaptionServer
+
+transformers = pytest.importorskip("transformers")
+
+
+def _tiny_coca(batch_first=False):
+    torch.manual_seed(0)
+    model = CoCa(
+        embed_dim=32,
+        multimodal_cfg=dict(context_length=76, width=32, heads=4, layers=2, batch_first=batch_first),
+        text_cfg=dict(context_length=76, width=32, heads=4, layers=2, embed_cls=True, output_tokens=True,
+                      batch_first=batch_first),
+        vision_cfg=dict(image_size=32, patch_size=8, width=32, head_width=16, layers=2,
+                        attentional_pool=True, attn_pooler_heads=4, output_tokens=True, batch_first=batch_first),
+    )
+    return model.eval()
+
+
+def test_cached_logits():
+    model = _tiny_coca()
+    image = torch.randn(2, 3, 32, 32)
+    text = torch.randint(1, 49406, (2, 12))
+    with torch.no_grad():
+        _, image_embs = model._encode_image(image)
+        expected = model(image, text)['logits']
+
+        kv_cache = {}
+        logits = [model._forward_cached(text[:, :5], image_embs, kv_cache)]
+        for i in range(5, text.shape[1]):
+            logits.append(model._forward_cached(text[:, i:i + 1], image_embs, kv_cache))
+        logits = torch.cat(logits, dim=1)
+
+    assert kv_cache['offset'] == text.shape[1]
+    assert torch.allclose(logits, expected, atol=1e-5)
+
+
+def test_batch_first_cached_logits():
+    model = _tiny_coca()
+    model_bf = _tiny_coca(batch_first=True)
+    model_bf.load_state_dict(model.state_dict())
+    image = torch.randn(2, 3, 32, 32)
+    text = torch.randint(1, 49406, (2, 12))
+    with torch.no_grad():
+        expected = model(image, text)
+        output = model_bf(image, text)
+        for k in ('image_features', 'text_features', 'logits'):
+            assert torch.allclose(output[k], expected[k], atol=1e-5)
+
+        _, image_embs = model_bf._encode_image(image)
+        kv_cache = {}
+        logits = [model_bf._forward_cached(text[:, :5], image_embs, kv_cache)]
+        for i in range(5, text.shape[1]):
+            logits.append(model_bf._forward_cached(text[:, i:i + 1], image_embs, kv_cache))
+    assert torch.allclose(torch.cat(logits, dim=1), expected['logits'], atol=1e-5)
+
+
+@pytest.mark.parametrize("generation_type", ["top_k", "top_p", "beam_search"])
+def test_generate_with_cache(generation_type):
+    model = _tiny_coca()
+    image = torch.randn(2, 3, 32, 32)
+    kwargs = dict(generation_type=generation_type, seq_len=12, top_k=1, top_p=0.1, num_beams=4, num_beam_groups=2)
+
+    torch.manual_seed(0)
+    expected = model.generate(image, use_cache=False, **kwargs)
+    torch.manual_seed(0)
+    output = model.generate(image, use_cache=True, **kwargs)
+    assert torch.equal(output, expected)
+
+
+def _generate_reference(model, images, seq_lens):
+    return [
+        model.generate(image[None], generation_type='top_k', top_k=1, seq_len=seq_len)[0]
+        for image, seq_len in zip(images, seq_lens)
+    ]
+
+
+def test_caption_engine():
+    model = _tiny_coca()
+    images = torch.randn(5, 3, 32, 32)
+    seq_lens = [12, 7, 9, 6, 10]
+    engine = CaptionEngine(model, max_batch_size=2, seq_len=12, generation_type='top_k', top_k=1)
+    request_ids = [engine.add_request(image, seq_len=seq_len) for image, seq_len in zip(images, seq_lens)]
+
+    outputs = {}
+    while engine.has_unfinished():
+        assert engine.num_active <= 2
+        outputs.update(engine.step())
+
+    for request_id, expected in zip(request_ids, _generate_reference(model, images, seq_lens)):
+        assert torch.equal(outputs[request_id], expected)
+
+
+def test_async_caption_server():
+    model = _tiny_coca()
+    images = torch.randn(4, 3, 32, 32)
+    seq_lens = [8, 12, 6, 10]
+    engine = CaptionEngine(model, max_batch_size=3, seq_len=12, generation_type='top_k', top_k=1)
+
+    async def _caption_all():
+        async with AsyncCaptionServer(engine) as server:
+            return await asyncio.gather(*[
+                server.generate(image, seq_len=seq_len) for image, seq_len in zip(images, seq_lens)])
+
+    outputs = asyncio.run(_caption_all())
+    for output, expected in zip(outputs, _generate_reference(model, images, seq_lens)):
+        assert torch.equal(output, expected)
@@ -0,0 +1,186 @@
+import os
+import socket
+
+import pytest
+import torch
+import torch.distributed as dist
+import torch.distributed.nn
+import torch.multiprocessing as mp
+import torch.nn.functional as F
+from torch import nn
+
+from open_clip.loss import AsyncImageGather, ClipLoss, DistillClipLoss, SigLipLoss, gather_features
+
+pytestmark = pytest.mark.skipif(
+    not dist.is_available() or not dist.is_gloo_available(), reason='requires torch.distributed w/ gloo')
+
+WORLD_SIZE = 2
+BATCH_SIZE = 4
+
+
+class _Towers(nn.Module):
+    def __init__(self):
+        super().__init__()
+        torch.manual_seed(0)
+        self.visual = nn.Linear(8, 16)
+        self.text = nn.Linear(12, 16)
+
+    def forward(self, image, text):
+        return F.normalize(self.visual(image), dim=-1), F.normalize(self.text(text), dim=-1)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _input_grads(model, loss, image, text):
+    image = image.clone().requires_grad_()
+    text = text.clone().requires_grad_()
+    image_features, text_features = model(image, text)
+    loss(image_features, text_features, 10.).backward()
+    return image.grad, text.grad
+
+
+def _gather_worker(rank, port, async_gather, local_loss, gather_with_grad):
+    os.environ['MASTER_ADDR'] = '127.0.0.1'
+    os.environ['MASTER_PORT'] = str(port)
+    dist.init_process_group('gloo', rank=rank, world_size=WORLD_SIZE)
+
+    generator = torch.Generator().manual_seed(0)
+    image = torch.randn(WORLD_SIZE * BATCH_SIZE, 8, generator=generator)
+    text = torch.randn(WORLD_SIZE * BATCH_SIZE, 12, generator=generator)
+    model = _Towers()
+    expected_image_grad, expected_text_grad = _input_grads(model, ClipLoss(), image, text)
+
+    loss = ClipLoss(local_loss=local_loss, gather_with_grad=gather_with_grad, rank=rank, world_size=WORLD_SIZE)
+    if async_gather:
+        loss.async_gather = AsyncImageGather(local_loss, gather_with_grad, rank, WORLD_SIZE)
+        loss.async_gather.register(model)
+    local = slice(rank * BATCH_SIZE, (rank + 1) * BATCH_SIZE)
+    for _ in range(2):
+        # the second step reuses the persistent gather buffers
+        image_grad, text_grad = _input_grads(model, loss, image[local], text[local])
+        # w/ the full distributed gradient, the loss of every rank contributes to the local features
+        scale = WORLD_SIZE if gather_with_grad else 1
+        assert torch.allclose(image_grad, scale * expected_image_grad[local], atol=1e-6)
+        assert torch.allclose(text_grad, scale * expected_text_grad[local], atol=1e-6)
+    dist.destroy_process_group()
+
+
+@pytest.mark.parametrize("async_gather", [False, True])
+@pytest.mark.parametrize("local_loss,gather_with_grad", [(False, False), (False, True), (True, True)])
+def test_gather_features(async_gather, local_loss, gather_with_grad):
+    mp.spawn(
+        _gather_worker, args=(_free_port(), async_gather, local_loss, gather_with_grad), nprocs=WORLD_SIZE)
+
+
+def _distill_worker(rank, port):
+    os.environ['MASTER_ADDR'] = '127.0.0.1'
+    os.environ['MASTER_PORT'] = str(port)
+    dist.init_process_group('gloo', rank=rank, world_size=WORLD_SIZE)
+
+    # student and teacher w/ the same embed dim, their gathers have the same buffer shape
+    generator = torch.Generator().manual_seed(0)
+    image_features, text_features, dist_image_features, dist_text_features = (
+        F.normalize(torch.randn(WORLD_SIZE * BATCH_SIZE, 16, generator=generator), dim=-1) for _ in range(4))
+    local = slice(rank * BATCH_SIZE, (rank + 1) * BATCH_SIZE)
+    loss = DistillClipLoss(local_loss=True, rank=rank, world_size=WORLD_SIZE)
+
+    # reference local loss against the (constant) features of all ranks
+    local_image_features = image_features[local].clone().requires_grad_()
+    local_text_features = text_features[local].clone().requires_grad_()
+    labels = torch.arange(BATCH_SIZE) + rank * BATCH_SIZE
+    logits_per_image = 10. * local_image_features @ text_features.T
+    logits_per_text = 10. * local_text_features @ image_features.T
+    dist_logits_per_image = 20. * dist_image_features[local] @ dist_text_features.T
+    dist_logits_per_text = 20. * dist_text_features[local] @ dist_image_features.T
+    contrastive_loss = (F.cross_entropy(logits_per_image, labels) + F.cross_entropy(logits_per_text, labels)) / 2
+    distill_loss = (
+        loss.dist_loss(dist_logits_per_image, logits_per_image) +
+        loss.dist_loss(dist_logits_per_text, logits_per_text)
+    ) / 2
+    (contrastive_loss + distill_loss).backward()
+    expected_image_grad, expected_text_grad = local_image_features.grad, local_text_features.grad
+
+    for _ in range(2):
+        local_image_features = image_features[local].clone().requires_grad_()
+        local_text_features = text_features[local].clone().requires_grad_()
+        sum(loss(
+            local_image_features, local_text_features, 10.,
+            dist_image_features[local], dist_text_features[local], 20.,
+        )).backward()
+        assert torch.allclose(local_image_features.grad, expected_image_grad, atol=1e-6)
+        assert torch.allclose(local_text_features.grad, expected_text_grad, atol=1e-6)
+    dist.destroy_process_group()
+
+
+def test_distill_local_loss():
+    mp.spawn(_distill_worker, args=(_free_port(),), nprocs=WORLD_SIZE)
+
+
+def _reduce_scatter_worker(rank, port):
+    os.environ['MASTER_ADDR'] = '127.0.0.1'
+    os.environ['MASTER_PORT'] = str(port)
+    dist.init_process_group('gloo', rank=rank, world_size=WORLD_SIZE)
+
+    generator = torch.Generator().manual_seed(rank)
+    image_features = torch.randn(BATCH_SIZE, 16, generator=generator, requires_grad=True)
+    text_features = torch.randn(BATCH_SIZE, 16, generator=generator, requires_grad=True)
+    # a different upstream gradient on every rank
+    weight = torch.randn(WORLD_SIZE * BATCH_SIZE, 16, generator=generator)
+
+    all_image_features, all_text_features = gather_features(
+        image_features, text_features, gather_with_grad=True, rank=rank, world_size=WORLD_SIZE)
+    (weight * all_image_features + weight.flip(0) * all_text_features).sum().backward()
+    image_grad, text_grad = image_features.grad, text_features.grad
+
+    # previous implementation, all_gather w/ an all-reduce backward
+    image_features.grad = text_features.grad = None
+    all_image_features = torch.cat(torch.distributed.nn.all_gather(image_features), dim=0)
+    all_text_features = torch.cat(torch.distributed.nn.all_gather(text_features), dim=0)
+    (weight * all_image_features + weight.flip(0) * all_text_features).sum().backward()
+    assert torch.allclose(image_grad, image_features.grad, atol=1e-6)
+    assert torch.allclose(text_grad, text_features.grad, atol=1e-6)
+    dist.destroy_process_group()
+
+
+def test_gather_with_grad_reduce_scatter():
+    mp.spawn(_reduce_scatter_worker, args=(_free_port(),), nprocs=WORLD_SIZE)
+
+
+def _siglip_worker(rank, port, world_size, bidir):
+    os.environ['MASTER_ADDR'] = '127.0.0.1'
+    os.environ['MASTER_PORT'] = str(port)
+    dist.init_process_group('gloo', rank=rank, world_size=world_size)
+
+    generator = torch.Generator().manual_seed(0)
+    image_features = F.normalize(torch.randn(world_size * BATCH_SIZE, 16, generator=generator), dim=-1)
+    text_features = F.normalize(torch.randn(world_size * BATCH_SIZE, 16, generator=generator), dim=-1)
+    image_features.requires_grad_()
+    text_features.requires_grad_()
+    logit_scale, logit_bias = torch.tensor(10.), torch.tensor(-10.)
+
+    # reference sigmoid loss over the full batch w/ the explicit label matrix
+    labels = 2 * torch.eye(world_size * BATCH_SIZE) - 1
+    logits = logit_scale * image_features @ text_features.T + logit_bias
+    (-F.logsigmoid(labels * logits).sum() / BATCH_SIZE).backward()
+    expected_image_grad, expected_text_grad = image_features.grad, text_features.grad
+
+    loss = SigLipLoss(rank=rank, world_size=world_size, bidir=bidir)
+    local = slice(rank * BATCH_SIZE, (rank + 1) * BATCH_SIZE)
+    for _ in range(2):
+        # the second step reuses the ring receive buffers
+        local_image_features = image_features[local].detach().requires_grad_()
+        local_text_features = text_features[local].detach().requires_grad_()
+        loss(local_image_features, local_text_features, logit_scale, logit_bias).backward()
+        assert torch.allclose(local_image_features.grad, expected_image_grad[local], atol=1e-5)
+        assert torch.allclose(local_text_features.grad, expected_text_grad[local], atol=1e-5)
+    dist.destroy_process_group()
+
+
+@pytest.mark.parametrize("world_size", [2, 4])
+@pytest.mark.parametrize("bidir", [False, True])
+def test_siglip_ring(world_size, bidir):
+    mp.spawn(_siglip_worker, args=(_free_port(), world_size, bidir), nprocs=world_size)
@@ -0,0 +1,173 @@
+import os
+import socket
+from argparse import Namespace
+from contextlib import nullcontext
+
+import pytest
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.distributed.algorithms.ddp_comm_hooks import default_hooks
+from torch.nn.parallel import DistributedDataParallel
+
+from open_clip import CLIP, ClipLoss, CoCaLoss
+from open_clip.loss import SigLipLoss
+from open_clip.coca_model import CoCa
+import training.train
+from training.train import train_one_epoch
+
+pytestmark = pytest.mark.skipif(
+    not dist.is_available() or not dist.is_gloo_available(), reason='requires torch.distributed w/ gloo')
+
+WORLD_SIZE = 2
+BATCH_SIZE = 4
+NUM_STEPS = 2
+
+
+class _DataLoader:
+    def __init__(self, batches):
+        self.batches = batches
+        self.num_batches = len(batches)
+        self.num_samples = len(batches) * BATCH_SIZE
+
+    def __iter__(self):
+        return iter(self.batches)
+
+
+class _DataInfo:
+    def __init__(self, dataloader):
+        self.dataloader = dataloader
+        self.normalize = None
+
+    def set_epoch(self, epoch):
+        pass
+
+
+def _args(accum_freq, **kwargs):
+    args = dict(
+        device='cpu', precision='fp32', accum_freq=accum_freq, grad_cache=False, distill=False, skip_scheduler=True,
+        horovod=False, grad_clip_norm=None, log_every_n_steps=100, world_size=1, batch_size=BATCH_SIZE, rank=0,
+        local_rank=0, wandb=False,
+    )
+    args.update(kwargs)
+    return Namespace(**args)
+
+
+def _tiny_model(model_cls=CLIP, **kwargs):
+    torch.manual_seed(0)
+    if model_cls is CoCa:
+        return CoCa(
+            embed_dim=16,
+            multimodal_cfg=dict(context_length=16, width=32, heads=4, layers=1),
+            text_cfg=dict(context_length=16, width=32, heads=4, layers=1, embed_cls=True, output_tokens=True),
+            vision_cfg=dict(image_size=32, patch_size=8, width=32, head_width=16, layers=1,
+                            attentional_pool=True, attn_pooler_heads=4, output_tokens=True),
+        )
+    return CLIP(
+        embed_dim=16,
+        vision_cfg=dict(image_size=32, patch_size=8, width=32, head_width=16, layers=1),
+        text_cfg=dict(context_length=16, width=32, heads=4, layers=1),
+        output_dict=True,
+        **kwargs,
+    )
+
+
+def _batches(num_batches, batch_size, generator):
+    return [
+        (torch.randn(batch_size, 3, 32, 32, generator=generator),
+         torch.randint(1, 1000, (batch_size, 16), generator=generator))
+        for _ in range(num_batches)
+    ]
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _train_worker(rank, port, accum_freq, sync_every_backward, out_dir):
+    os.environ['MASTER_ADDR'] = '127.0.0.1'
+    os.environ['MASTER_PORT'] = str(port)
+    dist.init_process_group('gloo', rank=rank, world_size=WORLD_SIZE)
+    if sync_every_backward:
+        # previous behavior, all-reduce in every backward pass
+        training.train.no_sync = lambda model, enable=True: nullcontext()
+
+    model = DistributedDataParallel(_tiny_model())
+    num_all_reduce = [0]
+
+    def _counting_hook(state, bucket):
+        num_all_reduce[0] += 1
+        return default_hooks.allreduce_hook(state, bucket)
+    model.register_comm_hook(None, _counting_hook)
+
+    batches = _batches(NUM_STEPS * accum_freq, BATCH_SIZE, torch.Generator().manual_seed(rank))
+    args = _args(accum_freq, world_size=WORLD_SIZE, rank=rank, local_rank=rank)
+    loss = ClipLoss(gather_with_grad=True, rank=rank, world_size=WORLD_SIZE)
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+    train_one_epoch(model, {'train': _DataInfo(_DataLoader(batches))}, loss, 0, optimizer, None, None, None, args)
+
+    torch.save({
+        'all_reduce_per_step': num_all_reduce[0] / NUM_STEPS,
+        'state_dict': model.module.state_dict(),
+    }, os.path.join(out_dir, f'{rank}.pt'))
+    dist.destroy_process_group()
+
+
+def _train(tmp_path, accum_freq, sync_every_backward=False):
+    out_dir = tmp_path / f'{accum_freq}_{sync_every_backward}'
+    out_dir.mkdir()
+    mp.spawn(
+        _train_worker, args=(_free_port(), accum_freq, sync_every_backward, str(out_dir)), nprocs=WORLD_SIZE)
+    return [torch.load(out_dir / f'{rank}.pt') for rank in range(WORLD_SIZE)]
+
+
+def test_grad_accum_no_sync(tmp_path):
+    baseline = _train(tmp_path, accum_freq=1)
+    accum_sync = _train(tmp_path, accum_freq=3, sync_every_backward=True)
+    accum = _train(tmp_path, accum_freq=3)
+
+    # one gradient all-reduce (per bucket) per optimizer step, whatever the accumulation
+    num_buckets = baseline[0]['all_reduce_per_step']
+    assert accum_sync[0]['all_reduce_per_step'] == 3 * num_buckets
+    assert accum[0]['all_reduce_per_step'] == num_buckets
+
+    # ranks stay in sync and end up w/ the same weights as w/ an all-reduce per backward
+    for rank in range(1, WORLD_SIZE):
+        for k, v in accum[0]['state_dict'].items():
+            assert torch.equal(v, accum[rank]['state_dict'][k]), k
+    for k, v in accum[0]['state_dict'].items():
+        assert torch.allclose(v, accum_sync[0]['state_dict'][k], atol=1e-6), k
+
+
+@pytest.mark.parametrize("model_cls,loss", [
+    (CLIP, ClipLoss()),
+    (CLIP, SigLipLoss()),
+    (CoCa, CoCaLoss(caption_loss_weight=1.0, clip_loss_weight=1.0)),
+])
+def test_grad_cache(model_cls, loss):
+    accum_freq = 3
+    batches = _batches(NUM_STEPS * accum_freq, BATCH_SIZE, torch.Generator().manual_seed(0))
+    model_kwargs = dict(init_logit_bias=-10.) if isinstance(loss, SigLipLoss) else {}
+
+    # one loss over the features of all accum_freq batches is the loss of their concatenation
+    expected = _tiny_model(model_cls, **model_kwargs)
+    full_batches = [
+        tuple(torch.cat(x) for x in zip(*batches[i:i + accum_freq])) for i in range(0, len(batches), accum_freq)]
+    optimizer = torch.optim.SGD(expected.parameters(), lr=0.1)
+    train_one_epoch(
+        expected, {'train': _DataInfo(_DataLoader(full_batches))}, loss, 0, optimizer, None, None, None,
+        _args(1, batch_size=accum_freq * BATCH_SIZE),
+    )
+
+    model = _tiny_model(model_cls, **model_kwargs)
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+    train_one_epoch(
+        model, {'train': _DataInfo(_DataLoader(batches))}, loss, 0, optimizer, None, None, None,
+        _args(accum_freq, grad_cache=True),
+    )
+
+    expected = expected.state_dict()
+    for k, v in model.state_dict().items():
+        assert torch.allclose(v, expected[k], atol=1e-5), k
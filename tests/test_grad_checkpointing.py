@@ -0,0 +1,87 @@
+import pytest
+import torch
+
+from open_clip import CLIP, CustomTextCLIP
+from open_clip.coca_model import CoCa
+from open_clip.transformer import Transformer, parse_grad_checkpointing
+
+POLICIES = ['all', 'every:2', 'first:1', 'attn', 'mlp', 'auto:0', 'auto:1000']
+
+
+def _tiny_model(model_cls):
+    torch.manual_seed(0)
+    if model_cls is CoCa:
+        return CoCa(
+            embed_dim=32,
+            multimodal_cfg=dict(context_length=16, width=32, heads=4, layers=3),
+            text_cfg=dict(context_length=16, width=32, heads=4, layers=3, embed_cls=True, output_tokens=True),
+            vision_cfg=dict(image_size=32, patch_size=8, width=32, head_width=16, layers=3,
+                            attentional_pool=True, attn_pooler_heads=4, output_tokens=True),
+        )
+    return model_cls(
+        embed_dim=16,
+        vision_cfg=dict(image_size=32, patch_size=8, width=32, head_width=16, layers=3),
+        text_cfg=dict(context_length=16, width=32, heads=4, layers=3),
+    )
+
+
+def _grads(model, policy):
+    model.zero_grad()
+    model.set_grad_checkpointing(policy)
+    torch.manual_seed(0)
+    image = torch.randn(2, 3, 32, 32, requires_grad=True)
+    text = torch.randint(1, 1000, (2, 16))
+    out = model(image, text)
+    out = out.values() if isinstance(out, dict) else out
+    sum(o.float().sum() for o in out if isinstance(o, torch.Tensor)).backward()
+    return {n: p.grad.clone() for n, p in model.named_parameters() if p.grad is not None}
+
+
+@pytest.mark.parametrize("model_cls", [CLIP, CustomTextCLIP, CoCa])
+@pytest.mark.parametrize("policy", POLICIES)
+def test_grad_checkpointing_policy(model_cls, policy):
+    model = _tiny_model(model_cls)
+    expected = _grads(model, False)
+    grads = _grads(model, policy)
+    assert grads.keys() == expected.keys()
+    for name, grad in grads.items():
+        assert torch.allclose(grad, expected[name], atol=1e-5), name
+
+
+def test_checkpoint_plan():
+    transformer = Transformer(32, 4, 4)
+    x = torch.randn(10, 2, 32)
+    transformer.set_grad_checkpointing('every:2')
+    assert transformer.checkpoint_plan(x) == ['block', '', 'block', '']
+    transformer.set_grad_checkpointing('first:1')
+    assert transformer.checkpoint_plan(x) == ['block', '', '', '']
+    transformer.set_grad_checkpointing('attn')
+    assert transformer.checkpoint_plan(x) == ['attn'] * 4
+    transformer.set_grad_checkpointing('auto:0')
+    assert transformer.checkpoint_plan(x) == ['block'] * 4
+    transformer.set_grad_checkpointing('auto:1000')
+    assert transformer.checkpoint_plan(x) == [''] * 4
+    transformer.set_grad_checkpointing(False)
+    assert not transformer.grad_checkpointing
+
+
+def test_checkpoint_plan_auto_budget():
+    transformer = Transformer(32, 4, 4)
+    for block in transformer.resblocks:
+        block.fused_attn = True
+    x = torch.randn(10, 2, 32)
+    input_bytes = x.numel() * x.element_size()
+    layer_bytes = input_bytes * (8 + 2 * 4)
+
+    # two layers w/ all activations, two checkpointed ones w/ their inputs only
+    budget_gb = (2 * layer_bytes + 2 * input_bytes) / 2 ** 30
+    transformer.set_grad_checkpointing(f'auto:{budget_gb}')
+    assert transformer.checkpoint_plan(x) == ['block', 'block', '', '']
+    transformer.set_grad_checkpointing(f'auto:{budget_gb * 0.99}')
+    assert transformer.checkpoint_plan(x) == ['block', 'block', 'block', '']
+
+
+@pytest.mark.parametrize("policy", ['every', 'every:0', 'first:x', 'auto', 'attn:2', 'some'])
+def test_invalid_grad_checkpointing_policy(policy):
+    with pytest.raises(ValueError):
+        parse_grad_checkpointing(policy)
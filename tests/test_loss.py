@@ -0,0 +1,56 @@
+import pytest
+import torch
+import torch.nn.functional as F
+
+from open_clip.loss import ClipLoss, CoCaLoss
+
+
+def _random_features(batch_size, dim, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    image_features = F.normalize(torch.randn(batch_size, dim, generator=generator), dim=-1)
+    text_features = F.normalize(torch.randn(batch_size, dim, generator=generator), dim=-1)
+    logit_scale = torch.tensor(1 / 0.07)
+    return image_features, text_features, logit_scale
+
+
+def _loss_and_grads(loss_fn, image_features, text_features, logit_scale):
+    image_features = image_features.clone().requires_grad_()
+    text_features = text_features.clone().requires_grad_()
+    logit_scale = logit_scale.clone().requires_grad_()
+    loss = loss_fn(image_features, text_features, logit_scale)
+    loss.backward()
+    return loss.detach(), image_features.grad, text_features.grad, logit_scale.grad
+
+
+@pytest.mark.parametrize("batch_size,chunk_size", [(32, 8), (33, 8), (16, 64)])
+def test_chunked_clip_loss(batch_size, chunk_size):
+    features = _random_features(batch_size, 24)
+    expected = _loss_and_grads(ClipLoss(), *features)
+    actual = _loss_and_grads(ClipLoss(chunk_size=chunk_size), *features)
+    for e, a in zip(expected, actual):
+        assert torch.allclose(e, a, atol=1e-5, rtol=1e-4)
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason='requires CUDA autocast')
+@pytest.mark.parametrize("dtype", [torch.float16, torch.bfloat16])
+def test_chunked_clip_loss_autocast(dtype, monkeypatch):
+    monkeypatch.setattr(torch.backends.cuda.matmul, 'allow_tf32', False)
+    features = [f.cuda() for f in _random_features(32, 24)]
+    expected = _loss_and_grads(ClipLoss(), *features)
+    # chunked logits are computed in fp32 in forward and backward, w/ or w/o autocast
+    with torch.cuda.amp.autocast(dtype=dtype):
+        actual = _loss_and_grads(ClipLoss(chunk_size=8), *features)
+    for e, a in zip(expected, actual):
+        assert torch.allclose(e, a, atol=1e-5, rtol=1e-4)
+
+
+def test_chunked_coca_contrastive_loss():
+    image_features, text_features, logit_scale = _random_features(12, 16)
+    logits = torch.randn(12, 5, 10)
+    labels = torch.randint(1, 10, (12, 5))
+    expected = CoCaLoss(caption_loss_weight=2., clip_loss_weight=1.)(
+        image_features, text_features, logits, labels, logit_scale)
+    actual = CoCaLoss(caption_loss_weight=2., clip_loss_weight=1., chunk_size=5)(
+        image_features, text_features, logits, labels, logit_scale)
+    for e, a in zip(expected, actual):
+        assert torch.allclose(e, a, atol=1e-5)
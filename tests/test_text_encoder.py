@@ -0,0 +1,33 @@
+import pytest
+import torch
+
+from open_clip import CLIP, CustomTextCLIP, SimpleTokenizer
+
+TEXTS = ['a cat', 'a photo of a dog on the grass', 'bird']
+
+
+@pytest.mark.parametrize("model_cls", [CLIP, CustomTextCLIP])
+def test_trim_padding(model_cls):
+    torch.manual_seed(0)
+    model = model_cls(
+        embed_dim=16,
+        vision_cfg=dict(image_size=32, patch_size=8, width=32, head_width=16, layers=1),
+        text_cfg=dict(context_length=32, width=32, heads=4, layers=2),
+    ).eval()
+    text = SimpleTokenizer(context_length=32)(TEXTS)
+
+    with torch.no_grad():
+        expected = model.encode_text(text)
+        model.set_text_trim_padding()
+        trimmed = model.encode_text(text)
+    assert torch.allclose(trimmed, expected, atol=1e-5)
+
+
+def test_trim_padding_unsupported():
+    model = CustomTextCLIP(
+        embed_dim=16,
+        vision_cfg=dict(image_size=32, patch_size=8, width=32, head_width=16, layers=1),
+        text_cfg=dict(context_length=32, width=32, heads=4, layers=1, pool_type='last'),
+    )
+    with pytest.raises(AssertionError):
+        model.set_text_trim_padding()
@@ -0,0 +1,66 @@
+import pytest
+import torch
+
+from open_clip.transformer import ResidualAttentionBlock, VisionTransformer
+from open_clip.token_merging import bipartite_soft_matching, merge_wavg
+
+
+def _tiny_vit(**kwargs):
+    torch.manual_seed(0)
+    model = VisionTransformer(
+        image_size=32, patch_size=4, width=32, layers=3, heads=4, mlp_ratio=4.0, output_dim=16, **kwargs)
+    return model.eval()
+
+
+def test_bipartite_soft_matching():
+    torch.manual_seed(0)
+    x = torch.randn(2, 9, 8)
+    # token 4 (set A) duplicates token 3 (set B), the best match
+    x[:, 4] = x[:, 3]
+    size = torch.ones(2, 9)
+    merge = bipartite_soft_matching(x, r=1)
+    merged, merged_size = merge_wavg(merge, x, size)
+
+    assert merged.shape == (2, 8, 8)
+    assert torch.equal(merged[:, 0], x[:, 0])  # class token kept first
+    assert torch.equal(merged_size.sum(dim=1), size.sum(dim=1))
+    assert (merged_size == 2).sum() == 2
+    assert torch.allclose(merged[merged_size == 2], x[:, 3])
+
+
+def test_forward_merged_no_merge():
+    torch.manual_seed(0)
+    block = ResidualAttentionBlock(32, 4).eval()
+    x = torch.randn(3, 10, 32)
+    with torch.no_grad():
+        expected = block(x.transpose(0, 1)).transpose(0, 1)
+        out, size = block.forward_merged(x, torch.ones(3, 10), 0.)
+    assert torch.allclose(out, expected, atol=1e-5)
+    assert torch.equal(size, torch.ones(3, 10))
+
+
+@pytest.mark.parametrize("ratio", [0.1, [0.5, 0.25, 0.]])
+def test_vision_transformer_token_merging(ratio):
+    model = _tiny_vit(output_tokens=True)
+    image = torch.randn(2, 3, 32, 32)
+    with torch.no_grad():
+        expected, expected_tokens = model(image)
+        model.set_token_merging(ratio)
+        pooled, tokens = model(image)
+    assert pooled.shape == expected.shape
+    assert tokens.shape[1] < expected_tokens.shape[1]
+    assert torch.isfinite(pooled).all()
+
+    # merging is inference only
+    model.train()
+    with torch.no_grad():
+        _, tokens = model(image)
+    assert tokens.shape == expected_tokens.shape
+
+
+def test_token_merging_invalid_ratio():
+    model = _tiny_vit()
+    with pytest.raises(AssertionError):
+        model.set_token_merging(0.75)
+    with pytest.raises(AssertionError):
+        model.set_token_merging([0.1, 0.1])
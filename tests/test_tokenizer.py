@@ -0,0 +1,104 @@
+import random
+
+import numpy as np
+import pytest
+import torch
+
+from open_clip.tokenizer import SimpleTokenizer, get_pairs
+
+
+def _reference_bpe(tokenizer, token):
+    # original OpenAI CLIP merge loop, min() over all pairs per merge
+    word = tuple(token[:-1]) + (token[-1] + '</w>',)
+    pairs = get_pairs(word)
+    if not pairs:
+        return token + '</w>'
+    while True:
+        bigram = min(pairs, key=lambda pair: tokenizer.bpe_ranks.get(pair, float('inf')))
+        if bigram not in tokenizer.bpe_ranks:
+            break
+        first, second = bigram
+        new_word = []
+        i = 0
+        while i < len(word):
+            try:
+                j = word.index(first, i)
+                new_word.extend(word[i:j])
+                i = j
+            except ValueError:
+                new_word.extend(word[i:])
+                break
+            if word[i] == first and i < len(word) - 1 and word[i + 1] == second:
+                new_word.append(first + second)
+                i += 2
+            else:
+                new_word.append(word[i])
+                i += 1
+        word = tuple(new_word)
+        if len(word) == 1:
+            break
+        pairs = get_pairs(word)
+    return ' '.join(word)
+
+
+def test_bpe_matches_reference():
+    tokenizer = SimpleTokenizer(cache_size=0)
+    rng = random.Random(0)
+    pieces = [t.replace('</w>', '') for t in tokenizer.encoder if t not in tokenizer.special_tokens]
+    words = ['a', 'aaaa', 'aaaaaaa', 'mississippi', 'ababababa']
+    words += [''.join(rng.choices(pieces, k=rng.randint(1, 4))) for _ in range(2000)]
+    for word in words:
+        assert tokenizer.bpe(word) == _reference_bpe(tokenizer, word), word
+
+
+def test_bpe_cache_bounded():
+    tokenizer = SimpleTokenizer(cache_size=2)
+    tokenizer.encode('a photo of a photo')
+    info = tokenizer.cache_info()
+    assert info['size'] == 2
+    assert info['hits'] == 1  # second 'photo', single characters bypass the cache
+    assert info['misses'] == 2
+    assert tokenizer.encode('a photo of a photo') == SimpleTokenizer(cache_size=None).encode('a photo of a photo')
+
+
+def test_batch_encode():
+    tokenizer = SimpleTokenizer()
+    texts = ['a diagram', 'a dog', 'a cat ' * 100, '']
+    expected = torch.zeros(len(texts), 77, dtype=torch.long)
+    for i, text in enumerate(texts):
+        tokens = [tokenizer.sot_token_id] + tokenizer.encode(text) + [tokenizer.eot_token_id]
+        tokens = tokens[:77]
+        tokens[-1] = tokenizer.eot_token_id
+        expected[i, :len(tokens)] = torch.tensor(tokens)
+
+    assert torch.equal(tokenizer(texts), expected)
+    out = np.full((len(texts), 77), -1, dtype=np.int32)
+    assert tokenizer.batch_encode(texts, out=out) is out
+    assert np.array_equal(out, expected.numpy())
+    threaded = tokenizer.batch_encode(texts * 8, num_workers=2, use_threads=True, chunk_size=3)
+    assert np.array_equal(threaded, expected.repeat(8, 1).numpy())
+
+
+def test_batch_encode_threads_shared_cache():
+    # a cache much smaller than the vocabulary of the texts, every thread keeps evicting the others' entries
+    tokenizer = SimpleTokenizer(cache_size=4)
+    rng = random.Random(0)
+    words = ['photo', 'diagram', 'mississippi', 'dog', 'cat', 'bird', 'airplane', 'truck', 'horse', 'frog']
+    texts = [' '.join(rng.choices(words, k=8)) for _ in range(2000)]
+    expected = SimpleTokenizer(cache_size=0).batch_encode(texts)
+    threaded = tokenizer.batch_encode(texts, num_workers=8, use_threads=True, chunk_size=16)
+    assert np.array_equal(threaded, expected)
+    info = tokenizer.cache_info()
+    assert info['size'] <= 4
+    assert info['hits'] + info['misses'] == sum(len(text.split()) for text in texts)
+
+
+@pytest.mark.parametrize("reduction_mask", ['simple', 'random', 'shuffle'])
+def test_batch_encode_reduction_mask(reduction_mask):
+    tokenizer = SimpleTokenizer(context_length=16, reduction_mask=reduction_mask)
+    texts = ['a photo of a cat', ' '.join(['dog'] * 40)]
+    tokens = tokenizer.batch_encode(texts, dtype=np.int32)
+    assert tokens.shape == (2, 16) and tokens.dtype == np.int32
+    assert np.all(tokens[:, 0] == tokenizer.sot_token_id)
+    assert tokens[1, -1] == tokenizer.eot_token_id
+    assert tokens[0].tolist()[:7] == tokenizer('a photo of a cat')[0].tolist()[:7]
@@ -0,0 +1,79 @@
+import io
+import random
+from argparse import Namespace
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+from open_clip import get_decode_size, get_uint8_normalize, image_transform
+from training.data import get_csv_dataset, open_image
+
+
+def _random_image(seed, size=(48, 40)):
+    rng = np.random.RandomState(seed)
+    return Image.fromarray(rng.randint(0, 256, size=(size[1], size[0], 3), dtype=np.uint8))
+
+
+def _seeded(transform, image, seed=0):
+    random.seed(seed)
+    torch.manual_seed(seed)
+    return transform(image)
+
+
+@pytest.mark.parametrize("is_train", [False, True])
+def test_uint8_transform_parity(is_train):
+    preprocess = image_transform(32, is_train=is_train)
+    preprocess_uint8 = image_transform(32, is_train=is_train, uint8_output=True)
+    assert get_uint8_normalize(preprocess) is None
+    normalize = get_uint8_normalize(preprocess_uint8)
+
+    images = [_random_image(seed) for seed in range(4)]
+    expected = torch.stack([_seeded(preprocess, image, seed) for seed, image in enumerate(images)])
+    images_uint8 = torch.stack([_seeded(preprocess_uint8, image, seed) for seed, image in enumerate(images)])
+    assert images_uint8.dtype == torch.uint8
+    assert torch.equal(normalize(images_uint8), expected)
+
+
+def test_uint8_csv_dataset(tmp_path):
+    rows = []
+    for i in range(6):
+        image_path = tmp_path / f'{i}.png'
+        _random_image(i).save(image_path)
+        rows.append(f'{image_path}\tcaption {i}')
+    (tmp_path / 'data.csv').write_text('filepath\ttitle\n' + '\n'.join(rows) + '\n')
+    args = Namespace(
+        val_data=str(tmp_path / 'data.csv'), csv_img_key='filepath', csv_caption_key='title', csv_separator='\t',
+        batch_size=4, workers=0, distributed=False,
+    )
+    tokenizer = lambda texts: torch.zeros(len(texts), 4, dtype=torch.long)
+
+    data = get_csv_dataset(args, image_transform(32, is_train=False), is_train=False, tokenizer=tokenizer)
+    data_uint8 = get_csv_dataset(
+        args, image_transform(32, is_train=False, uint8_output=True), is_train=False, tokenizer=tokenizer)
+    assert data.normalize is None and data_uint8.normalize is not None
+    for (images, _), (images_uint8, _) in zip(data.dataloader, data_uint8.dataloader):
+        assert images_uint8.dtype == torch.uint8
+        assert torch.equal(data_uint8.normalize(images_uint8), images)
+
+
+def test_get_decode_size():
+    assert get_decode_size(image_transform(224, is_train=False)) == (224, 224)
+    assert get_decode_size(image_transform((224, 320), is_train=False, resize_mode='squash')) == (320, 320)
+    # smallest crop of the default (0.9, 1.0) scale and (3/4, 4/3) ratio range
+    assert get_decode_size(image_transform(224, is_train=True)) == (273, 273)
+
+
+@pytest.mark.parametrize("is_train", [False, True])
+def test_jpeg_draft_decode(is_train):
+    stream = io.BytesIO()
+    _random_image(0, size=(1200, 900)).save(stream, format='JPEG')
+    transform = image_transform(224, is_train=is_train)
+    decode_size = get_decode_size(transform)
+
+    image = open_image(io.BytesIO(stream.getvalue()), decode_size).convert('RGB')
+    # 1/4 scale for the eval transform, the train one needs more pixels for its random crops (1/2 scale)
+    assert image.size == ((600, 450) if is_train else (300, 225))
+    assert min(image.size) >= min(decode_size)
+    assert _seeded(transform, image).shape == (3, 224, 224)
@@ -4,6 +4,7 @@ import util_test
 import collections
 import tarfile
 import io
+import torch
 from PIL import Image
 
 from training.data import get_wds_dataset
@@ -147,3 +148,196 @@ def test_two_sources_with_upsampling():
             assert count == pytest.approx(TRAIN_NUM_SAMPLES / 20, RTOL), f'{key}, {count}'
         else:
             assert count == pytest.approx(TRAIN_NUM_SAMPLES / 10, RTOL), f'{key}, {count}'
+
+
+def test_pretokenized_text_store(monkeypatch):
+    """Test webdataset reading captions from an offline pre-tokenized store."""
+    from open_clip import SimpleTokenizer
+    from training.data import PretokenizedTextStore
+    from training.pretokenize import pretokenize_shards
+
+    input_dir = build_inputs('pretokenized_text_store')
+    input_shards = os.path.join(input_dir, 'test_data_000.tar')
+    tokenizer = SimpleTokenizer()
+    store = pretokenize_shards(input_shards, os.path.join(input_dir, 'tokens'), tokenizer, batch_size=4)
+    assert len(store) == 10
+
+    # sample i of shard 000 has caption 000_i
+    expected = {str(i): tokenizer(f'000_{i}')[0] for i in range(10)}
+    for key, tokens in expected.items():
+        assert torch.equal(store[key], tokens)
+
+    # record the key of each looked up sample, the batches only hold (image, text)
+    looked_up = []
+    add_tokens = PretokenizedTextStore.add_tokens
+    monkeypatch.setattr(
+        PretokenizedTextStore, 'add_tokens',
+        lambda self, sample: looked_up.append(sample['__key__']) or add_tokens(self, sample))
+
+    args, preprocess_img, _ = build_params(input_shards)
+    args.workers = 0
+    args.train_num_samples = 100
+    args.train_data_tokens = store.path
+    dataset = get_wds_dataset(args, preprocess_img, is_train=True, tokenizer=tokenizer)
+
+    texts = [text for _, batch_texts in dataset.dataloader for text in batch_texts]
+    assert len(texts) == len(looked_up) == 100
+    for key, text in zip(looked_up, texts):
+        assert torch.equal(text, expected[key])
+
+
+def test_selective_decoding(monkeypatch):
+    """Test only the chosen image of samples passing the sample filters is decoded."""
+    import training.data
+
+    input_dir = os.path.join(util_test.get_data_dirs()[0], 'selective_decoding')
+    os.makedirs(input_dir, exist_ok=True)
+    input_shards = os.path.join(input_dir, 'test_data_000.tar')
+    with tarfile.open(input_shards, 'w') as tar:
+        for sample_idx in range(10):
+            members = {'txt': f'000_{sample_idx}'.encode('utf-8'), 'json': b'{"extra": 1}'}
+            for ext, fmt in (('jpg', 'jpeg'), ('png', 'png')):
+                bio = io.BytesIO()
+                Image.new('RGB', (32, 32)).save(bio, format=fmt)
+                members[ext] = bio.getvalue()
+            for ext, data in members.items():
+                info = tarfile.TarInfo(f'{sample_idx}.{ext}')
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+
+    decoded = []
+    open_image = training.data.open_image
+    monkeypatch.setattr(training.data, 'open_image', lambda fp, *args: decoded.append(fp) or open_image(fp, *args))
+
+    args, preprocess_img, tokenizer = build_params(input_shards)
+    args.val_data = input_shards
+    args.workers = 0
+    even_captions = lambda sample: int(sample['text'].split('_')[1]) % 2 == 0
+    dataset = get_wds_dataset(
+        args, preprocess_img, is_train=False, tokenizer=tokenizer, sample_filters=[even_captions])
+
+    texts = [text for _, batch_texts in dataset.dataloader for text in batch_texts]
+    assert sorted(texts) == [f'000_{i}' for i in range(0, 10, 2)]
+    # one decode per kept sample, the png / json members and the filtered samples are never decoded
+    assert len(decoded) == 5
+
+
+def test_filter_index(monkeypatch):
+    """Test only the samples selected by the filter index are read out of the tar members."""
+    import numpy as np
+    input_dir = build_inputs(test_name='filter_index')
+    input_shards = os.path.join(input_dir, 'test_data_000.tar')
+    # an index of a larger shard pool, w/ a shard that isn't trained on
+    index_path = os.path.join(input_dir, 'index.npz')
+    np.savez(
+        index_path,
+        __key__=np.array([str(i) for i in range(10)] + [f'x{i}' for i in range(5)]),
+        __url__=np.array([input_shards] * 10 + ['/other/test_data_002.tar'] * 5),
+        clip_score=np.concatenate([np.arange(10) / 10, np.ones(5)]),
+        language=np.array(['en', 'de'] * 5 + ['en'] * 5),
+    )
+
+    read_out = []
+    extractfile = tarfile.TarFile.extractfile
+    monkeypatch.setattr(
+        tarfile.TarFile, 'extractfile', lambda self, member: read_out.append(member.name) or extractfile(self, member))
+
+    args, preprocess_img, tokenizer = build_params(input_shards)
+    args.dataset_resampled = False
+    args.workers = 0
+    args.train_num_samples = None
+    args.train_data_filter_index = index_path
+    args.train_data_filter = "language == 'en'"
+    args.train_data_filter_min = {'clip_score': 0.3}
+    dataset = get_wds_dataset(args, preprocess_img, is_train=True, tokenizer=tokenizer)
+    assert dataset.dataloader.num_samples == 3
+
+    texts = [text for _, batch_texts in dataset.dataloader for text in batch_texts]
+    assert sorted(texts) == ['000_4', '000_6', '000_8']
+    # the png and txt member of each selected sample
+    assert len(read_out) == 6
+
+    # w/o the shard of each sample, the number of selected --train-data samples is unknown
+    np.savez(index_path, __key__=np.array([str(i) for i in range(10)]), clip_score=np.arange(10) / 10)
+    args.train_data_filter = None
+    with pytest.raises(AssertionError):
+        get_wds_dataset(args, preprocess_img, is_train=True, tokenizer=tokenizer)
+    args.train_num_samples = 7
+    assert get_wds_dataset(args, preprocess_img, is_train=True, tokenizer=tokenizer).dataloader.num_samples == 7
+
+
+def test_indexed_tar_dataset():
+    """Test the random access dataset over indexed shards reads every sample in a (seed, epoch) fixed order."""
+    from training.data import get_dataset_fn
+    from training.index_tars import index_tar
+
+    input_dir = build_inputs(test_name='indexed_tar')
+    input_shards = os.path.join(input_dir, 'test_data_{000..001}.tar')
+    # an image and a caption member per sample
+    assert index_tar(os.path.join(input_dir, 'test_data_000.tar'), overwrite=True) == 20
+    assert index_tar(os.path.join(input_dir, 'test_data_001.tar'), overwrite=True) == 10
+
+    args, _, tokenizer = build_params(input_shards)
+    preprocess_img = lambda x: torch.zeros(1)  # collated by the torch DataLoader
+    args.rank = 0
+    args.workers = 0
+    args.val_data = input_shards
+    args.val_num_samples = 4
+    get_dataset = get_dataset_fn(input_shards, 'indexed-tar')
+
+    def _texts(data, epoch=0):
+        data.set_epoch(epoch)
+        return [text for _, batch_texts in data.dataloader for text in batch_texts]
+
+    data = get_dataset(args, preprocess_img, is_train=True, tokenizer=tokenizer)
+    assert data.dataloader.num_samples == 15
+    texts = _texts(data)
+    assert sorted(texts) == sorted([f'000_{i}' for i in range(10)] + [f'001_{i}' for i in range(5)])
+    assert texts == _texts(data) and texts != _texts(data, epoch=1)
+
+    # eval subsets are read in shard order
+    data = get_dataset(args, preprocess_img, is_train=False, tokenizer=tokenizer)
+    assert _texts(data) == ['000_0', '000_1', '000_2', '000_3']
+
+
+def test_cli_sample_filters(monkeypatch):
+    """Test the command line caption / metadata filters drop training samples before their image is decoded."""
+    import json
+    import training.data
+
+    input_dir = os.path.join(util_test.get_data_dirs()[0], 'cli_sample_filters')
+    os.makedirs(input_dir, exist_ok=True)
+    input_shards = os.path.join(input_dir, 'test_data_000.tar')
+    with tarfile.open(input_shards, 'w') as tar:
+        for sample_idx in range(10):
+            bio = io.BytesIO()
+            Image.new('RGB', (32, 32)).save(bio, format='png')
+            members = {
+                'png': bio.getvalue(),
+                # 1 word for odd samples, 2 for even ones
+                'txt': ('000 ' * (2 - sample_idx % 2) + str(sample_idx)).encode('utf-8'),
+                'json': json.dumps({'similarity': sample_idx / 10}).encode('utf-8'),
+            }
+            for ext, data in members.items():
+                info = tarfile.TarInfo(f'{sample_idx}.{ext}')
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+
+    decoded = []
+    open_image = training.data.open_image
+    monkeypatch.setattr(training.data, 'open_image', lambda fp, *args: decoded.append(fp) or open_image(fp, *args))
+
+    args = parse_args([
+        '--train-data-caption-min-words', '3', '--train-data-json-min', 'similarity=0.3'])
+    args.train_data = input_shards
+    args.train_num_samples = 3
+    args.seed = 0
+    args.workers = 0
+    args.world_size = 1
+    args.batch_size = 1
+    dataset = get_wds_dataset(args, lambda x: x, is_train=True, tokenizer=lambda x: [x.strip()])
+
+    texts = [text for _, batch_texts in dataset.dataloader for text in batch_texts]
+    assert sorted(texts) == ['000 000 4', '000 000 6', '000 000 8']
+    # only the images of the kept samples are decoded
+    assert len(decoded) == 3
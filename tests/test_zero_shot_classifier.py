@@ -0,0 +1,109 @@
+import os
+
+import pytest
+import torch
+
+from open_clip import CLIP, SimpleTokenizer, build_zero_shot_classifier, get_zero_shot_classifier_cache_key
+
+CLASSNAMES = ['cat', 'dog', 'bird']
+TEMPLATES = ['a photo of a {}.', 'a drawing of a {}.']
+
+
+def _tiny_clip():
+    torch.manual_seed(0)
+    model = CLIP(
+        embed_dim=16,
+        vision_cfg=dict(image_size=32, patch_size=8, width=32, head_width=16, layers=1),
+        text_cfg=dict(context_length=16, width=32, heads=4, layers=1),
+    )
+    return model.eval()
+
+
+def test_zero_shot_classifier_cache(tmp_path):
+    model = _tiny_clip()
+    tokenizer = SimpleTokenizer(context_length=16)
+    expected = build_zero_shot_classifier(model, tokenizer, CLASSNAMES, TEMPLATES)
+
+    classifier = build_zero_shot_classifier(model, tokenizer, CLASSNAMES, TEMPLATES, cache_dir=str(tmp_path))
+    key = get_zero_shot_classifier_cache_key(model, tokenizer, CLASSNAMES, TEMPLATES)
+    assert os.listdir(tmp_path) == [f'{key}.pt']
+    assert torch.equal(classifier, expected)
+
+    # a hit must not run the text tower
+    def _fail(*args, **kwargs):
+        raise AssertionError('text tower used on cache hit')
+    model.encode_text = _fail
+    cached = build_zero_shot_classifier(model, tokenizer, CLASSNAMES, TEMPLATES, cache_dir=str(tmp_path))
+    assert torch.equal(cached, expected)
+
+
+def test_zero_shot_classifier_cache_key():
+    model = _tiny_clip()
+    tokenizer = SimpleTokenizer(context_length=16)
+    key = get_zero_shot_classifier_cache_key(model, tokenizer, CLASSNAMES, TEMPLATES)
+    assert key == get_zero_shot_classifier_cache_key(
+        model, tokenizer, CLASSNAMES, [lambda c: f'a photo of a {c}.', lambda c: f'a drawing of a {c}.'])
+
+    # image tower changes don't invalidate the classifier
+    with torch.no_grad():
+        model.visual.proj.add_(1.)
+    assert key == get_zero_shot_classifier_cache_key(model, tokenizer, CLASSNAMES, TEMPLATES)
+
+    assert key != get_zero_shot_classifier_cache_key(model, tokenizer, CLASSNAMES[:2], TEMPLATES)
+    assert key != get_zero_shot_classifier_cache_key(model, SimpleTokenizer(context_length=12), CLASSNAMES, TEMPLATES)
+    with torch.no_grad():
+        model.text_projection.add_(1.)
+    assert key != get_zero_shot_classifier_cache_key(model, tokenizer, CLASSNAMES, TEMPLATES)
+
+
+def test_zero_shot_classifier_cache_key_text_config():
+    model = _tiny_clip()
+    tokenizer = SimpleTokenizer(context_length=16)
+    key = get_zero_shot_classifier_cache_key(model, tokenizer, CLASSNAMES, TEMPLATES)
+
+    # torch.compile'd models prefix their parameter names w/ '_orig_mod.'
+    compiled = torch.nn.Module()
+    compiled._orig_mod = model
+    assert key == get_zero_shot_classifier_cache_key(compiled, tokenizer, CLASSNAMES, TEMPLATES)
+
+    # pooling and the (non-persistent) causal mask aren't in the state dict
+    pool_type, model.text_pool_type = model.text_pool_type, 'last'
+    assert key != get_zero_shot_classifier_cache_key(model, tokenizer, CLASSNAMES, TEMPLATES)
+    model.text_pool_type = pool_type
+    model.attn_mask = None
+    assert key != get_zero_shot_classifier_cache_key(model, tokenizer, CLASSNAMES, TEMPLATES)
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason='requires CUDA autocast')
+def test_zero_shot_classifier_cache_key_autocast():
+    model = _tiny_clip()
+    tokenizer = SimpleTokenizer(context_length=16)
+    key = get_zero_shot_classifier_cache_key(model, tokenizer, CLASSNAMES, TEMPLATES)
+    with torch.cuda.amp.autocast():
+        amp_key = get_zero_shot_classifier_cache_key(model, tokenizer, CLASSNAMES, TEMPLATES)
+    with torch.cuda.amp.autocast(dtype=torch.bfloat16):
+        bf16_key = get_zero_shot_classifier_cache_key(model, tokenizer, CLASSNAMES, TEMPLATES)
+    assert len({key, amp_key, bf16_key}) == 3
+
+
+@pytest.mark.parametrize("num_classes_per_batch", [1, 2, None])
+def test_bucketed_zero_shot_classifier(num_classes_per_batch):
+    model = _tiny_clip()
+    tokenizer = SimpleTokenizer(context_length=16)
+    classnames = CLASSNAMES + ['cat', 'a very long class name with many words in it']
+    expected = build_zero_shot_classifier(
+        model, tokenizer, classnames, TEMPLATES, num_classes_per_batch=num_classes_per_batch, bucket_prompts=False)
+
+    seq_lens = []
+    encode_text = model.encode_text
+
+    def _encode_text(text, normalize=False):
+        seq_lens.append(text.shape[1])
+        return encode_text(text, normalize=normalize)
+    model.encode_text = _encode_text
+    classifier = build_zero_shot_classifier(
+        model, tokenizer, classnames, TEMPLATES, num_classes_per_batch=num_classes_per_batch)
+
+    assert classifier.shape == expected.shape
+    assert torch.allclose(classifier, expected, atol=1e-5)
+    assert min(seq_lens) < 16